@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Benchmark ulti2kicad on synthetic boards from ddfgen.py.
+
+Parse and emit are timed separately (best of --repeat runs), peak Python memory of each
+phase is measured in an extra run under tracemalloc. Every run is appended as one JSON
+line to the results file and compared to the last recorded run of the same case.
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+import concurrent.futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ulti2kicad
+import ddfgen
+
+# board sizes as multiples of the ddfgen defaults
+CASES = {
+    'small': 1,
+    'medium': 10,
+    'large': 50,
+}
+
+def case_file(name, scale, workdir):
+    """
+    Generate the DDF file of a case once, later runs reuse it.
+    """
+    path = os.path.join(workdir, 'bench_{}.ddf'.format(name))
+    if not os.path.exists(path):
+        counts = {key: value * scale for key, value in ddfgen.DEFAULTS.items()}
+        counts['shapes'] = ddfgen.DEFAULTS['shapes']    # a real board reuses its shapes
+        with open(path, 'w', newline='\n') as out:
+            ddfgen.write_ddf(out, **counts)
+    return path
+
+def parse(path, vectorize, pool=None):
+    return ulti2kicad.parse_ddf(path, vectorize, pool=pool)
+
+def emit(board, pool=None):
+    with open(os.devnull, 'wb') as kicad:
+        ulti2kicad.write_kicad(board, kicad, encoding='utf-8', pool=pool)
+
+def best_time(func, repeat):
+    best = None
+    for i in range(repeat):
+        gc.collect()
+        t = time.perf_counter()
+        result = func()
+        t = time.perf_counter() - t
+        if best is None or t < best:
+            best = t
+    return best, result
+
+def peak_memory(func):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_case(name, path, vectorize, repeat, pool=None, jobs=None):
+    """
+    Time and measure one case, returns the result record. Peak memory is that of the main
+    process only.
+    """
+    parse_s, board = best_time(lambda: parse(path, vectorize, pool), repeat)
+    emit_s, _ = best_time(lambda: emit(board, pool), repeat)
+    parse_peak = peak_memory(lambda: parse(path, vectorize, pool))
+    emit_peak = peak_memory(lambda: emit(board, pool))
+    case = name if vectorize else name + '-nonumpy'
+    return {
+        'case': case + '-j{}'.format(jobs) if pool is not None else case,
+        'bytes': os.path.getsize(path),
+        'segments': len(board.segments),
+        'vias': len(board.vias),
+        'components': len(board.components),
+        'parse_s': round(parse_s, 4),
+        'emit_s': round(emit_s, 4),
+        'parse_peak_mb': round(parse_peak / 1e6, 2),
+        'emit_peak_mb': round(emit_peak / 1e6, 2),
+    }
+
+def load_results(path):
+    results = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    results.append(json.loads(line))
+    return results
+
+def compare(result, previous, threshold):
+    """
+    Print the result next to the previous run of the same case, returns True on a regression.
+    """
+    regressed = False
+    line = "{case:<20} parse {parse_s:8.3f}s {parse_peak_mb:8.1f}MB   emit {emit_s:8.3f}s {emit_peak_mb:8.1f}MB".format(**result)
+    if previous is not None:
+        changes = []
+        for key in ('parse_s', 'emit_s', 'parse_peak_mb', 'emit_peak_mb'):
+            if previous[key]:
+                change = result[key] / previous[key] - 1
+                changes.append("{} {:+.0%}".format(key, change))
+                if change > threshold:
+                    regressed = True
+        line += "   vs {}: {}".format(previous['label'] or previous['time'], ", ".join(changes))
+        if regressed:
+            line += "   REGRESSION"
+    print(line)
+    return regressed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ulti2kicad parse and emit on synthetic DDF boards.')
+    parser.add_argument('cases', nargs='*', default=['small', 'medium'], help='cases to run out of {}, default small medium'.format(', '.join(CASES)))
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='timed runs per phase, the best one counts, default 3')
+    parser.add_argument('-l', '--label', default='', help='name of this run in the results file, e.g. a commit id')
+    parser.add_argument('--results', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl'), help='results file runs get appended to')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'ulti2kicad_bench'), help='where generated boards are kept between runs')
+    parser.add_argument('--nonumpy', action='store_true', default=False, help='also run every case with the plain Python parser')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='parse and format traces and polygons with this many worker processes')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown counted as a regression, default 0.1')
+
+    args = parser.parse_args(argv)
+    os.makedirs(args.workdir, exist_ok=True)
+    previous = {}
+    for record in load_results(args.results):
+        previous[record['case']] = record
+
+    info = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'label': args.label,
+        'python': platform.python_version(),
+        'numpy': ulti2kicad.np.__version__ if ulti2kicad.np is not None else None,
+    }
+    regressions = 0
+    with contextlib.ExitStack() as stack:
+        pool = None
+        if args.jobs is not None and args.jobs > 1:
+            pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs))
+        out = stack.enter_context(open(args.results, 'a'))
+        for name in args.cases:
+            path = case_file(name, CASES[name], args.workdir)
+            modes = [ulti2kicad.np is not None]
+            if args.nonumpy and modes[0]:
+                modes.append(False)
+            for vectorize in modes:
+                result = dict(info, **run_case(name, path, vectorize, args.repeat, pool, args.jobs))
+                regressions += compare(result, previous.get(result['case']), args.threshold)
+                out.write(json.dumps(result) + "\n")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
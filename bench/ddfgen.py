@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Write synthetic UltiBoard 4.80 DDF boards for benchmarking ulti2kicad.
+
+The boards are valid DDF as far as the converter is concerned, the contents are random
+but reproducible for the same seed.
+"""
+
+import sys
+import random
+import argparse
+
+# default record counts of a generated board
+DEFAULTS = {
+    'shapes': 20,
+    'components': 200,
+    'nets': 100,
+    'traces': 2000,
+    'arcs': 200,
+    'polygons': 20,
+    'vias': 500,
+    'texts': 50,
+}
+
+def write_ddf(out, shapes=20, components=200, nets=100, traces=2000, arcs=200, polygons=20,
+              vias=500, texts=50, layers=2, seed=0):
+    """
+    Write a synthetic DDF board to a text stream.
+
+    :param out: Text stream, written as plain ASCII.
+    :param traces: Number of *LT trace records, grouped into blocks of up to 100.
+    :param vias: Number of vias, grouped into *V blocks of up to 50 sharing one x position.
+    :param layers: Number of copper layers.
+    :param seed: Random seed, the same seed gives the same board.
+    """
+    rnd = random.Random(seed)
+    w, h = 12000, 9000      # half the board size in DDF units, about 508 x 381 mm
+
+    def xy():
+        return rnd.randint(-w + 200, w - 200), rnd.randint(-h + 200, h - 200)
+
+    def net():
+        return rnd.randrange(nets) if nets and rnd.random() < 0.9 else 65535
+
+    # header and technology
+    out.write("*P SYNTH\n4 80\n")
+    out.write("{},{},{},{},25,0,{};\n".format(-w, -h, w, h, layers))
+    out.write("(|+|)\n0,0\n0 0 0 0 0 0\n")
+    out.write("*TP FFFF\n")
+    for code, width in enumerate((12, 24, 36, 48)):
+        out.write("*TT {},{},12\n".format(code, width))
+    out.write("*TC 2\n*TD 1,20\n*TD 2,0\n")
+    out.write("*T0 1,30,30,60,30,10,0,0,0,0\n")
+    out.write("*T1 1,30,30,60,30,10,0,0,0,0\n")
+    out.write("*T2 1,40,40,80,40,10,0,0,0,0\n")
+    out.write("*T1 2,20,20,40,10,10,0,0,0,0\n")
+    out.write("*T2 2,20,20,40,10,10,0,0,0,0\n")
+    out.write("*TS 0,0\n")
+
+    # shapes, the board outline first
+    out.write("*SBOARD\n0 0 0 0 0 0\n0 0 0 0 0 0\n0.0\n")
+    out.write("{},{},{},{},{},{},{},{},{},{};\n;\n;\n".format(-w - 1, -h, w, -h, w, h, -w, h, -w, -h))
+    pins = []
+    for s in range(shapes):
+        npins = rnd.choice((2, 3, 8, 14, 16))
+        th = s % 2 == 0
+        bw, bh = 50 * npins + 60, 160
+        out.write("*SSHP{}\n0 {} 60 0 50 5\n0 -{} 60 0 50 5\n1.5\n".format(s, bh, bh))
+        out.write("{},{},{},{},{},{},{},{},{},{};\n".format(-bw - 1, -bh, bw, -bh, bw, bh, -bw, bh, -bw, -bh))
+        for p in range(npins):
+            x = -bw + 60 + 100 * (p // 2)
+            y = -100 if p % 2 == 0 else 100
+            if th:
+                line = "1,0,FFFFFFFF,{},{},{}".format(x, y, p + 1)
+            else:
+                line = "2,{},1,{},{},{}".format(rnd.choice((0, 90 * 64)), x, y, p + 1)
+            out.write(line + (";\n" if p == npins - 1 else ",\n"))
+        out.write("{},{},30,0,{};\n".format(-bw + 40, 0, rnd.choice((11520, 23040))))
+        pins.append((npins, th))
+
+    for n in range(nets):
+        out.write("*N \"N{}\" 0 0 0 0 0 0 0 2;\n".format(n))
+
+    for c in range(components if shapes else 0):
+        s = rnd.randrange(shapes)
+        npins, th = pins[s]
+        x, y = xy()
+        out.write("*C U{} /V{} SHP{}\n".format(c, c % 97, s))
+        out.write("{},{},{},0,100,0,60,50,5,0,-100,0,60,50,5\n".format(x, y, rnd.choice((0, 5760, 11520, 17280))))
+        out.write("0,0,0.000,0.000,0.000,0.000,0\n")
+        pairs = ["{} {}".format(net(), 'T' if th else 0) for p in range(npins)]
+        for i in range(0, len(pairs), 8):
+            out.write(" ".join(pairs[i:i + 8]) + "\n")
+        out.write(";\n")
+
+    # traces in blocks sharing layer and first coordinate
+    left = traces
+    while left > 0:
+        rows = min(left, rnd.randint(1, 100))
+        left -= rows
+        out.write("*LT {} {}\n".format(rnd.randint(1, layers), rnd.randint(-h + 200, h - 200)))
+        for r in range(rows):
+            a = rnd.randint(-h + 200, h - 400)
+            out.write("{} {} {} {} 0 {}".format(a, a + rnd.randint(10, 200), net(), rnd.randrange(4),
+                                                 rnd.choice((1, 1, 2, 2, 4, 8))))
+            out.write(";\n" if r == rows - 1 else "\n")
+
+    for a in range(arcs):
+        x, y = xy()
+        out.write("*LA {} {} {} {} {} {} {} {} 0\n".format(rnd.choice((10, 1, layers)), x, y, rnd.randint(20, 500),
+                                                        rnd.randrange(23040), rnd.randint(64, 23040), net(),
+                                                        rnd.randrange(4)))
+
+    for p in range(polygons):
+        cx, cy = xy()
+        r = rnd.randint(100, 1500)
+        corners = [(max(-w, min(w, cx + dx * r)), max(-h, min(h, cy + dy * r))) for dx, dy in ((-1, -1), (1, -1), (1, 1), (-1, 1))]
+        out.write("*LP {} {} 0 0 0 20 0\n".format(rnd.randint(1, layers), net()))
+        out.write(" ".join("{} {}".format(*c) for c in corners[:3]) + "\n")
+        out.write("{} {}:\n".format(*corners[3]))
+
+    left = vias
+    while left > 0:
+        rows = min(left, rnd.randint(1, 50))
+        left -= rows
+        out.write("*V {}\n".format(rnd.randint(-w + 200, w - 200)))
+        for r in range(rows):
+            out.write("{} {} 1 0 0 0 0 0".format(rnd.randint(-h + 200, h - 200), net()))
+            out.write(";\n" if r == rows - 1 else "\n")
+
+    for t in range(texts):
+        x, y = xy()
+        out.write("*X {} {} 60 50 5 {} {} Text {}\n".format(x, y, rnd.choice((0, 5760)), rnd.choice((0, 2)), t))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic UltiBoard DDF board.')
+    parser.add_argument('outfile', help='output file, - for stdout')
+    for name, default in DEFAULTS.items():
+        parser.add_argument('--' + name, type=int, default=default, help='number of {}, default {}'.format(name, default))
+    parser.add_argument('--layers', type=int, default=2, help='number of copper layers, default 2')
+    parser.add_argument('--seed', type=int, default=0, help='random seed, default 0')
+
+    args = vars(parser.parse_args(argv))
+    outfile = args.pop('outfile')
+    if outfile == '-':
+        write_ddf(sys.stdout, **args)
+    else:
+        with open(outfile, 'w', newline='\n') as out:
+            write_ddf(out, **args)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
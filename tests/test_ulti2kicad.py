@@ -0,0 +1,430 @@
+import concurrent.futures
+import fractions
+import io
+import os
+import random
+import re
+import struct
+import subprocess
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bench'))
+
+import ulti2kicad
+import ddfgen
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SMALL = os.path.join(DATA, 'small.ddf')
+
+def golden(name='small.kicad_pcb'):
+    with open(os.path.join(DATA, name), 'rb') as f:
+        return f.read()
+
+def convert_to_bytes(board, **options):
+    out = io.BytesIO()
+    ulti2kicad.write_kicad(board, out, encoding='utf-8', **options)
+    return out.getvalue()
+
+def test_parse_and_write_match_golden_output():
+    assert convert_to_bytes(ulti2kicad.parse_ddf(SMALL)) == golden()
+    with open(SMALL, 'rb') as f:
+        board = ulti2kicad.parse_ddf(f)
+    text = io.StringIO()
+    ulti2kicad.write_kicad(board, text)
+    assert text.getvalue().encode('utf-8') == golden()
+
+def test_cli_matches_golden_output(tmp_path):
+    out = str(tmp_path / 'small.kicad_pcb')
+    assert ulti2kicad.main([SMALL, out]) == 0
+    with open(out, 'rb') as f:
+        assert f.read() == golden()
+
+def board_with_segments(*segments):
+    board = ulti2kicad.Board()
+    for seg in segments:
+        board.segments.append(*seg)
+    return board
+
+def test_merge_diagonal_run():
+    # three touching 45 degree segments on B.Cu, the ends rounded to nm on their own
+    v2nm = ulti2kicad.v2nm
+    pts = [(v2nm(x), v2nm(x + 4)) for x in (7, 80, 151, 226)]
+    board = board_with_segments(*[(x1, y1, x2, y2, 1, 2, 5) for (x1, y1), (x2, y2) in zip(pts, pts[1:])])
+    assert ulti2kicad.merge_segments(board) == 2
+    assert list(board.segments) == [(pts[0][0], pts[0][1], pts[3][0], pts[3][1], 1, 2, 5)]
+
+def test_merge_keeps_bends():
+    v2nm = ulti2kicad.v2nm
+    board = board_with_segments((0, 0, v2nm(100), v2nm(100), 1, 2, 5),
+                                (v2nm(100), v2nm(100), v2nm(200), v2nm(101), 1, 2, 5))
+    assert ulti2kicad.merge_segments(board) == 0
+
+def write_board(path, **counts):
+    with open(path, 'w', newline='\n') as out:
+        ddfgen.write_ddf(out, **counts)
+    return str(path)
+
+def test_truncated_index_is_rebuilt(tmp_path):
+    path = write_board(tmp_path / 'b.ddf', shapes=3, components=10, traces=50, vias=20)
+    with open(path, 'rb') as f:
+        data = f.read()
+    index = ulti2kicad.RecordIndex.for_file(path, data)
+    size = os.path.getsize(path + '.idx')
+    with open(path + '.idx', 'r+b') as f:
+        f.truncate(size - 8)
+    again = ulti2kicad.RecordIndex.for_file(path, data)
+    assert again.kinds == index.kinds and list(again.y1) == list(index.y1)
+    assert os.path.getsize(path + '.idx') == size
+
+def test_arc_shorts_another_net():
+    board = board_with_segments((0, 0, 1000000, 0, 0, 1, 1))
+    board.traceWidth[0] = 12
+    board.nets.update({1: 'A', 2: 'B'})
+    board.arcs.append((1000000, 0, 1500000, 500000, 2000000, 0, 254000, 1, 2, 0))
+    assert [short[:2] for short in ulti2kicad.check_connectivity(board).shorts] == [('A', 'B')]
+
+def test_arc_too_close_to_another_net():
+    board = board_with_segments((0, 0, 2000000, 0, 0, 1, 1))
+    board.traceWidth[0] = 12
+    board.traceClearance[0] = 12
+    board.nets.update({1: 'A', 2: 'B'})
+    # 0.2 mm apart, both 0.254 mm wide, clearance 0.254 mm
+    board.arcs.append((0, 454000, 1000000, 454000, 2000000, 454000, 254000, 1, 2, 0))
+    assert [v[:2] for v in ulti2kicad.check_clearance(board).violations] == [('A', 'B')]
+
+def test_copper_layers_clamped_to_layer_table():
+    board = board_with_segments((0, 0, 1000000, 0, 0, 1, 1))
+    board.maxlayers = 16
+    assert ulti2kicad.copper_numbers(board.maxlayers) == (1, 2, 3, 4)
+    assert ulti2kicad.check_connectivity(board).islands == 1
+    assert ulti2kicad.fill_zones(board) == 0
+
+def board_with_shape(name, code):
+    # a two pin through hole shape whose pads use pad code code of the technology table
+    board = ulti2kicad.Board()
+    stack = board.padstack[code]
+    stack.top = stack.inner = stack.bottom = ulti2kicad.PadDef(30, 30, 60, 30, 10)
+    stack.drill = ulti2kicad.v2nm(20)
+    pads = [ulti2kicad.Pad(str(p + 1), code, 0, 0, 1270000 * p, 0, stack) for p in range(2)]
+    board.shapes[name] = ulti2kicad.Shape(name, (0, -1000000, 0), [(0, 0, 1000000, 0)], pads, [], [])
+    return board
+
+def test_library_ignores_pad_codes_and_names(tmp_path):
+    library = ulti2kicad.FootprintLibrary(str(tmp_path / 'test.pretty'))
+    assert library.add_board(board_with_shape('DIP2', 1)) == (1, 0)
+    other = board_with_shape('CONN2', 7)
+    assert library.add_board(other) == (0, 1)
+    lib_id = other.shapes['CONN2'].template.lib_id
+    assert lib_id.startswith('test:DIP2_') and len(lib_id) == len('test:DIP2_') + library.HASH_DIGITS
+    assert os.listdir(library.directory) == [lib_id.split(':')[1] + '.kicad_mod']
+
+def test_library_without_hard_links(tmp_path, monkeypatch):
+    def link(src, dst):
+        raise PermissionError(1, "Operation not permitted")
+    monkeypatch.setattr(os, 'link', link)
+    library = ulti2kicad.FootprintLibrary(str(tmp_path / 'test.pretty'))
+    board = board_with_shape('A/B:C', 1)
+    assert library.add_board(board) == (1, 0)
+    assert library.add_board(board_with_shape('D', 1)) == (0, 1)
+    fpname = board.shapes['A/B:C'].template.lib_id.split(':')[1]
+    assert fpname.startswith('A_B_C_')
+    assert os.listdir(library.directory) == [fpname + '.kicad_mod']
+
+def test_library_keeps_one_name_per_geometry(tmp_path, monkeypatch):
+    library = ulti2kicad.FootprintLibrary(str(tmp_path / 'test.pretty'))
+    link = os.link
+    def racing_link(src, dst):
+        # another worker adds the same geometry under an earlier name at the same time
+        digest = os.path.splitext(dst)[0].rpartition('_')[2]
+        with open(os.path.join(library.directory, 'AAA_' + digest + '.kicad_mod'), 'w') as f:
+            f.write("(footprint)\n")
+        link(src, dst)
+    monkeypatch.setattr(os, 'link', racing_link)
+    board = board_with_shape('DIP2', 1)
+    assert library.add_board(board) == (0, 1)
+    fpname = board.shapes['DIP2'].template.lib_id.split(':')[1]
+    assert fpname.startswith('AAA_')
+    assert os.listdir(library.directory) == [fpname + '.kicad_mod']
+
+def test_batch_reports_a_bad_file_and_converts_the_rest(tmp_path, capsys):
+    indir = tmp_path / 'in'
+    (indir / 'sub').mkdir(parents=True)
+    with open(SMALL, 'rb') as f:
+        (indir / 'good.ddf').write_bytes(f.read())
+    (indir / 'sub' / 'bad.ddf').write_bytes(b"*C R1 /x NOPE\n1,2\n")
+    results = ulti2kicad.convert_batch(str(indir), str(tmp_path / 'out'), jobs=1)
+    assert [(os.path.basename(infile), ok) for infile, outfile, ok, error in results] == [('good.ddf', True), ('bad.ddf', False)]
+    assert results[1][3]
+    with open(results[0][1], 'rb') as f:
+        assert f.read() == golden()
+    assert "FAILED" in capsys.readouterr().out
+
+@pytest.mark.parametrize('newline', [b'\n', b'\r\n'])
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 1000, 1 << 20])
+def test_stream_records_match_memory_records(chunk_size, newline):
+    with open(SMALL, 'rb') as f:
+        data = b'leading junk\n' + f.read().replace(b'\n', newline)
+    expected = list(ulti2kicad.tokenize_ddf(data))
+    assert len(expected) == len(list(ulti2kicad.record_spans(data)))
+    assert list(ulti2kicad.tokenize_ddf(io.BytesIO(data), chunk_size)) == expected
+
+def test_crlf_input_converts_like_lf():
+    with open(SMALL, 'rb') as f:
+        data = f.read()
+    assert convert_to_bytes(ulti2kicad.parse_ddf(data.replace(b'\n', b'\r\n'))) == golden()
+
+def test_batch_messages_come_from_the_parent(tmp_path, capfd):
+    indir = tmp_path / 'in'
+    indir.mkdir()
+    for name in ('a.ddf', 'b.ddf'):
+        with open(SMALL, 'rb') as f:
+            (indir / name).write_bytes(f.read())
+    results = ulti2kicad.convert_batch(str(indir), str(tmp_path / 'out'), jobs=2, merge=True, layers={'F.Cu'})
+    assert all(ok for infile, outfile, ok, error in results)
+    lines = capfd.readouterr().out.splitlines()
+    # every file's messages follow its own ok line, nothing printed by the workers
+    for i, line in enumerate(lines):
+        if line.startswith("ok "):
+            assert lines[i + 1].startswith("selected ") and lines[i + 2].startswith("merged away ")
+    assert len(lines) == 6
+
+@pytest.mark.parametrize('jobs', [[], ['-j', '2']])
+def test_stdin_to_stdout_matches_files(tmp_path, jobs):
+    script = os.path.join(os.path.dirname(SMALL), '..', '..', 'ulti2kicad.py')
+    out = str(tmp_path / 'small.kicad_pcb')
+    assert ulti2kicad.main([SMALL, out, '-m']) == 0
+    with open(SMALL, 'rb') as f:
+        run = subprocess.run([sys.executable, script, '-', '-', '-m'] + jobs, stdin=f, capture_output=True, check=True)
+    with open(out, 'rb') as f:
+        assert run.stdout == f.read()
+    assert run.stderr.decode().startswith("merged away ")
+
+@pytest.mark.parametrize('order', [(0, 1, 2), (1, 0, 2), (0, 2, 1), (2, 1, 0)])
+def test_short_through_no_connect_copper(order):
+    # net A touches a no connect trace which touches net B
+    chain = [(0, 0, 1000000, 0, 0, 1, 1), (1000000, 0, 2000000, 0, 0, 1, 0), (2000000, 0, 3000000, 0, 0, 1, 2)]
+    board = board_with_segments(*[chain[i] for i in order])
+    board.traceWidth[0] = 12
+    board.nets.update({1: 'A', 2: 'B'})
+    result = ulti2kicad.check_connectivity(board)
+    assert result.islands == 1
+    assert [short[:2] for short in result.shorts] == [('A', 'B')]
+
+def distance_to_polyline(p, line):
+    best = float('inf')
+    for (ax, ay), (bx, by) in zip(line, line[1:]):
+        dx, dy = bx - ax, by - ay
+        t = max(0, min(1, ((p[0] - ax) * dx + (p[1] - ay) * dy) / (dx * dx + dy * dy))) if dx or dy else 0
+        best = min(best, ((ax + t * dx - p[0]) ** 2 + (ay + t * dy - p[1]) ** 2) ** 0.5)
+    return best
+
+@pytest.mark.parametrize('with_numpy', [True, False])
+def test_simplify_polyline_keeps_ends_and_tolerance(monkeypatch, with_numpy):
+    if not with_numpy:
+        monkeypatch.setattr(ulti2kicad, 'np', None)
+    rnd = random.Random(3)
+    pts = [(x * 1000, rnd.randint(-400, 400) + (x % 17) * 300) for x in range(200)]
+    for tolerance in (100, 500, 2000):
+        kept = ulti2kicad.simplify_polyline(pts, tolerance)
+        assert kept[0] == pts[0] and kept[-1] == pts[-1]
+        assert kept == [p for p in pts if p in kept]     # a subsequence in order
+        assert len(kept) < len(pts)
+        assert all(distance_to_polyline(p, kept) <= tolerance for p in pts)
+
+def test_simplify_ring_leaves_degenerate_rings_alone():
+    triangle = [(0, 0), (1000, 0), (0, 1000)]
+    assert ulti2kicad.simplify_ring(triangle, 10) == triangle
+    assert ulti2kicad.simplify_ring(triangle + [(0, 0)], 10) == triangle
+    # all points on one line would leave fewer than three
+    flat = [(0, 0), (1000, 1), (2000, 0), (3000, 1)]
+    assert ulti2kicad.simplify_ring(flat, 10) == flat
+    square = [(0, 0), (500, 1), (1000, 0), (1000, 1000), (0, 1000)]
+    assert ulti2kicad.simplify_ring(square, 10) == [(0, 0), (1000, 0), (1000, 1000), (0, 1000)]
+    assert ulti2kicad.simplify_ring(square, 0) == square
+
+@pytest.mark.parametrize('val, div, nm, mm', [
+    (0, 1, 0, '0'),
+    (1, 1, 21167, '0.021167'),
+    (-1, 1, -21167, '-0.021167'),
+    (6, 1, 127000, '0.127'),
+    (-6, 1, -127000, '-0.127'),
+    (123456, 1, 2613152000, '2613.152'),
+    (3, 10, 6350, '0.00635'),
+    (1, 10, 2117, '0.002117'),
+    (-1, 10, -2117, '-0.002117'),
+    (7, 100, 1482, '0.001482'),
+    (-7, 100, -1482, '-0.001482'),
+    (-123456, 100, -26131520, '-26.13152'),
+])
+def test_v2nm_and_fmt_nm(val, div, nm, mm):
+    assert ulti2kicad.v2nm(val, div) == nm
+    assert ulti2kicad.fmt_nm(nm) == mm
+    if ulti2kicad.np is not None:
+        assert int(ulti2kicad.v2nm_np(ulti2kicad.np.array([val]), div)[0]) == nm
+
+@pytest.mark.parametrize('div', [1, 10, 100])
+def test_v2nm_rounds_to_nearest(div):
+    for val in range(-1000, 1001):
+        exact = fractions.Fraction(val * 127000, 6 * div)
+        assert abs(ulti2kicad.v2nm(val, div) - exact) <= fractions.Fraction(1, 2)
+
+@pytest.mark.parametrize('nm, mm', [
+    (1, '0.000001'), (-1, '-0.000001'), (500000, '0.5'), (1000000, '1'),
+    (-1500000, '-1.5'), (999999, '0.999999'), (-20000000, '-20'),
+])
+def test_fmt_nm(nm, mm):
+    assert ulti2kicad.fmt_nm(nm) == mm
+
+@pytest.mark.parametrize('vectorize', [True, False])
+def test_parallel_parse_matches_sequential(vectorize):
+    if vectorize and ulti2kicad.np is None:
+        pytest.skip("needs NumPy")
+    with open(SMALL, 'rb') as f:
+        data = f.read()
+    # a vector before the traces, the sequential parser keeps it first without NumPy
+    first = data.index(b'\n*LT ') + 1
+    data = data[:first] + b'*LV 2 10 20 300 400 3 0 0\n' + data[first:]
+    board = ulti2kicad.parse_ddf(data, vectorize)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as pool:
+        for part_size in (1, None):
+            parallel = ulti2kicad.parse_parallel(data, pool, vectorize, part_size=part_size)
+            assert list(parallel.segments) == list(board.segments)
+            assert convert_to_bytes(parallel) == convert_to_bytes(board)
+
+def stats_rows(text):
+    # record, count, bytes and objects of every --stats table row
+    return [line.split()[:4] for line in text.splitlines() if line.startswith(('*', 'total'))]
+
+def test_cache_round_trip(tmp_path, capsys):
+    cache_dir = str(tmp_path / 'cache')
+    runs = []
+    for name in ('first.kicad_pcb', 'second.kicad_pcb'):
+        out = str(tmp_path / name)
+        assert ulti2kicad.main([SMALL, out, '--cache', '--cache-dir', cache_dir, '-s']) == 0
+        with open(out, 'rb') as f:
+            assert f.read() == golden()
+        runs.append(capsys.readouterr().out)
+    assert len(os.listdir(cache_dir)) == 1
+    assert "parsed board taken from the cache" in runs[1]
+    assert stats_rows(runs[1]) == stats_rows(runs[0])
+    assert stats_rows(runs[1])[-1][1] != '0'
+
+@pytest.mark.parametrize('size', [0, 8, 9, 11, 12, 40])
+def test_truncated_cache_file_is_ignored(tmp_path, size):
+    cache = ulti2kicad.BoardCache(str(tmp_path))
+    with open(SMALL, 'rb') as f:
+        key = cache.key(f.read())
+    cache.store(key, ulti2kicad.parse_ddf(SMALL))
+    assert cache.load(key) is not None
+    with open(cache.path(key), 'r+b') as f:
+        f.truncate(size)
+    assert cache.load(key) is None
+
+class Serialized:
+    # stands in for a compiled template, format() writes the tree with the values in its Slots
+    def __init__(self, node, indent, depth):
+        self.node, self.indent, self.depth = node, indent, depth
+
+    def format(self, *values):
+        values = iter(values)
+
+        def atom(value):
+            if not isinstance(value, ulti2kicad.Slot):
+                return ' ' + str(value)
+            if value.nodes:
+                return str(next(values))
+            return ' "{}"'.format(next(values)) if value.quoted else ' {}'.format(next(values))
+
+        text = ''.join(self.node.tokens(self.indent, self.depth, atom))
+        assert next(values, None) is None
+        return text
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_footprint_templates_match_serialized_tree(monkeypatch, indent):
+    board = ulti2kicad.parse_ddf(SMALL)
+    for shape in board.shapes.values():
+        shape.name += '{0}'     # literal text, has to be escaped in the template
+    font = 'Mono {x}'
+
+    def outputs():
+        footprints = []
+        for comp in board.components:
+            template = ulti2kicad.FootprintTemplate(board.shapes[comp.shape])
+            footprints.append(template.render(comp, board.nets, font, indent))
+            footprints.append(template.library_footprint(comp.shape, font, indent or 2))
+        return footprints
+
+    compiled = outputs()
+    monkeypatch.setattr(ulti2kicad.SExpression, 'template', lambda node, indent=None, depth=0: Serialized(node, indent, depth))
+    assert compiled == outputs()
+    assert any("thru_hole" in text for text in compiled) and any(" smd " in text for text in compiled)
+    assert any("B.Cu" in text for text in compiled) and all("{0}" in text and "{x}" in text for text in compiled)
+
+@pytest.mark.skipif(ulti2kicad.np is None, reason="needs NumPy")
+def test_fill_flag_before_infile(tmp_path):
+    outputs = []
+    for args in (['--fill'], ['-fz', '--fill-resolution', '0.2']):
+        out = str(tmp_path / 'filled.kicad_pcb')
+        assert ulti2kicad.main(args + [SMALL, out]) == 0
+        with open(out, 'rb') as f:
+            outputs.append(f.read())
+    assert b'(filled_polygon' in outputs[0] and b'(filled_polygon' in outputs[1]
+    assert outputs[0] != outputs[1]
+
+@pytest.mark.parametrize('variant', ['plain', 'lone semicolon', 'crlf'])
+def test_catalog_counts_match_parser(tmp_path, variant):
+    path = write_board(tmp_path / 'b.ddf', shapes=4, components=20, nets=10, traces=300, arcs=0, polygons=5, vias=120)
+    with open(path, 'rb') as f:
+        data = f.read()
+    if variant == 'lone semicolon':
+        # the last row of a trace or via block followed by a line with just the ';'
+        data = re.sub(rb'(?m)^((?:-?\d+ ){5,7}-?\d+);$', rb'\1\n;', data)
+    elif variant == 'crlf':
+        data = data.replace(b'\n', b'\r\n')
+    with open(path, 'wb') as f:
+        f.write(data)
+    info = ulti2kicad.scan_header(path)
+    board = ulti2kicad.parse_ddf(path)
+    assert (info['traces'], info['vias']) == (300, 120) == (len(board.segments), len(board.vias))
+    assert (info['shapes'], info['components'], info['nets'], info['zones']) == \
+        (len(board.shapes), len(board.components), len(board.nets) - 1, len(board.zones))
+
+@pytest.mark.skipif(ulti2kicad.np is None, reason="needs NumPy")
+def test_thumbnail_draws_copper_vias_and_outline(tmp_path):
+    mm = 1000000
+    corners = [(0, 0), (20 * mm, 0), (20 * mm, 10 * mm), (0, 10 * mm)]
+    board = board_with_segments((2 * mm, 3 * mm, 12 * mm, 3 * mm, 1, 1, 1),     # F.Cu
+                                (16 * mm, 1 * mm, 16 * mm, 6 * mm, 1, 2, 2))    # B.Cu
+    board.traceWidth[1] = 60
+    board.shapes['BOARD'] = ulti2kicad.Shape('BOARD', (0, 0, 0), [a + b for a, b in zip(corners, corners[1:] + corners[:1])], [], [], [])
+    board.padstack[3].top = ulti2kicad.PadDef(y=60)
+    board.vias.append(6 * mm, 8 * mm, 3, 0)
+
+    image = ulti2kicad.render_thumbnail(board, 200)
+    assert image.dtype == ulti2kicad.np.uint8 and image.shape == (102, 200, 3)
+    scale = 20 * mm / (200 - 4)
+
+    def pixel(x, y):
+        return tuple(image[int(y / scale) + 2, int(x / scale) + 2])
+
+    colours = ulti2kicad.THUMBNAIL_COLOURS
+    assert pixel(7 * mm, 3 * mm) == colours['F.Cu']
+    assert pixel(16 * mm, 4 * mm) == colours['B.Cu']
+    assert pixel(6 * mm, 8 * mm) == colours['via']
+    assert pixel(10 * mm, 0) == colours['outline']
+    assert pixel(7 * mm, 6 * mm) == colours['background']
+
+    path = str(tmp_path / 'board.png')
+    ulti2kicad.write_png(path, image)
+    with open(path, 'rb') as f:
+        png = f.read()
+    assert png[:8] == b'\x89PNG\r\n\x1a\n' and png[12:16] == b'IHDR'
+    assert struct.unpack('>II', png[16:24]) == (200, 102)
+    size, = struct.unpack('>I', png[33:37])
+    assert png[37:41] == b'IDAT'
+    raw = zlib.decompress(png[41:41 + size])
+    assert raw == b''.join(b'\0' + row.tobytes() for row in image)
@@ -1,9 +1,30 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import array as arr
 import math
 import argparse
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import io
+import itertools
+import json
+import mmap
+import pickle
+import re
+import sqlite3
+import struct
+import time
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 header = """(kicad_pcb (version 20221018) (generator ulti2kicad)
 
@@ -86,122 +107,356 @@ class Shape:
         self.pads = pads
         self.arcs = arcs
         self.circles = circles
+        self.template = None        # FootprintTemplate, compiled on first use
 
     def __str__(self):
         return f"KiCadFootprint({self.name}, {self.reference}, Pads: {len(self.pads)})"
 
 class Pad:
-    def __init__(self,kind,x,y,w,h,drill_size,layer):
-        self.kind = kind
+    """
+    One pin of a shape, the pad geometry comes from the PadStack of its pad code.
+    """
+    __slots__ = ('name', 'code', 'rot', 'layer', 'x', 'y', 'stack')
+
+    def __init__(self,name,code,rot,layer,x,y,stack):
+        self.name = name
+        self.code = code
+        self.rot = rot
+        self.layer = layer
         self.x = x
         self.y = y
-        self.w = w
-        self.h = h
-        self.drill_size
+        self.stack = stack
+
+class PadDef:
+    """
+    A pad definition of one layer (*T0, *T1 or *T2 record), converted to integer nm.
+    """
+    __slots__ = ('x1', 'x2', 'y', 'radius', 'clear', 'horz', 'vert', 'thermh', 'thermv', 'width', 'roundratio')
+
+    def __init__(self,x1=0,x2=0,y=0,radius=0,clear=0,horz=0,vert=0,thermh=0,thermv=0):
+        self.x1 = v2nm(x1)
+        self.x2 = v2nm(x2)
+        self.y = v2nm(y)
+        self.radius = v2nm(radius)
+        self.clear = v2nm(clear)
+        self.horz = v2nm(horz)
+        self.vert = v2nm(vert)
+        self.thermh = v2nm(thermh)
+        self.thermv = v2nm(thermv)
+        self.width = v2nm(x1 + x2)
+        self.roundratio = self.radius / self.y if self.y != 0 else 0
+
+class PadStack:
+    """
+    Top, inner and bottom pad definitions plus drill of one pad code.
+    differs is set when the bottom pad has another size than the top one.
+    """
+    __slots__ = ('top', 'inner', 'bottom', 'drill', 'differs')
+
+    def __init__(self):
+        self.top = PadDef()
+        self.inner = self.top
+        self.bottom = self.top
+        self.drill = 0
+        self.differs = False
+
+    def update(self):
+        top, bottom = self.top, self.bottom
+        self.differs = (top.x1, top.x2, top.y) != (bottom.x1, bottom.x2, bottom.y)
+
+class Component:
+    def __init__(self,name,alias,shape,pos,nameref,aliasref,pnpairs):
+        self.name = name
+        self.alias = alias
+        self.shape = shape
+        self.pos = pos              # (x, y, rot)
+        self.nameref = nameref      # (x, y, rot, height, width, thickness)
+        self.aliasref = aliasref    # (x, y, rot, height, width, thickness)
+        self.pnpairs = pnpairs      # [[kicad net, pad setting], ...] per pin
+
+class Zone:
+    def __init__(self,net,layer,clearance,pts):
+        self.net = net
         self.layer = layer
+        self.clearance = clearance
+        self.pts = pts
+        self.filled = []            # filled polygons from fill_zones()
 
-class SExpression:
-    def __init__(self, name, subvalues=None):
+class Text:
+    def __init__(self,text,x,y,height,width,thickness,rot,layer):
+        self.text = text
+        self.x = x
+        self.y = y
+        self.height = height
+        self.width = width
+        self.thickness = thickness
+        self.rot = rot
+        self.layer = layer
+
+class SegmentTable:
+    """
+    Struct of arrays holding all straight copper segments (*LT and *LV records).
+    Coordinates are integer nm, the width is kept as DDF trace code and resolved through
+    Board.traceWidth when needed.
+    """
+    columns = ('x1', 'y1', 'x2', 'y2', 'code', 'layer', 'net')
+    typecodes = ('q', 'q', 'q', 'q', 'H', 'B', 'i')
+
+    def __init__(self):
+        for name, typecode in zip(self.columns, self.typecodes):
+            setattr(self, name, arr.array(typecode))
+
+    def append(self, x1, y1, x2, y2, code, layer, net):
+        self.x1.append(x1)
+        self.y1.append(y1)
+        self.x2.append(x2)
+        self.y2.append(y2)
+        self.code.append(code)
+        self.layer.append(layer)
+        self.net.append(net)
+
+    def extend_np(self, *cols):
         """
-        Initialize the S-Expression object.
-        
-        :param name: The name of the S-Expression (symbol).
-        :param subvalues: A list of subvalues which can be key-value pairs, another S-Expression object,
-                          or simple strings/integers.
+        Append whole NumPy columns, in the order of SegmentTable.columns.
         """
-        self.name = name
-        self.subvalues = subvalues if subvalues is not None else []
+        for name, typecode, col in zip(self.columns, self.typecodes, cols):
+            getattr(self, name).frombytes(np.ascontiguousarray(col, dtype=typecode).tobytes())
 
-    def add_subvalue(self, key, value):
+    def extend(self, other):
         """
-        Add a key-value pair as a subvalue to the S-Expression.
-        
-        :param key: The key of the pair.
-        :param value: The value of the pair.
+        Append all rows of another table of the same kind.
         """
-        self.subvalues.append((key, value))
+        for name in self.columns:
+            getattr(self, name).extend(getattr(other, name))
 
-    def add_subexpression(self, subexpression):
+    def slice(self, start, stop):
         """
-        Add a subexpression or simple value (string/int) as a subvalue.
-        
-        :param subexpression: Another S-Expression object or a simple string/int.
+        Return the columns of rows start to stop as a list of arrays.
         """
-        if isinstance(subexpression, (SExpression, str, int, float)):
-            self.subvalues.append(subexpression)
-        else:
-            raise ValueError("Subexpression should be an SExpression, string, or integer")
+        return [getattr(self, name)[start:stop] for name in self.columns]
 
-    def add_arbitrary_subexpression(self, name, *values):
+    def to_np(self):
         """
-        Add a subexpression with an arbitrary number of values.
-        
-        :param name: The name of the subexpression.
-        :param values: A variable number of values which can be strings, integers, key-value pairs, or S-Expression objects.
+        Return the columns as a dict of NumPy arrays sharing the table memory.
         """
-        subexpr = SExpression(name)
-        for value in values:
-            if isinstance(value, tuple):
-                # If it's a key-value pair (tuple), add as subvalue
-                subexpr.add_subvalue(*value)
-            else:
-                # Otherwise, add as a simple value or subexpression
-                subexpr.add_subexpression(value)
-        self.subvalues.append(subexpr)
+        return {name: np.frombuffer(getattr(self, name), dtype=typecode)
+                for name, typecode in zip(self.columns, self.typecodes)}
+
+    def nbytes(self):
+        return sum(len(getattr(self, name)) * getattr(self, name).itemsize for name in self.columns)
+
+    def __len__(self):
+        return len(self.x1)
+
+    def __iter__(self):
+        return zip(*(getattr(self, name) for name in self.columns))
+
+class ViaTable(SegmentTable):
+    """
+    Struct of arrays holding all vias, coordinates in integer nm. Size and drill are looked up
+    from the pad code in Board.padstack.
+    """
+    columns = ('x', 'y', 'code', 'net')
+    typecodes = ('q', 'q', 'B', 'i')
+
+    def append(self, x, y, code, net):
+        self.x.append(x)
+        self.y.append(y)
+        self.code.append(code)
+        self.net.append(net)
+
+    def __len__(self):
+        return len(self.x)
+
+class Board:
+    """
+    Parsed contents of a DDF file, coordinates and sizes already converted to integer KiCad
+    nanometres, nets to KiCad net numbers.
+    Produced by parse_ddf() and consumed by write_kicad().
+    """
+    def __init__(self):
+        self.outline = [0, 0, 0, 0]
+        self.maxlayers = 2
+        self.papersize = 'A4'
+
+        self.traceWidth = {}
+        self.traceClearance = {}
+        self.padstack = [PadStack() for x in range(256)]
+
+        self.nets = {0: ''}
+        self.shapes = {}
+        self.components = []
+        self.segments = SegmentTable()
+        self.arcs = []          # (xs, ys, xm, ym, xe, ye, width, layer, net, trace code)
+        self.zones = []
+        self.vias = ViaTable()
+        self.texts = []
+        self.diagnostics = {}   # message: count, things worth knowing that don't stop the conversion
+
+    def note(self, message):
+        self.diagnostics[message] = self.diagnostics.get(message, 0) + 1
 
-    def _escape_value(self, value):
+    def __str__(self):
+        return f"Board(layers: {self.maxlayers}, shapes: {len(self.shapes)}, components: {len(self.components)}, nets: {len(self.nets) - 1})"
+
+class Stats:
+    """
+    Per record type counters of one conversion, filled by parse_ddf() and write_kicad() when
+    passed in. Record types are the DDF record names, '*T' covers all technology records.
+    """
+    # report order
+    order = ('*P', '*S', '*T', '*N', '*C', '*LT', '*LV', '*LA', '*LP', '*V', '*X')
+
+    def __init__(self):
+        self.records = {}   # record type: [count, bytes, objects, parse seconds]
+        self.written = {}   # record type: [objects, write seconds]
+
+    def parsed(self, kind, count, nbytes, seconds):
+        entry = self.records.setdefault(kind, [0, 0, 0, 0.0])
+        entry[0] += count
+        entry[1] += nbytes
+        entry[3] += seconds
+
+    def wrote(self, kind, objects, seconds):
+        entry = self.written.setdefault(kind, [0, 0.0])
+        entry[0] += objects
+        entry[1] += seconds
+
+    def merge(self, records):
         """
-        Helper function to escape string values with double quotes.
-        
-        :param value: The value to escape if it's a string.
-        :return: Escaped string or the original value.
+        Add the record counters of another Stats, e.g. from a worker process.
         """
-        if isinstance(value, str):
-            return f'"{value}"'
-        return str(value)
+        for kind, (count, nbytes, objects, seconds) in records.items():
+            self.parsed(kind, count, nbytes, seconds)
 
-    def __str__(self):
+    def count_objects(self, board):
         """
-        Serialize the S-Expression to a string.
+        Fill in the objects created per record type once the board is parsed completely.
         """
-        subvalue_strings = []
-        for subvalue in self.subvalues:
-            if isinstance(subvalue, SExpression):
-                subvalue_strings.append(str(subvalue))
-            elif isinstance(subvalue, tuple):
-                key, value = subvalue
-                subvalue_strings.append(f"({key} {self._escape_value(value)})")
-            else:
-                # If it's a simple string or integer
-                subvalue_strings.append(self._escape_value(subvalue))
-        
-        subvalues_str = " ".join(subvalue_strings)
-        return f"({self.name} {subvalues_str})"
+        vectors = self.records.get('*LV', [0])[0]
+        objects = {'*S': len(board.shapes), '*N': len(board.nets) - 1, '*C': len(board.components),
+                   '*LT': len(board.segments) - vectors, '*LV': vectors, '*LA': len(board.arcs),
+                   '*LP': len(board.zones), '*V': len(board.vias), '*X': len(board.texts)}
+        for kind, count in objects.items():
+            if kind in self.records:
+                self.records[kind][2] = count
+
+    def report(self, board, out=None):
+        """
+        Print the statistics table and the diagnostics collected in board.
+        """
+        out = out or sys.stdout
+        # the segment write time is split between *LT and *LV by object count
+        written = dict(self.written)
+        if '*LT' in written:
+            objects, seconds = written['*LT']
+            lt = self.records.get('*LT', [0, 0, 0])[2]
+            lv = self.records.get('*LV', [0, 0, 0])[2]
+            if lt + lv:
+                written['*LT'] = [lt, seconds * lt / (lt + lv)]
+                if lv:
+                    written['*LV'] = [lv, seconds * lv / (lt + lv)]
+
+        kinds = [k for k in self.order if k in self.records or k in written]
+        kinds += sorted(k for k in self.records if k not in self.order)
+        out.write("{:<6} {:>9} {:>11} {:>9} {:>10} {:>10}\n".format('record', 'count', 'bytes', 'objects', 'parse ms', 'write ms'))
+        total = [0, 0, 0, 0.0, 0.0]
+        for kind in kinds:
+            count, nbytes, objects, parse_s = self.records.get(kind, [0, 0, 0, 0.0])
+            write_s = written.get(kind, [0, 0.0])[1]
+            out.write("{:<6} {:>9} {:>11} {:>9} {:>10.1f} {:>10.1f}\n".format(kind, count, nbytes, objects, parse_s * 1000, write_s * 1000))
+            for i, v in enumerate((count, nbytes, objects, parse_s, write_s)):
+                total[i] += v
+        out.write("{:<6} {:>9} {:>11} {:>9} {:>10.1f} {:>10.1f}\n".format('total', total[0], total[1], total[2], total[3] * 1000, total[4] * 1000))
+        if board.diagnostics:
+            out.write("diagnostics:\n")
+            for message, count in board.diagnostics.items():
+                out.write("  {:>6}x {}\n".format(count, message))
+
+class Slot:
+    """
+    Placeholder in an SExpression that is compiled into a template, see SExpression.template().
+
+    :param quoted: The value gets written in double quotes.
+    :param nodes: The value is already written child nodes, separators included, see
+                  SExpression.separator().
+    """
+    __slots__ = ('quoted', 'nodes')
+
+    def __init__(self, quoted=False, nodes=False):
+        self.quoted = quoted
+        self.nodes = nodes
+
+def quote(text):
+    return '"' + text + '"'
+
+class SExpression:
+    """
+    One node of a KiCad s-expression: a name followed by values. A value is an atom written
+    as it is (str, int, use quote() for strings), a Slot or another node.
+
+    Records are never written from the tree directly, every kind of record is compiled once
+    into a str.format() template with its Slots as fields, see board_templates() and
+    FootprintTemplate. The compiler walks the tree with an explicit stack, so deep trees
+    need no recursion.
+    """
+    __slots__ = ('name', 'values')
+
+    def __init__(self, name, *values):
+        self.name = name
+        self.values = list(values)
+
+    def add(self, name, *values):
+        """
+        Append a new child node and return it.
+        """
+        node = SExpression(name, *values)
+        self.values.append(node)
+        return node
 
-parser = argparse.ArgumentParser(description='Convert PCB board files in UltiBoard 4.x format to KiCad pcb format.')
-parser.add_argument('infile', help='input file',)
-parser.add_argument('outfile', help='output file')
-parser.add_argument('-f', '--font', default='KiCad Font', help='use a different font, mono spaced fonts work best')
-parser.add_argument('-ts', '--textsilk', action='store_true', default=False, help='put freestanding silk text unto the front silk layer instead of the reference layer')
+    @staticmethod
+    def separator(indent=None, depth=0):
+        # what goes in front of a child node at depth, one space unless pretty-printed
+        return ' ' if indent is None else '\n' + ' ' * (indent * depth)
 
-args = parser.parse_args()
+    def tokens(self, indent=None, depth=0, atom=str):
+        """
+        Generate the output of this node token by token without recursion.
 
-# print(args)
-xScale = (1/1.2) * 0.0254
-ncount = 0
+        :param indent: Pretty-print with child nodes on lines of their own, indented by this
+                       many spaces per level. None writes everything on one line.
+        :param depth: Level of this node, for the indentation of its children.
+        :param atom: Function turning atoms into their text.
+        """
+        yield '(' + self.name
+        stack = [iter(self.values)]
+        while stack:
+            for value in stack[-1]:
+                if isinstance(value, SExpression):
+                    yield self.separator(indent, depth + len(stack)) + '(' + value.name
+                    stack.append(iter(value.values))
+                    break
+                yield atom(value)
+            else:
+                stack.pop()
+                yield ')'
 
-traceWidth = {}
-traceClearance = {}
-drillCode = [0] * 256
-padT = [{'X1': 0, 'X2': 0, 'Y': 0, 'Radius': 0, 'Clear': 0, 'Horz': 0, 'Vert': 0, 'ThermH': 0, 'ThermV': 0} for x in range(256)]
-padI = [{'X1': 0, 'X2': 0, 'Y': 0, 'Radius': 0, 'Clear': 0, 'Horz': 0, 'Vert': 0, 'ThermH': 0, 'ThermV': 0} for x in range(256)]
-padB = [{'X1': 0, 'X2': 0, 'Y': 0, 'Radius': 0, 'Clear': 0, 'Horz': 0, 'Vert': 0, 'ThermH': 0, 'ThermV': 0} for x in range(256)]
-nets = {}
-nets[0] = ''
-# shapes = {}
-Shapes = {}
+    def template(self, indent=None, depth=0):
+        """
+        Compile this node into a str.format() template, every Slot becomes a positional field.
+        """
+        return ''.join(self.tokens(indent, depth, self._template_atom))
 
-# print(drillCode)
+    @staticmethod
+    def _template_atom(value):
+        if isinstance(value, Slot):
+            if value.nodes:
+                return '{}'
+            return ' "{}"' if value.quoted else ' {}'
+        return ' ' + str(value).replace('{', '{{').replace('}', '}}')
+
+
+xScale = (1/1.2) * 0.0254
 
 # layers = [''] * 100
 layers = ['F.Fab','F.Cu','B.Cu','In1.Cu','In2.Cu','F.Mask','B.Mask','B.SilkS','B.Fab','Cmts.User','F.SilkS','','']
@@ -210,11 +465,33 @@ layers = ['F.Fab','F.Cu','B.Cu','In1.Cu','In2.Cu','F.Mask','B.Mask','B.SilkS','B
 def v2mm(val):
     return (val/1.2) * 0.0254
 
+def v2nm(val, div=1):
+    # DDF units (1/1.2 mil) of val/div to the nearest KiCad nanometre, integers only
+    return (val * 127000 + 3 * div) // (6 * div)
+
+@functools.lru_cache(maxsize=1 << 16)
+def fmt_nm(val):
+    """
+    Format integer nanometres as mm with the shortest exact decimal. Boards reuse the same
+    coordinates a lot, so results are cached.
+    """
+    if val < 0:
+        return '-' + fmt_nm(-val)
+    mm, frac = divmod(val, 1000000)
+    if frac == 0:
+        return str(mm)
+    return str(mm) + ('.%06d' % frac).rstrip('0')
+
+def fmt_num(val):
+    # angles and ratios, at most 6 decimals without trailing zeros
+    text = ('%.6f' % val).rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
 def nnameCheck(name, nb):
     # name = name[1:]
     if(name == ""):
         name = "SB${}".format(nb)
-    
+
     ch = 0
     while ch != -1:
         ch = name.find('\'')
@@ -252,585 +529,2867 @@ def netadjust(netnr):
     else: ret = netnr + 1
     return ret
 
-with open(args.infile, 'r', encoding="cp850") as ddf, open(args.outfile, 'w') as kicad:
-    for line in ddf:
-        if(line[0] == '*'):
-            # print(line)
-            line = line.strip()
-            match line[1]:
-                case 'P':
-                    # Header
-                    # print("Header")
-                    line = next(ddf).strip()
+# DDF angles are integers in 1/64 degree, arc midpoints can fall on half a step so the
+# table runs in 1/128 degree. Index 0 is stored as a full turn, like the "> 360" wrap the
+# arc code always used, so table values match math.cos/sin of the same angle exactly.
+ARC_STEPS = 360 * 128
+_arc_cos = [math.cos(math.pi / 180 * (k / 128)) for k in range(ARC_STEPS + 1)]
+_arc_sin = [math.sin(math.pi / 180 * (k / 128)) for k in range(ARC_STEPS + 1)]
+
+@functools.lru_cache(maxsize=16384)
+def arc_offsets(radius, start, sweep):
+    """
+    Start, mid and end point of a DDF arc relative to its centre, y still pointing up.
+
+    :param radius: radius in DDF units
+    :param start: start angle in 1/64 degree
+    :param sweep: arc angle in 1/64 degree
+    :return: (xs, ys, xm, ym, xe, ye) in nm
+    """
+    ar = v2nm(radius)
+    ks = (2 * start) % ARC_STEPS or ARC_STEPS
+    km = (ks + sweep) % ARC_STEPS or ARC_STEPS
+    ke = (ks + 2 * sweep) % ARC_STEPS or ARC_STEPS
+    return (round(ar * _arc_cos[ks]), round(ar * _arc_sin[ks]),
+            round(ar * _arc_cos[km]), round(ar * _arc_sin[km]),
+            round(ar * _arc_cos[ke]), round(ar * _arc_sin[ke]))
+
+def v2nm_np(arr, div=1):
+    # same integer arithmetic as v2nm(), numpy's // rounds down like Python's
+    return (arr * 127000 + 3 * div) // (6 * div)
+
+def body_rows(block, ncols):
+    """
+    Parse a block of whitespace separated integer records straight from bytes.
+
+    :return: 2D int64 array with ncols columns, or None if the block doesn't have exactly
+             ncols numbers on every line (the caller then falls back to the line parser).
+    """
+    block = block.strip()
+    tokens = block.split()
+    nlines = block.count(b'\n') + 1 if block else 0
+    if len(tokens) != nlines * ncols:
+        return None
+    try:
+        return np.array(tokens, dtype=np.int64).reshape(-1, ncols)
+    except ValueError:
+        return None
+
+def traces_np(board, blocks):
+    """
+    Vectorized *LT handling, resolves the records of all pending trace blocks at once
+    and appends them to board.segments.
+
+    :param blocks: [(layer, coord1, rows), ...] in file order, rows as returned by body_rows().
+    """
+    if not blocks:
+        return
+    counts = [len(rows) for layer, coord1, rows in blocks]
+    a = np.concatenate([rows for layer, coord1, rows in blocks])
+    c1 = np.repeat(np.array([coord1 for layer, coord1, rows in blocks], dtype=np.int64), counts)
+    layer = np.repeat(np.array([layer for layer, coord1, rows in blocks], dtype=np.int64), counts)
+    c2 = a[:, 0]
+    c3 = a[:, 1]
+    orient = a[:, 5]
+
+    x1 = np.zeros(len(a), dtype=np.int64)
+    y1 = np.zeros(len(a), dtype=np.int64)
+    x2 = np.zeros(len(a), dtype=np.int64)
+    y2 = np.zeros(len(a), dtype=np.int64)
+    m = orient == 1  # horizontal
+    x1[m] = v2nm_np(c2[m])
+    y1[m] = -v2nm_np(c1[m])
+    x2[m] = v2nm_np(c3[m])
+    y2[m] = y1[m]
+    m = orient == 2  # vertical
+    x1[m] = v2nm_np(c1[m])
+    y1[m] = -v2nm_np(c2[m])
+    x2[m] = x1[m]
+    y2[m] = -v2nm_np(c3[m])
+    # diagonals run through the half way points, done in half DDF units to stay exact
+    m = orient == 4  # north-east
+    x1[m] = v2nm_np(c1[m] + c2[m], 2)
+    y1[m] = v2nm_np(c1[m] - c2[m], 2)
+    x2[m] = v2nm_np(c1[m] + c3[m], 2)
+    y2[m] = v2nm_np(c1[m] - c3[m], 2)
+    m = orient == 8  # south-east
+    x1[m] = v2nm_np(c1[m] + c2[m], 2)
+    y1[m] = v2nm_np(c2[m] - c1[m], 2)
+    x2[m] = v2nm_np(c1[m] + c3[m], 2)
+    y2[m] = v2nm_np(c3[m] - c1[m], 2)
+    netnr = np.where(a[:, 2] == 65535, 0, a[:, 2] + 1)
+
+    keep = (orient == 1) | (orient == 2) | (orient == 4) | (orient == 8)
+    board.segments.extend_np(x1[keep], y1[keep], x2[keep], y2[keep], a[keep, 3], layer[keep], netnr[keep])
+    blocks.clear()
+
+def vectors_np(board, rows):
+    """
+    Vectorized *LV handling for all vector records of a board, appends them to board.segments.
+
+    :param rows: [layer, x1, y1, x2, y2, netnr, tracecode, tracetype] per record.
+    """
+    if len(rows) == 0:
+        return
+    a = np.array(rows, dtype=np.int64)
+    netnr = np.where(a[:, 5] == 65535, 0, a[:, 5] + 1)
+    board.segments.extend_np(v2nm_np(a[:, 1]), -v2nm_np(a[:, 2]), v2nm_np(a[:, 3]), -v2nm_np(a[:, 4]),
+                             a[:, 6], a[:, 0], netnr)
+
+def vias_np(board, blocks):
+    """
+    Vectorized *V handling, appends the vias of all pending via blocks to board.vias.
+
+    :param blocks: [(xpos, rows), ...] in file order, rows as [y, netnr, padcode, ...] per via record.
+    """
+    if not blocks:
+        return
+    counts = [len(rows) for xpos, rows in blocks]
+    a = np.concatenate([rows for xpos, rows in blocks])
+    x = v2nm_np(np.repeat(np.array([xpos for xpos, rows in blocks], dtype=np.int64), counts))
+    netnr = np.where(a[:, 1] == 65535, 0, a[:, 1] + 1)
+    board.vias.extend_np(x, -v2nm_np(a[:, 0]), a[:, 2], netnr)
+    blocks.clear()
+
+def map_ddf(f):
+    """
+    Memory-map an open binary file, empty files, pipes and devices can't be mapped and
+    are read instead.
+    """
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError, io.UnsupportedOperation):
+        return f.read()
+
+def split_record(rec):
+    # (stripped first line including the '*', rest of the record)
+    nl = rec.find(b'\n')
+    if nl < 0:
+        return rec.strip(), b''
+    return rec[:nl].strip(), rec[nl + 1:]
+
+def record_spans(data):
+    """
+    Return an iterator of (offset, length) of every record in bytes-like DDF data.
+    """
+    start = 0 if data[:1] == b'*' else data.find(b'\n*') + 1
+    if start == 0 and data[:1] != b'*':
+        return
+    size = len(data)
+    while start < size:
+        end = data.find(b'\n*', start + 1)
+        if end < 0:
+            end = size
+        yield start, end - start
+        start = end + 1
+
+def tokenize_ddf(source, chunk_size=1 << 20, spans=None):
+    """
+    Split DDF data into records without decoding it. A record starts with a '*' at the
+    beginning of a line and runs up to the next one.
+
+    :param source: bytes-like object (e.g. an mmap) or a binary stream read in chunks.
+    :param spans: Only return the records at these (offset, length) pairs, bytes-like
+                  sources only.
+    :return: Iterator of (line, body) byte strings, line is the stripped first line of
+             the record including the '*', body is everything after it.
+    """
+    split = split_record
+    if spans is not None:
+        for offset, length in spans:
+            yield split(source[offset:offset + length])
+        return
+
+    if hasattr(source, 'read'):
+        # buf holds the record being read from its '*' on, or before the first record the
+        # last byte read; nothing before scan can be the '\n' of a record start
+        buf = bytearray()
+        started = False
+        scan = 0
+        while True:
+            data = source.read(chunk_size)
+            buf += data
+            if not started:
+                start = 0 if buf[:1] == b'*' else buf.find(b'\n*') + 1
+                if start == 0 and buf[:1] != b'*':
+                    del buf[:-1]
+                    if not data:
+                        break
+                    continue
+                del buf[:start]
+                started = True
+                scan = 1
+            start = 0
+            while True:
+                end = buf.find(b'\n*', scan)
+                if end < 0:
+                    break
+                yield split(bytes(buf[start:end]))
+                start = end + 1
+                scan = start + 1
+            del buf[:start]     # cheap, bytearray drops leading bytes without copying the rest
+            scan = max(scan - start, len(buf) - 1, 1)
+            if not data:
+                break
+        if buf[:1] == b'*':
+            yield split(bytes(buf))
+        return
+
+    for offset, length in record_spans(source):
+        yield split(source[offset:offset + length])
+
+def parse_ddf(source, vectorize=None, stats=None, spans=None, pool=None):
+    """
+    Parse an UltiBoard DDF file into a Board.
+
+    Files given by path are memory-mapped and split into records on bytes, only names and
+    texts get decoded from cp850.
+
+    :param source: Path of the DDF file, or an open binary stream, or an open text stream.
+    :param vectorize: Convert trace, vector, via and polygon blocks with NumPy, defaults to
+                      True when NumPy is installed.
+    :param stats: Stats object to count records, bytes and parse time per record type in.
+    :param spans: Only parse the records at these (offset, length) pairs, e.g. from
+                  RecordIndex.select(). Needs a path or bytes-like source.
+    :param pool: concurrent.futures executor, *LT and *LP records are then parsed in chunks
+                 by its workers. Needs a path or bytes-like source.
+    :return: The parsed Board.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            data = map_ddf(f)
+            try:
+                return parse_ddf(data, vectorize, stats, spans, pool)
+            finally:
+                if isinstance(data, mmap.mmap):
+                    data.close()
+    if isinstance(source, io.TextIOBase):
+        source = source.read().encode('cp850', errors='replace')
+
+    if vectorize is None:
+        vectorize = np is not None
+    if pool is not None:
+        return parse_parallel(source, pool, vectorize, stats, spans)
+    board = Board()
+    traces = []     # pending vectorized *LT blocks
+    vias = []       # pending vectorized *V blocks
+    vectors = []
+    ncount = 0
+    kind = None
+    if stats is not None:
+        clock = time.perf_counter
+        last = clock()
+    for line, body in tokenize_ddf(source, spans=spans):
+        if stats is not None:
+            # the time up to here belongs to the previous record, some branches 'continue'
+            now = clock()
+            if kind is not None:
+                stats.parsed(kind, 1, nbytes, now - last)
+            kind = '*' + line[1:3 if line[1:2] == b'L' else 2].decode('cp850')
+            nbytes = len(line) + len(body) + 1
+            last = now
+        ddf = iter(body.splitlines())
+        match line[1:2]:
+            case b'P':
+                # Header
+                # print("Header")
+                line = next(ddf).strip()
+                line = next(ddf).strip()
+                outline = [int(i) for i in line[:-1].split(b',')]
+                # print("Outline ", outline)
+                if(v2mm(outline[0])+v2mm(-outline[2]) > 260 ):
+                    # print(outline[0]+(-outline[2]))
+                    board.papersize = 'A3'
+                else:
+                    # print(outline[0]+(-outline[2]))
+                    board.papersize = 'A4'
+                board.outline = outline
+                board.maxlayers = outline[-1]
+                board.note("{} layers".format(board.maxlayers))
+
+            case b'S':
+                # print("Shape " + line[2:])
+                sName = line[2:].decode('cp850')
+                line = next(ddf).strip()
+                lname = [v2nm(int(i)) for i in line.split(b' ')]
+                sNRelx = lname[0]
+                sNRely = -lname[1]
+                sNHeight = lname [2]
+                sNRot = v2mm(int(line.split(b' ')[3])) / 64
+                sNWidth = lname[4]
+                sNThick = lname[5]
+
+                line = next(ddf).strip()
+                lalias = [v2nm(int(i)) for i in line.split(b' ')]
+                sARelx = lalias[0]
+                sARely = -lalias[1]
+                sAHeight = lalias [2]
+                sARot = v2mm(int(line.split(b' ')[3])) / 64
+                sAWidth = lalias[4]
+                sAThick = lalias[5]
+
+                line = next(ddf).strip()
+                rthJuncB = float(line)
+                sline = b""
+                while True:
                     line = next(ddf).strip()
-                    outline = [int(i) for i in line[:-1].split(',')]
-                    # print("Outline ", outline)
-                    # hstr = "  (gr_rect (start {x1:.4f} {y1:.4f}) (end {x2:.4f} {y2:.4f}) (width 0.1) (layer \"Edge.Cuts\"))\n"
-                    # kicad.write(hstr.format(x1 = outline[0], y1 = -outline[1], x2 = outline[2], y2 = -outline[3]))
-                    if(v2mm(outline[0])+v2mm(-outline[2]) > 260 ):
-                        # print(outline[0]+(-outline[2]))
-                        psize = 'A3'
+                    if line[:1] == b';': break
+                    if b';' in line:
+                        sline += line[:-1]
+                        break
                     else:
-                        # print(outline[0]+(-outline[2]))
-                        psize = 'A4'
-                    maxlayers = outline[-1]
-                    print(maxlayers)
-
-                    innerl = ""
-                    for l in range(1,maxlayers-1):
-                        innerl += "({c} \"In{l}.Cu\" signal)\n".format(c=l,l=l)
-
-                    header = header.format(inner_layers=innerl, papersize=psize)
-
-                    kicad.writelines(header)
-                    kicad.write("  (net 0 \"\")\n")     #Empty Net
-
-                case 'S':
-                    # print("Shape " + line[2:])
-                    shapeStr = ""
-                    sName = line[2:]
-                    line = next(ddf).strip()
-                    lname = [v2mm(int(i)) for i in line.split(' ')]
-                    sNRelx = lname[0]
-                    sNRely = -lname[1]
-                    sNHeight = lname [2]
-                    sNRot = lname[3] / 64
-                    sNWidth = lname[4]
-                    sNThick = lname[5]
-
+                        sline += line
+
+                #outline lines
+                lines = []
+                if len(sline) > 0:
+                    parr = [int(i) for i in sline.split(b',')]
+                    # print("x/y of lines", parr)
+                    oddies = split_odd(parr)
+                    for p in oddies:
+                        for i in range(0, len(p) - 3, 2):
+                            sp = p[i:i+2]
+                            ep = p[i+2:i+4]
+                            if(i == 0): sp[0] = sp[0]-1
+                            lines.append((v2nm(sp[0]), -v2nm(sp[1]), v2nm(ep[0]), -v2nm(ep[1])))
+
+                #Pads
+                pads = []
+                while True:
                     line = next(ddf).strip()
-                    lalias = [v2mm(int(i)) for i in line.split(' ')]
-                    sARelx = lalias[0]
-                    sARely = -lalias[1]
-                    sAHeight = lalias [2]
-                    sARot = lalias[3] / 64
-                    sAWidth = lalias[4]
-                    sAThick = lalias[5]
-
-                    shapeStr = "(footprint \"library:{sname}\" ".format(sname=sName)
-                    shapeStr += " (layer \"{fp_layer}\")\n {component}\n"
-                    shapeStr += """  (fp_text user \"${REFERENCE}\" (at {snrelx} {snrely} {snrot}) (layer "F.Fab")\n\
-                                    (effects (font (size 0.25 0.25) (thickness 0.04)))\n  )\n"""\
-                                    .format(REFERENCE=sName,snrelx=sNRelx,snrely=sNRely,snrot=sNRot)
-
+                    if len(line) > 1:
+                        larr = line[:-1].split(b',', 5)
+                        pcode    = int(larr[0])
+                        pcoderot = float(larr[1])/64
+                        pcodels  = int(larr[2],16)
+                        pcoderelx = v2nm(int(larr[3]))
+                        pcoderely = v2nm(int(larr[4]))
+                        pname = larr[5].decode('cp850')
+                        # print("Pad ", pcode, pcoderot, pcodels, pcoderelx, pcoderely, pname)
+
+                        pads.append(Pad(pname, pcode, pcoderot, pcodels, pcoderelx, pcoderely, board.padstack[pcode]))
+
+                    if b';' in line:
+                        break
+                #outline arcs and circles
+                arcs = []
+                circles = []
+                while True:
                     line = next(ddf).strip()
-                    rthJuncB = float(line)
-                    sline = ""
-                    while True:
-                        line = next(ddf).strip()
-                        if ';' == line[0]: break
-                        if ';' in line:
-                            sline += line[:-1]
-                            break
+                    if len(line) > 1:
+                        larr = line[:-1].split(b',')
+                        ax = v2nm(int(larr[0]))
+                        ay = v2nm(int(larr[1]))
+                        ar = v2nm(int(larr[2]))
+                        arc2 = int(larr[4])
+                        # print("Arc ", ax,ay,ar, larr[3], arc2)
+
+                        if(arc2 == 360 * 64):
+                            circles.append((ax, -ay, ax + ar, -ay))
                         else:
-                            sline += line
-                    
-                    #outline lines
-                    if len(sline) > 0:
-                        parr = [int(i) for i in sline.split(',')]
-                        # print("x/y of lines", parr)
-                        oddies = split_odd(parr)
-                        for p in oddies:
-                            for i in range(0, len(p) - 3, 2):
-                                sp = p[i:i+2]
-                                ep = p[i+2:i+4]
-                                if(i == 0): sp[0] = sp[0]-1
-                                
-                                if(sName == 'BOARD'):
-                                    # handle complex board outline
-                                    kicad.write("  (gr_line (start {sx:.4f} {sy:.4f}) (end {ex:.4f} {ey:.4f}) (width 0.1) (layer \"Edge.Cuts\"))\n"\
-                                                    .format(sx=v2mm(sp[0]),sy=-v2mm(sp[1]),ex=v2mm(ep[0]),ey=-v2mm(ep[1])))
-                                else:
-                                    shapeStr += "  (fp_line (start {sx} {sy}) (end {ex} {ey}) (layer \"{fp_side}.SilkS\"))\n"\
-                                                    .format(sx=v2mm(sp[0]),sy=-v2mm(sp[1]),ex=v2mm(ep[0]),ey=-v2mm(ep[1]),fp_side="{fp_side}")
-                                
-                    #Pads
-                    pads = []
-                    bpads = []
-                    while True:
-                        line = next(ddf).strip()
-                        if len(line) > 1:
-                            larr = line[:-1].split(',', 5)
-                            pcode    = int(larr[0])
-                            pcoderot = float(larr[1])/64
-                            pcodels  = int(larr[2],16)
-                            pcoderelx = v2mm(int(larr[3]))
-                            pcoderely = v2mm(int(larr[4]))
-                            pname = larr[5]
-                            # print("Pad ", pcode, pcoderot, pcodels, pcoderelx, pcoderely, pname)
-
-                            bpx1 = v2mm(padB[pcode]['X1'])
-                            bpx2 = v2mm(padB[pcode]['X2'])
-                            bpy  = v2mm(padB[pcode]['Y'])
-                            bpr  = v2mm(padB[pcode]['Radius'])
-                            bpc  = v2mm(padB[pcode]['Clear'])
-                            bph  = v2mm(padB[pcode]['Horz'])
-                            bpv  = v2mm(padB[pcode]['Vert'])
-                            dc  = drillCode[pcode]
-                            # print("Pad2 ", pcoderelx, pcoderely, pcodels, bpx1, bpx2, bpy, bpr, bpc, dc)
-                            bpx = bpx1 + bpx2
-
-                            tpx1 = v2mm(padT[pcode]['X1'])
-                            tpx2 = v2mm(padT[pcode]['X2'])
-                            tpy  = v2mm(padT[pcode]['Y'])
-                            tpr  = v2mm(padT[pcode]['Radius'])
-                            tpc  = v2mm(padT[pcode]['Clear'])
-                            tph  = v2mm(padT[pcode]['Horz'])
-                            tpv  = v2mm(padT[pcode]['Vert'])
-                            dc  = drillCode[pcode]
-                            # print("Pad2 ", pcoderelx, pcoderely, pcodels, tpx1, tpx2, tpy, tpr, tpc, dc)
-                            tpx = tpx1 + tpx2
-
-                            bpads.append({'code': pcode,
-                                           'rot': pcoderot,
-                                         'layer': pcodels,
-                                          'relx': pcoderelx,
-                                          'rely': pcoderely,
-                                          'name': pname,
-                                            'x1': bpx1,
-                                            'x2': bpx2,
-                                             'y': bpy,
-                                           'rad': bpr,
-                                         'clear': bpc,
-                                         'width': bpx,
-                                        'height': bpy,
-                                         'drill': 0})
-
-                            pads.append({ 'code': pcode,
-                                           'rot': pcoderot,
-                                         'layer': pcodels,
-                                          'relx': pcoderelx,
-                                          'rely': pcoderely,
-                                          'name': pname,
-                                            'x1': tpx1,
-                                            'x2': tpx2,
-                                             'y': tpy,
-                                           'rad': tpr,
-                                         'clear': tpc,
-                                         'width': tpx,
-                                        'height': tpy,
-                                         'drill': dc})
-
-                        if ';' in line:
-                            break
-                    #outline arcs and circles
-                    while True:
-                        line = next(ddf).strip()
-                        if len(line) > 1:
-                            larr = line[:-1].split(',')
-                            ax = v2mm(int(larr[0]))
-                            ay = v2mm(int(larr[1]))
-                            ar = v2mm(int(larr[2]))
-                            arc1 = int(larr[3]) / 64
-                            arc2 = int(larr[4]) / 64
-                            # print("Arc ", ax,ay,ar, arc1, arc2)
-
-                            arcStart = 360 + arc1
-                            if(arcStart > 360): arcStart -= 360
-                            arcMid = -(arcStart + (arc2/2))
-                            if(arcMid > 360): arcMid -= 360
-                            arcEnd = arcStart + arc2
-                            if(arcEnd > 360): arcEnd -= 360
-                            xArcStart = ar * math.cos(math.pi / 180 * arcStart)
-                            yArcStart = ar * math.sin(math.pi / 180 * arcStart)
-                            xArcMid   = ar * math.cos(math.pi / 180 * arcMid)
-                            yArcMid   = ar * math.sin(math.pi / 180 * arcMid)
-                            xArcEnd   = ar * math.cos(math.pi / 180 * arcEnd)
-                            yArcEnd   = ar * math.sin(math.pi / 180 * arcEnd)
-
-                            if(arc2 == 360):
-                                circstr = "  (fp_circle (center {xc} {yc}) (end {xe} {ye}) (layer \"{fp_side}.SilkS\") (width 0.1))\n"
-                                shapeStr += circstr.format(xc = ax, yc = -ay, xe = ax + ar, ye = -ay,fp_side="{fp_side}")
-                            else:
-                                astr = "  (fp_arc (start {xs:.4f} {ys:.4f}) (mid {xm:.4f} {ym:.4f}) (end {xe:.4f} {ye:.4f}) (width {width:.3f}) (layer \"{fp_side}.SilkS\"))\n"
-                                shapeStr += astr.format(xs = ax + xArcStart, ys = -(ay + yArcStart), xm = ax + xArcMid, ym = -(ay - yArcMid), xe = ax + xArcEnd, ye = -(ay + yArcEnd), width = 0.1,fp_side="{fp_side}")
-
-                        if ';' in line:
-                            break
-
-                    Shapes[sName] = {'str': shapeStr, 'pads': pads, 'bpads': bpads}
-                case 'T':
-                    # print("Technology")
-                    match line[2]:
-                        case 'P':
-                            print("padset " + line[4:])
-                        case 'T':
-                            tl = [int(i) for i in line[4:].split(',')]
-                            # print("Trace ", tl)
-                            traceWidth[tl[0]] = tl[1]
-                            traceClearance[tl[0]] = tl[2]
-
-                        case 'C':
-                            print("Drill tolerance " + line[4:])
-                        case 'D':
-                            dc = [int(i) for i in line[4:].split(',')]
-                            # print("Drill Code ", dc)
-                            drillCode[dc[0]] = v2mm(dc[1])
-                        case '0':
-                            pi = [int(i) for i in line[4:].split(',')]
-                            # print("Inner Pads ", pi)
-                            padI[pi[0]] = {'X1': pi[1], 'X2': pi[2], 'Y': pi[3], 'Radius': pi[4], 'Clear': pi[5], 'Horz': pi[6], 'Vert': pi[7], 'ThermH': pi[8], 'ThermV': pi[9]}
-                        case '1':
-                            pi = [int(i) for i in line[4:].split(',')]
-                            # print("Top Pads ", [int(i) for i in line[4:].split(',')])
-                            padT[pi[0]] = {'X1': pi[1], 'X2': pi[2], 'Y': pi[3], 'Radius': pi[4], 'Clear': pi[5], 'Horz': pi[6], 'Vert': pi[7], 'ThermH': pi[8], 'ThermV': pi[9]}
-                        case '2':
-                            pi = [int(i) for i in line[4:].split(',')]
-                            # print("Bottom Pads ", [int(i) for i in line[4:].split(',')])
-                            padB[pi[0]] = {'X1': pi[1], 'X2': pi[2], 'Y': pi[3], 'Radius': pi[4], 'Clear': pi[5], 'Horz': pi[6], 'Vert': pi[7], 'ThermH': pi[8], 'ThermV': pi[9]}
-                        case 'S':
-                            print("Wave solder dir " + line[4:])
-                        case _:
-                            print("T?" + line)
-
-                case 'N':
-                    # print("Net")
-                    larr = line[3:-1].split(" ")
-                    # print("Net " + larr[0][1:], [int(i) for i in larr[1:]])
-                    # nets[ncount] = larr[0][1:]
-                    ncount += 1
-                    nets[ncount] = nnameCheck(larr[0].strip("\""), ncount)
-                    if(nets[ncount] == 65535):
-                        nets[ncount] = 1
-                    # if len(larr[0]) > 1:
-                    kicad.write("  (net {ncount} \"{name}\")\n".format(ncount = ncount, name = nets[ncount]))
-                case 'C':
-                    # print("Component")
-                    carr = line[3:].split(" ")
-                    cname = carr[0]
-                    calias = carr[1].strip("/")
-                    cshape = carr[2]
-                    carr = next(ddf).strip().split(",")
-                    cxpos = v2mm(int(carr[0]))
-                    cypos = -v2mm(int(carr[1]))
-                    crot  = int(carr[2])/64
-                    cnxpos = v2mm(int(carr[3]))
-                    cnypos = -v2mm(int(carr[4]))
-                    cnrot  = int(carr[5])/64
-                    cnhght = v2mm(int(carr[6]))
-                    cnwdth = v2mm(int(carr[7]))
-                    cnthck = v2mm(int(carr[8]))
-                    caxpos = v2mm(int(carr[9]))
-                    caypos = v2mm(int(carr[10]))
-                    carot  = int(carr[11])/64
-                    cahght = v2mm(int(carr[12]))
-                    cawdth = v2mm(int(carr[13]))
-                    cathck = v2mm(int(carr[14]))
-                    carr = next(ddf).strip().split(",")
-
-                    # print("cname ", cname)
-                    nline = ""
-                    while True:
-                        line = next(ddf).strip()
-                        if ';' == line[0]: break
-                        nline += line + ' '
-
-                    narr = [i for i in nline.strip().split(" ")]
-
-                    pnpairs = []
-                    for i in range(0, len(narr), 2):
-                        pair = narr[i:i+2]
-                        # print("pair ", pair)
-                        # if pair[0] != '': break
-                        pair[0] =  int(pair[0]) + 1             # in kicad net 0 has to remain empty
-                        if pair[0] == 65536: pair[0] = 0        # no connect
-                        if not pair[1].isdigit(): pair[1] = 0   # thru hole
-                        else: pair[1] = int(pair[1])
-                        # pair.append(pair[1])
-                        # pair[1] = 0
-                        pnpairs.append(pair)
-                    
-                    # print("pnp", pnpairs)
-
-                    shape = Shapes[cshape]
-                    theside = 'B' if pnpairs[0][1] == 2 and pnpairs[-1][1] == 2 else 'F'
-
-                    mir = ""
-                    if theside == 'B':
-                        crot = crot + 180
-                        mir = "(justify mirror)"
-                        cnypos = -cnypos
-
-
-                    fpadd = "(at {locx} {locy} {rot})\n  ".format(locx = cxpos, locy = cypos, rot = crot)
-                    shapeStr = shape['str'].format(component = fpadd, fp_layer = layers[pnpairs[0][1]], fp_side = theside)
-                    shapeStr += "  (property \"Reference\" \"{name}\" (layer \"{cnl}.Fab\")(at {cnx} {cny} {cnrot}) (hide no) (effects  (font (face \"{font}\") (size {cnsizex} {cnsizey}) (thickness {cnthick})) {mir}))\n"\
-                                    .format(name = cname, cnx = cnxpos, cny = cnypos, cnrot = cnrot+crot, cnl = theside, cnsizex = cnhght, cnsizey= cnwdth, cnthick=cnthck/10, mir=mir, font=args.font)
-                    shapeStr += "  (property \"Value\" \"{name}\" (layer \"{anl}.Fab\")(at {anx} {any} {anrot}) (hide yes) (effects (font (face \"{font}\") (size {ansizex} {ansizey}) (thickness {anthick})) {mir}))\n"\
-                                    .format(name = calias, anx = caxpos, any = caypos, anrot = carot+crot, anl = theside, ansizex = cahght, ansizey= cawdth, anthick=cathck/10, mir=mir, font=args.font)
-
-                    if shape['pads'][0]['drill'] == 0:
-                        shapeStr += "  (attr smd)\n"
-                    else:
-                        shapeStr += "  (attr through_hole)\n"
-
-                    # print(cstr)
-
-                    for pidx,pad in enumerate(shape['pads']):
-                        # print("pidx ", pidx, len(pnpairs), pad)
-
-                        if pad['layer'] == 0xffffffff: pad['layer'] = 9
-                        # if pnpairs[pidx][0] == 65535: 
-                        # pname = nnameCheck(nets[pnpairs[pidx][0]], pnpairs[pidx][0])
-                        pname = nets[pnpairs[pidx][0]]
-                        # print(pname)
-
-                        centeroffset = pad['x1'] - pad['x2']
-                        px = pad['x1'] + pad['x2']
-
-                        if pad['drill'] == 0:
-                            if pad['height'] != 0 and pad['width'] != 0:
-                                # smd
-                                if pad['y'] == 0: pad['y'] = 0.001
-                                if pad['rely'] == 0: pad['rely'] = 0.001
-                                roundratio = pad['rad'] / pad['y']
-
-                                if centeroffset == 0:
-                                    # bottom pads
-                                    if pnpairs[pidx][1] == 2:
-                                        shapeStr += "  (pad \"{name}\" smd roundrect (net {nnum} \"{nname}\") (at {x} {y} {rot}) (size {w} {h}) (layers \"{layer}\" \"B.Paste\" \"B.Mask\") (roundrect_rratio {rr}) (clearance {clear}))\n"\
-                                                        .format(name = pad['name'], x = pad['relx'], y = -pad['rely'], h = pad['height'], w = pad['width'], rot = crot + pad['rot'], layer=layers[pnpairs[pidx][1]], rr=roundratio, nnum = pnpairs[pidx][0], nname=pname, clear=pad['clear'])
-                                    else:
-                                        shapeStr += "  (pad \"{name}\" smd roundrect (net {nnum} \"{nname}\") (at {x} {y} {rot}) (size {w} {h}) (layers \"{layer}\" \"F.Paste\"  \"F.Mask\") (roundrect_rratio {rr}) (clearance {clear}))\n"\
-                                                        .format(name = pad['name'], x = pad['relx'], y = -pad['rely'], h = pad['height'], w = pad['width'], rot = crot + pad['rot'], layer=layers[pnpairs[pidx][1]], rr=roundratio, nnum = pnpairs[pidx][0], nname=pname, clear=pad['clear'])
-                                else:
-                                    match pad['rot']:
-                                        case 0:
-                                            rx = pad['relx'] - centeroffset/2
-                                            ry = pad['rely']
-                                        case 90:
-                                            rx = pad['relx']
-                                            ry = pad['rely'] - centeroffset/2
-                                        case 180:
-                                            rx = pad['relx'] + centeroffset/2
-                                            ry = pad['rely']
-                                        case 270:
-                                            rx = pad['relx']
-                                            ry = pad['rely'] + centeroffset/2
-                                    # Bottom
-                                    if pnpairs[pidx][1] == 2:
-                                        shapeStr += "  (pad \"{name}\" smd roundrect (net {nnum} \"{nname}\") (at {x} {y} {rot}) (size {w} {h}) (layers \"{layer}\" \"B.Paste\" \"B.Mask\") (roundrect_rratio {rr}) (clearance {clear}))\n"\
-                                                        .format(name = pad['name'], x = rx, y = -ry, h = pad['height'], w = pad['width'], rot = crot + pad['rot'], layer=layers[pnpairs[pidx][1]], rr=roundratio, nnum = pnpairs[pidx][0], nname=pname, clear=pad['clear'])
-                                    else:
-                                        # print("centeroffset ", centeroffset, pad['x1'], pad['x2'])
-                                        shapeStr += "  (pad \"{name}\" smd roundrect (net {nnum} \"{nname}\") (at {x} {y} {rot}) (size {w} {h}) (layers \"{layer}\" \"F.Paste\" \"F.Mask\") (roundrect_rratio {rr}) (clearance {clear}))\n"\
-                                                        .format(name = pad['name'], x = rx, y = -ry, h = pad['height'], w = pad['width'], rot = crot + pad['rot'], layer=layers[pnpairs[pidx][1]], rr=roundratio, nnum = pnpairs[pidx][0], nname=pname, clear=pad['clear'])
+                            xs, ys, xm, ym, xe, ye = arc_offsets(int(larr[2]), int(larr[3]), arc2)
+                            arcs.append((ax + xs, -(ay + ys), ax + xm, -(ay + ym), ax + xe, -(ay + ye)))
+
+                    if b';' in line:
+                        break
+
+                board.shapes[sName] = Shape(sName, (sNRelx, sNRely, sNRot), lines, pads, arcs, circles)
+            case b'T':
+                # print("Technology")
+                match line[2:3]:
+                    case b'P':
+                        board.note("padset " + line[4:].decode('cp850'))
+                    case b'T':
+                        tl = [int(i) for i in line[4:].split(b',')]
+                        # print("Trace ", tl)
+                        board.traceWidth[tl[0]] = tl[1]
+                        board.traceClearance[tl[0]] = tl[2]
+
+                    case b'C':
+                        board.note("Drill tolerance " + line[4:].decode('cp850'))
+                    case b'D':
+                        dc = [int(i) for i in line[4:].split(b',')]
+                        # print("Drill Code ", dc)
+                        board.padstack[dc[0]].drill = v2nm(dc[1])
+                    case b'0':
+                        pi = [int(i) for i in line[4:].split(b',')]
+                        # print("Inner Pads ", pi)
+                        board.padstack[pi[0]].inner = PadDef(*pi[1:10])
+                    case b'1':
+                        pi = [int(i) for i in line[4:].split(b',')]
+                        # print("Top Pads ", pi)
+                        board.padstack[pi[0]].top = PadDef(*pi[1:10])
+                        board.padstack[pi[0]].update()
+                    case b'2':
+                        pi = [int(i) for i in line[4:].split(b',')]
+                        # print("Bottom Pads ", pi)
+                        board.padstack[pi[0]].bottom = PadDef(*pi[1:10])
+                        board.padstack[pi[0]].update()
+                    case b'S':
+                        board.note("Wave solder dir " + line[4:].decode('cp850'))
+                    case _:
+                        board.note("unknown technology record " + line.decode('cp850'))
+
+            case b'N':
+                # print("Net")
+                larr = line[3:-1].split(b" ")
+                # print("Net " + larr[0][1:], [int(i) for i in larr[1:]])
+                ncount += 1
+                board.nets[ncount] = nnameCheck(larr[0].strip(b"\"").decode('cp850'), ncount)
+            case b'C':
+                # print("Component")
+                carr = line[3:].decode('cp850').split(" ")
+                cname = carr[0]
+                calias = carr[1].strip("/")
+                cshape = carr[2]
+                carr = next(ddf).strip().split(b",")
+                cxpos = v2nm(int(carr[0]))
+                cypos = -v2nm(int(carr[1]))
+                crot  = int(carr[2])/64
+                cnxpos = v2nm(int(carr[3]))
+                cnypos = -v2nm(int(carr[4]))
+                cnrot  = int(carr[5])/64
+                cnhght = v2nm(int(carr[6]))
+                cnwdth = v2nm(int(carr[7]))
+                cnthck = v2nm(int(carr[8]))
+                caxpos = v2nm(int(carr[9]))
+                caypos = v2nm(int(carr[10]))
+                carot  = int(carr[11])/64
+                cahght = v2nm(int(carr[12]))
+                cawdth = v2nm(int(carr[13]))
+                cathck = v2nm(int(carr[14]))
+                carr = next(ddf).strip().split(b",")
+
+                # print("cname ", cname)
+                nline = b""
+                while True:
+                    line = next(ddf).strip()
+                    if line[:1] == b';': break
+                    nline += line + b' '
+
+                narr = [i for i in nline.strip().split(b" ")]
+
+                pnpairs = []
+                for i in range(0, len(narr), 2):
+                    pair = narr[i:i+2]
+                    # print("pair ", pair)
+                    pair[0] =  int(pair[0]) + 1             # in kicad net 0 has to remain empty
+                    if pair[0] == 65536: pair[0] = 0        # no connect
+                    if not pair[1].isdigit(): pair[1] = 0   # thru hole
+                    else: pair[1] = int(pair[1])
+                    pnpairs.append(pair)
+
+                # print("pnp", pnpairs)
+                board.components.append(Component(cname, calias, cshape,
+                                                  (cxpos, cypos, crot),
+                                                  (cnxpos, cnypos, cnrot, cnhght, cnwdth, cnthck),
+                                                  (caxpos, caypos, carot, cahght, cawdth, cathck),
+                                                  pnpairs))
+            case b'L':
+                # print("Subrecord")
+                match line[2:3]:
+                    case b'T':
+                        # print("Trace")
+                        tline = [int(i) for i in line[4:].split(b' ')]
+                        # print(tline)
+                        layer = int(tline[0])
+                        if vectorize:
+                            end = body.find(b';')
+                            rows = body_rows(body[:end] if end >= 0 else body, 6)
+                            if rows is not None:
+                                traces.append((layer, int(tline[1]), rows))
+                                continue
+                            traces_np(board, traces)  # keep file order ahead of the line parser
+                        c1 = int(tline[1])
+                        coord1 = v2nm(c1)
+                        while True:
+                            line = next(ddf).strip()
+                            if len(line) > 1:
+                                tarr = line.split(b' ')
+                                # print(tarr)
+                                c2 = int(tarr[0])
+                                c3 = int(tarr[1])
+                                coord2 = v2nm(c2)
+                                coord3 = v2nm(c3)
+                                netnr = netadjust(int(tarr[2]))
+                                tcode = int(tarr[3])
+                                ttype = int(tarr[4])
+                                orient = int(tarr[5][:1])
+                                # print("Track ", layer, coord1, coord2, coord3, netnr, tcode, ttype, orient)
+                                match orient:
+                                    case 1:
+                                        board.segments.append(coord2, -coord1, coord3, -coord1, tcode, layer, netnr)
+                                    case 2:
+                                        board.segments.append(coord1, -coord2, coord1, -coord3, tcode, layer, netnr)
+                                    case 4:
+                                        board.segments.append(v2nm(c1 + c2, 2), v2nm(c1 - c2, 2), v2nm(c1 + c3, 2), v2nm(c1 - c3, 2), tcode, layer, netnr)
+                                    case 8:
+                                        board.segments.append(v2nm(c1 + c2, 2), v2nm(c2 - c1, 2), v2nm(c1 + c3, 2), v2nm(c3 - c1, 2), tcode, layer, netnr)
+                            if b';' in line:
+                                break
+
+                    case b'V':
+                        # print("Vector")
+                        vline = [int(i) for i in line[4:].split(b' ')]
+                        # print(vline)
+                        if vectorize:
+                            # converted together after the whole file is read
+                            vectors.append(vline[:8])
+                            continue
+                        vlayer = int(vline[0])
+                        vx1 = v2nm(int(vline[1]))
+                        vy1 = -(v2nm(int(vline[2])))
+                        vx2 = v2nm(int(vline[3]))
+                        vy2 = -(v2nm(int(vline[4])))
+                        vnetnr = netadjust(int(vline[5]))
+                        vtcode = int(vline[6])
+                        vttype = int(vline[7])
+                        board.segments.append(vx1, vy1, vx2, vy2, vtcode, vlayer, vnetnr)
+                    case b'A':
+                        # print("Arc")
+                        aline = [int(i) for i in line[4:].split(b' ')]
+                        # print(aline)
+                        alayer = int(aline[0])
+                        ax = v2nm(int(aline[1]))
+                        ay = (v2nm(int(aline[2])))
+                        anetnr = netadjust(int(aline[6]))
+                        atcode = int(aline[7])
+                        if(atcode == 65535): atcode = 0
+                        attype = int(aline[8])
+
+                        xs, ys, xm, ym, xe, ye = arc_offsets(int(aline[3]), int(aline[4]), int(aline[5]))
+
+                        board.arcs.append((ax + xs, -(ay + ys), ax + xm, -(ay + ym), ax + xe, -(ay + ye), v2nm(board.traceWidth[atcode]), alayer, anetnr, atcode))
+                    case b'P':
+                        # print("Polygon")
+                        lpline = [int(i) for i in line[4:].split(b' ')]
+                        # print(lpline)
+                        lplayer = lpline[0]
+                        lpnetnr = netadjust(lpline[1])
+                        lppat   = lpline[2]
+                        lpdist  = lpline[3]
+                        lptcode = lpline[4]
+                        lpclear = v2nm(lpline[5])
+                        lptype  = lpline[6]
+                        pts = []
+                        if vectorize:
+                            # only the outline of the total polygon, the voids follow after the ':'
+                            end = min(i for i in (body.find(b':'), body.find(b';'), len(body)) if i >= 0)
+                            coords = body[:end].split()
+                            if coords:
+                                xy = v2nm_np(np.array(coords[:len(coords) & ~1], dtype=np.int64).reshape(-1, 2))
+                                xy[:, 1] = -xy[:, 1]
+                                pts = list(map(tuple, xy.tolist()))
                         else:
-                            # thruhole
-                            roundratio = pad['rad'] / pad['y']
-                            if centeroffset == 0 and px == pad['y']:
-                                if pad['rad'] < (px/2):
-                                    padshape = "rect"
-                                else:
-                                    padshape = "circle"
-                            else:
-                                padshape = "roundrect"
-                                pcoderely = pcoderely - centeroffset
-                            
-
-                            shapeStr += "  (pad \"{name}\" thru_hole {padshape} (net {nnum} \"{nname}\") (at {x} {y} {rot}) (size {h} {w}) (drill {dc}) (layers \"*.Cu\" \"*.Mask\") (roundrect_rratio {rr}) (clearance {clear}))\n"\
-                                            .format(name = pad['name'], x = pad['relx'], y = -pad['rely'], h = pad['height'], w = pad['width'], rot = crot + pad['rot'] - 90, layer=layers[pnpairs[pidx][1]], rr=roundratio, dc = pad['drill'], padshape=padshape, nnum = pnpairs[pidx][0], nname=pname, clear=pad['clear'])
-                            # handle complex Padstack, right now only works if Top pad is smaller than the bottom one
-                            if(shape['bpads'][pidx] != pad):
-                                # print('pad diff!!')
-                                bpad = shape['bpads'][pidx]
-                                shapeStr += "  (pad \"{name}\" smd {padshape} (net {nnum} \"{nname}\") (at {x} {y} {rot}) (size {h} {w}) (drill {dc}) (layers \"B.Cu\" \"B.Mask\") (roundrect_rratio {rr}) (clearance {clear}))\n"\
-                                                .format(name = bpad['name'], x = bpad['relx'], y = -bpad['rely'], h = bpad['height'], w = bpad['width'], rot = crot + bpad['rot'] - 90, layer=layers[2], rr=roundratio, dc = bpad['drill'], padshape=padshape, nnum = pnpairs[pidx][0], nname=pname, clear=pad['clear'])
-
-                    # cstr += shapeStr
-                    kicad.write(shapeStr+"\n)\n")
-                case 'L':
-                    # print("Subrecord")
-                    match line[2]:
-                        case 'T':
-                            # print("Trace")
-                            tline = [int(i) for i in line[4:].split(' ')]
-                            # print(tline)
-                            layer = int(tline[0])
-                            coord1 = v2mm(int(tline[1]))
                             while True:
                                 line = next(ddf).strip()
-                                if len(line) > 1:
-                                    tarr = line.split(' ')
-                                    # print(tarr)
-                                    coord2 = v2mm(float(tarr[0]))
-                                    coord3 = v2mm(float(tarr[1]))
-                                    netnr = netadjust(int(tarr[2]))
-                                    tcode = int(tarr[3])
-                                    ttype = int(tarr[4])
-                                    orient = int(tarr[5][0])
-                                    # if(netnr == 65535):
-                                    #     netnr = 0
-                                    # netnr += 1
-                                    # print("Track ", layer, coord1, coord2, coord3, netnr, tcode, ttype, orient)
-                                    # print(traceWidth)
-                                    tstr = "  (segment (start {x1:.4f} {y1:.4f}) (end {x2:.4f} {y2:.4f}) (width {width:.3f}) (layer {layer}) (net {netnr}))\n"
-                                    match orient:
-                                        case 1:
-                                            tstr = tstr.format(x1 = coord2, y1 = -coord1, x2 = coord3, y2 = -coord1, netnr = netnr, layer = "\""+layers[layer]+"\"", width = v2mm(traceWidth[tcode]))
-                                        case 2:
-                                            tstr = tstr.format(x1 = coord1, y1 = -coord2, x2 = coord1, y2 = -coord3, netnr = netnr, layer = "\""+layers[layer]+"\"", width = v2mm(traceWidth[tcode]))
-                                        case 4:
-                                            tstr = tstr.format(x1 = coord2 + ((coord1 - coord2) / 2), y1 = -((coord1 - coord2) / -2), x2 = coord3 + ((coord1 - coord3) / 2 ), y2 = -((coord1 - coord3) / -2), netnr = netnr, layer = "\""+layers[layer]+"\"", width = v2mm(traceWidth[tcode]))
-                                        case 8:
-                                            tstr = tstr.format(x1 = coord2 - ((coord2 - coord1) / 2), y1 = -((coord2 - coord1) / -2), x2 = coord3 - ((coord3 - coord1) / 2 ), y2 = -((coord3 - coord1) / -2), netnr = netnr, layer = "\""+layers[layer]+"\"", width = v2mm(traceWidth[tcode]))
-                                    
-                                    # print(tstr)
-                                    kicad.write(tstr)
-                                if ';' in line:
-                                    break
-
-                        case 'V':
-                            # print("Vector")
-                            vline = [int(i) for i in line[4:].split(' ')]
-                            # print(vline)
-                            vlayer = int(vline[0])
-                            vx1 = v2mm(int(vline[1]))
-                            vy1 = -(v2mm(int(vline[2])))
-                            vx2 = v2mm(int(vline[3]))
-                            vy2 = -(v2mm(int(vline[4])))
-                            vnetnr = netadjust(int(vline[5]))
-                            # if(vnetnr == 65535):
-                            #     vnetnr = 0
-                            # vnetnr += 1
-                            vtcode = int(vline[6])
-                            vttype = int(vline[7])
-                            vstr = "  (segment (start {x1:.4f} {y1:.4f}) (end {x2:.4f} {y2:.4f}) (width {width:.3f}) (layer {layer}) (net {netnr}))\n"
-                            kicad.write(vstr.format(x1 = vx1, y1 = vy1, x2 = vx2, y2 = vy2, width = v2mm(traceWidth[vtcode]), layer = "\""+layers[vlayer]+"\"", netnr = vnetnr))
-                        case 'A':
-                            # print("Arc")
-                            aline = [int(i) for i in line[4:].split(' ')]
-                            # print(aline)
-                            alayer = int(aline[0])
-                            ax = v2mm(int(aline[1]))
-                            ay = (v2mm(int(aline[2])))
-                            ar = v2mm(int(aline[3]))
-                            arc1 = int(aline[4]) / 64
-                            arc2 = int(aline[5]) / 64
-                            anetnr = netadjust(int(aline[6]))
-                            # if(anetnr == 65535): anetnr = 0
-                            # anetnr += 1
-                            atcode = int(aline[7])
-                            if(atcode == 65535): atcode = 0
-                            attype = int(aline[8])
-
-                            arcStart = 360 + arc1
-                            if(arcStart > 360): arcStart -= 360
-                            arcMid = -(arcStart + (arc2/2))
-                            if(arcMid > 360): arcMid -= 360
-                            arcEnd = arcStart + arc2
-                            if(arcEnd > 360): arcEnd -= 360
-                            xArcStart = ar * math.cos(math.pi / 180 * arcStart)
-                            yArcStart = ar * math.sin(math.pi / 180 * arcStart)
-                            xArcMid   = ar * math.cos(math.pi / 180 * arcMid)
-                            yArcMid   = ar * math.sin(math.pi / 180 * arcMid)
-                            xArcEnd   = ar * math.cos(math.pi / 180 * arcEnd)
-                            yArcEnd   = ar * math.sin(math.pi / 180 * arcEnd)
-
-                            astr = "  (gr_arc (start {xs:.4f} {ys:.4f}) (mid {xm:.4f} {ym:.4f}) (end {xe:.4f} {ye:.4f}) (width {width:.3f}) (layer {layer}))\n"
-                            kicad.write(astr.format(xs = ax + xArcStart, ys = -(ay + yArcStart), xm = ax + xArcMid, ym = -(ay - yArcMid), xe = ax + xArcEnd, ye = -(ay + yArcEnd), width = v2mm(traceWidth[atcode]), layer = "\""+layers[alayer]+"\"", netnr = anetnr))
-                        case 'P':
-                            # print("Polygon")
-                            lpline = [int(i) for i in line[4:].split(' ')]
-                            # print(lpline)
-                            lplayer = lpline[0]
-                            lpnetnr = netadjust(lpline[1])
-                            # if(lpnetnr == 65535): lpnetnr = 0
-                            # lpnetnr += 1
-                            lppat   = lpline[2]
-                            lpdist  = lpline[3]
-                            lptcode = lpline[4]
-                            lpclear = v2mm(lpline[5])
-                            lptype  = lpline[6]
-                            lpstr = """  (zone (net {netnr})\n(net_name \"{netname}\")\n(layer \"{layer}\")\n
-                                            (fill yes (thermal_gap 0.254) (thermal_bridge_width 0.254))\n
-                                            (connect_pads (clearance {lpclear}))\n
-                                            (polygon\n
-                                                (pts\n
-                                    """
-                            kicad.write(lpstr.format(netnr = lpnetnr, netname = nets[lpnetnr], layer = layers[lplayer], lpclear = lpclear))
-                            while True:
-                                line = next(ddf).strip()
-                                if(line[0] == ';'): break
-                                polyline = [v2mm(int(i)) for i in line.strip(':;').split(" ")]
+                                if line[:1] == b';': break
+                                polyline = [v2nm(int(i)) for i in line.strip(b':;').split(b" ")]
                                 for i,i2 in zip(polyline[::2],polyline[1::2]):
-                                    kicad.write("(xy {x} {y})\n".format(x = i, y = -(i2)))
-                                if ':' in line: break
-                                if ';' in line: break
-
-                            kicad.write("  )))\n")
-                            # lpstr = """  (zone (net {netnr}) (net_name \"\") (layers \"F&B.Cu\" \"*.SilkS\" \"*.Mask\")\n
-                            #                 (connect_pads yes (clearance 0))
-                            #                 (keepout (tracks not_allowed) (vias not_allowed) (pads not_allowed) (copperpour not_allowed) (footprints allowed))
-                            #                 (fill (thermal_gap 0.508) (thermal_bridge_width 0.508))\n
-                            #                 (polygon\n
-                            #                     (pts\n
-                            #         """
-                            # while True:
-                            #     kicad.write(lpstr.format(netnr = lpnetnr))
-                            #     while True:
-                            #         line = next(ddf).strip()
-                            #         if(line[0] == ';'): break
-                            #         polyline = [v2mm(int(i)) for i in line.strip(':;').split(" ")]
-                            #         for i,i2 in zip(polyline[::2],polyline[1::2]):
-                            #             kicad.write("(xy {x} {y})\n".format(x = i, y = -(i2)))
-                            #         if ':' in line: break
-                            #         if ';' in line: break
-                            #     kicad.write("  )))\n")
-                            #     if ';' in line: break
-                        case _:
-                            print(line[2])
-                case 'V':
-                    # print("Vias")
-                    varr = line[3:].split(" ")
-                    # print(varr)
-                    vxpos = v2mm(int(varr[0]))
-                    while True:
-                        line = next(ddf).strip()
-                        if(line[0] == ';'):
-                            break
-                        vline = line.split(" ")
-                        vypos = -(v2mm(int(vline[0])))
-                        vnetnr = netadjust(int(vline[1]))
-                        vpcode = int(vline[2])
-                        vstr = "  (via (at {x} {y}) (size {s}) (drill {d:.2f}) (layers \"{lt}\" \"{lb}\") (net {n}))\n"
-                        kicad.write(vstr.format(x = vxpos, y = vypos, s = v2mm(padT[vpcode]['Y']), d = drillCode[vpcode], lt = "F.Cu", lb = "B.Cu", n = vnetnr))
-                        if ';' in line:
-                            break
-
-                case 'X':
-                    # print("Text")
-                    xtext = line[3:].split(" ", 7)
-                    textx = v2mm(int(xtext[0]))
-                    texty = -(v2mm(int(xtext[1])))
-                    texth = v2mm(int(xtext[2]))
-                    textw = v2mm(int(xtext[3]))
-                    textt = v2mm(int(xtext[4])/5)
-                    textr = int(xtext[5]) / 64
-                    textl = int(xtext[6])
-                    textstr = str_esc(xtext[7])
-                    if textl == 2 or textl == 4:
-                        textj = "(justify mirror)"
-                    else:
-                        textj = ''
+                                    pts.append((i, -(i2)))
+                                if b':' in line: break
+                                if b';' in line: break
+                        board.zones.append(Zone(lpnetnr, lplayer, lpclear, pts))
+                    case _:
+                        board.note("unknown record *L" + line[2:3].decode('cp850'))
+            case b'V':
+                # print("Vias")
+                varr = line[3:].split(b" ")
+                # print(varr)
+                if vectorize:
+                    end = body.find(b';')
+                    rows = body_rows(body[:end] if end >= 0 else body, 8)
+                    if rows is not None:
+                        vias.append((int(varr[0]), rows))
+                        continue
+                    vias_np(board, vias)
+                vxpos = v2nm(int(varr[0]))
+                while True:
+                    line = next(ddf).strip()
+                    if line[:1] == b';':
+                        break
+                    vline = line.split(b" ")
+                    vypos = -(v2nm(int(vline[0])))
+                    vnetnr = netadjust(int(vline[1]))
+                    vpcode = int(vline[2])
+                    board.vias.append(vxpos, vypos, vpcode, vnetnr)
+                    if b';' in line:
+                        break
+
+            case b'X':
+                # print("Text")
+                xtext = line[3:].split(b" ", 7)
+                textx = v2nm(int(xtext[0]))
+                texty = -(v2nm(int(xtext[1])))
+                texth = v2nm(int(xtext[2]))
+                textw = v2nm(int(xtext[3]))
+                textt = v2nm(int(xtext[4]), 5)
+                textr = int(xtext[5]) / 64
+                textl = int(xtext[6])
+                textstr = str_esc(xtext[7].decode('cp850'))
+                board.texts.append(Text(textstr, textx, texty, texth, textw, textt, textr, textl))
+            # case _:
+            #     print(line[1])
+
+    if stats is None:
+        traces_np(board, traces)
+        vias_np(board, vias)
+        vectors_np(board, vectors)
+        return board
+
+    if kind is not None:
+        stats.parsed(kind, 1, nbytes, clock() - last)
+    for kind, flush, pending in (('*LT', traces_np, traces), ('*V', vias_np, vias), ('*LV', vectors_np, vectors)):
+        last = clock()
+        flush(board, pending)
+        if kind in stats.records:
+            stats.parsed(kind, 0, 0, clock() - last)
+    stats.count_objects(board)
+    return board
+
+def layer_name(layer):
+    # KiCad name of a DDF layer number, '' if there is none
+    return layers[layer] if 0 <= layer < len(layers) else ''
+
+def copper_layers():
+    return {name for name in layers if name.endswith('.Cu')}
+
+def copper_numbers(maxlayers):
+    # DDF numbers of the copper layers of a board with maxlayers layers, as far as the
+    # layer table has names for them
+    last = min(max(maxlayers, 2), len(layers) - 1)
+    return tuple(l for l in range(1, last + 1) if layers[l].endswith('.Cu'))
+
+def parse_layer_names(text):
+    """
+    Turn a comma separated list of KiCad layer names or DDF layer numbers into a set of
+    KiCad layer names, raises ValueError on unknown layers.
+    """
+    names = set()
+    for item in text.split(','):
+        item = item.strip()
+        if item.isdigit():
+            if int(item) >= len(layers) or not layers[int(item)]:
+                raise ValueError("no KiCad layer for DDF layer " + item)
+            names.add(layers[int(item)])
+        elif item in layers or item == 'Edge.Cuts':
+            names.add(item)
+        else:
+            raise ValueError("unknown layer " + item)
+    return names
+
+def parse_region(text):
+    """
+    Turn 'X0,Y0,X1,Y1' in KiCad mm into a (x0, y0, x1, y1) tuple with x0 <= x1, y0 <= y1.
+    """
+    x0, y0, x1, y1 = [float(i) for i in text.split(',')]
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+# records parsed by worker processes with parse_ddf(pool=...), they don't depend on
+# anything before them in the file. *LV records are too, unless vectorized.
+PARALLEL_RECORDS = (b'LT', b'LP')
+
+def _parse_part(data, vectorize, with_stats):
+    # runs inside a worker process
+    stats = Stats() if with_stats else None
+    board = parse_ddf(data, vectorize, stats)
+    return board.segments, board.zones, board.diagnostics, stats.records if stats else None
+
+def parse_parallel(data, pool, vectorize, stats=None, spans=None, part_size=None):
+    """
+    Parse bytes-like DDF data with the *LT and *LP records split into chunks that are
+    parsed by the pool's workers, while the main process parses everything else. The
+    results are joined in file order. The vectorized parser puts all *LV segments after
+    the *LT ones, so *LV records stay in the main process then; without it they go to the
+    workers too, to keep them in file order among the *LT records.
+
+    :param part_size: Bytes of trace and polygon records per chunk, by default the records
+                      are split into four chunks per core but at least 256 kB each.
+    """
+    if spans is None:
+        spans = record_spans(data)
+    kinds = PARALLEL_RECORDS if vectorize else PARALLEL_RECORDS + (b'LV',)
+    bulk = []
+    rest = []
+    for span in spans:
+        (bulk if data[span[0] + 1:span[0] + 3] in kinds else rest).append(span)
+    total = sum(length for offset, length in bulk)
+    if part_size is None:
+        part_size = max(total // (4 * (os.cpu_count() or 1)), 1 << 18)
+
+    futures = []
+    part = []
+    size = 0
+    for offset, length in bulk:
+        part.append(data[offset:offset + length])
+        size += length
+        if size >= part_size:
+            futures.append(pool.submit(_parse_part, b'\n'.join(part), vectorize, stats is not None))
+            part = []
+            size = 0
+    if part:
+        futures.append(pool.submit(_parse_part, b'\n'.join(part), vectorize, stats is not None))
+
+    board = parse_ddf(data, vectorize, stats, rest)
+    segments = SegmentTable()
+    for future in futures:
+        part_segments, zones, diagnostics, records = future.result()
+        segments.extend(part_segments)
+        board.zones.extend(zones)
+        for message, count in diagnostics.items():
+            board.diagnostics[message] = board.diagnostics.get(message, 0) + count
+        if stats is not None:
+            stats.merge(records)
+    segments.extend(board.segments)
+    board.segments = segments
+    if stats is not None:
+        stats.count_objects(board)
+    return board
+
+class RecordIndex:
+    """
+    Byte offset, length and type of every '*' record of a DDF file, plus what is needed to
+    select records without parsing them: the layer, the DDF net and a bounding box.
+
+    Bounding boxes are in DDF units but with the KiCad y direction. A net of -1 means the
+    record has none, -2 that it has several or couldn't be read, a layer of -1 that it has
+    none. Records with several nets are selected as a whole and filtered per object after
+    parsing, see filter_board().
+    """
+    version = 1
+    columns = ('offset', 'length', 'layer', 'net', 'x0', 'y0', 'x1', 'y1')
+    typecodes = ('q', 'q', 'h', 'i', 'i', 'i', 'i', 'i')
+    geometry = (b'LT', b'LV', b'LA', b'LP', b'V ', b'C ', b'X ')
+
+    def __init__(self):
+        self.kinds = bytearray()    # 2 bytes per record, e.g. b'LT', b'C '
+        for name, typecode in zip(self.columns, self.typecodes):
+            setattr(self, name, arr.array(typecode))
+
+    def __len__(self):
+        return len(self.offset)
+
+    def kind(self, i):
+        return bytes(self.kinds[2 * i:2 * i + 2])
+
+    @classmethod
+    def build(cls, data):
+        """
+        Scan bytes-like DDF data once and index every record.
+        """
+        index = cls()
+        for offset, length in record_spans(data):
+            line, body = split_record(data[offset:offset + length])
+            kind = line[1:3] if line[1:2] == b'L' else line[1:2] + b' '
+            layer, net, box = -1, -1, None
+            if kind in cls.geometry:
+                net = -2
+                try:
+                    layer, net, box = cls._scan(kind, line, body)
+                except (ValueError, IndexError):
+                    pass
+            index.kinds += kind.ljust(2)[:2]
+            index.offset.append(offset)
+            index.length.append(length)
+            index.layer.append(layer)
+            index.net.append(net)
+            x0, y0, x1, y1 = box if box is not None else (1, 1, 0, 0)     # empty, always selected
+            index.x0.append(x0)
+            index.y0.append(y0)
+            index.x1.append(x1)
+            index.y1.append(y1)
+        return index
+
+    @staticmethod
+    def _scan(kind, line, body):
+        # (layer, net, (x0, y0, x1, y1)) of one geometry record
+        def common(nets):
+            nets = set(nets)
+            return int(nets.pop()) if len(nets) == 1 else (-1 if not nets else -2)
+
+        end = body.find(b';')
+        if end >= 0:
+            body = body[:end]
+        match kind:
+            case b'LT':
+                layer, c1 = [int(i) for i in line[4:].split()[:2]]
+                t = body.split()
+                if len(t) % 6:
+                    return layer, -2, None
+                xs = []
+                ys = []
+                for c2, c3, orient in zip(map(int, t[0::6]), map(int, t[1::6]), t[5::6]):
+                    match orient[:1]:
+                        case b'1':
+                            xs += (c2, c3)
+                            ys.append(-c1)
+                        case b'2':
+                            xs.append(c1)
+                            ys += (-c2, -c3)
+                        case b'4':
+                            xs += ((c1 + c2) // 2, (c1 + c3) // 2)
+                            ys += ((c1 - c2) // 2, (c1 - c3) // 2)
+                        case b'8':
+                            xs += ((c1 + c2) // 2, (c1 + c3) // 2)
+                            ys += ((c2 - c1) // 2, (c3 - c1) // 2)
+                if not xs:
+                    return layer, common(t[2::6]), None
+                return layer, common(t[2::6]), (min(xs), min(ys), max(xs), max(ys))
+            case b'LV':
+                v = [int(i) for i in line[4:].split()]
+                return v[0], v[5], (min(v[1], v[3]), -max(v[2], v[4]), max(v[1], v[3]), -min(v[2], v[4]))
+            case b'LA':
+                a = [int(i) for i in line[4:].split()]
+                return a[0], a[6], (a[1] - a[3], -a[2] - a[3], a[1] + a[3], -a[2] + a[3])
+            case b'LP':
+                p = [int(i) for i in line[4:].split()]
+                end = body.find(b':')
+                xy = [int(i) for i in (body[:end] if end >= 0 else body).split()]
+                if len(xy) < 2:
+                    return p[0], p[1], None
+                return p[0], p[1], (min(xy[0::2]), -max(xy[1::2]), max(xy[0::2]), -min(xy[1::2]))
+            case b'V ':
+                x = int(line[3:].split()[0])
+                rows = [r.split() for r in body.splitlines() if r.strip()]
+                ys = [-int(r[0]) for r in rows]
+                return -1, common(r[1] for r in rows), (x, min(ys), x, max(ys))
+            case b'C ':
+                rows = body.splitlines()
+                pos = rows[0].split(b',')
+                x, y = int(pos[0]), -int(pos[1])
+                pins = b' '.join(rows[2:]).split()
+                return -1, common(pins[0::2]), (x, y, x, y)
+            case b'X ':
+                t = line[3:].split(b' ', 7)
+                x, y = int(t[0]), -int(t[1])
+                return int(t[6]), -1, (x, y, x, y)
+
+    @classmethod
+    def for_file(cls, path, data):
+        """
+        Return the index of a DDF file, read from the cache file next to it when that is
+        still valid, otherwise built from data and saved. A cache that can't be written
+        is silently skipped.
+        """
+        st = os.stat(path)
+        key = "ulti2kicad-index {} {} {}".format(cls.version, st.st_size, st.st_mtime_ns)
+        cache = path + '.idx'
+        try:
+            return cls.load(cache, key)
+        except (OSError, ValueError, EOFError):
+            pass
+        index = cls.build(data)
+        try:
+            index.save(cache, key)
+        except OSError:
+            pass
+        return index
+
+    def save(self, path, key):
+        # written aside and moved into place, readers never see half an index
+        tmp = path + '.{}.tmp'.format(os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write("{} {}\n".format(key, len(self)).encode('ascii'))
+                f.write(self.kinds)
+                for name in self.columns:
+                    getattr(self, name).tofile(f)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    @classmethod
+    def load(cls, path, key):
+        """
+        Read an index saved by save(), raises ValueError if it doesn't belong to key or
+        is cut short.
+        """
+        with open(path, 'rb') as f:
+            head = f.readline().decode('ascii', errors='replace').split()
+            if ' '.join(head[:-1]) != key:
+                raise ValueError("stale index " + path)
+            count = int(head[-1])
+            index = cls()
+            index.kinds = bytearray(f.read(2 * count))
+            if len(index.kinds) != 2 * count:
+                raise ValueError("truncated index " + path)
+            try:
+                for name in cls.columns:
+                    getattr(index, name).fromfile(f, count)
+            except EOFError:
+                raise ValueError("truncated index " + path)
+        return index
+
+    def net_numbers(self, data, names):
+        """
+        Return the raw DDF numbers of the nets with the given names, named the way parse_ddf()
+        names them, plus the names that don't exist.
+        """
+        numbers = set()
+        missing = set(names)
+        ncount = 0
+        for i in range(len(self)):
+            if self.kinds[2 * i:2 * i + 2] == b'N ':
+                line = split_record(data[self.offset[i]:self.offset[i] + self.length[i]])[0]
+                ncount += 1
+                name = nnameCheck(line[3:-1].split(b" ")[0].strip(b"\"").decode('cp850'), ncount)
+                if name in names:
+                    numbers.add(ncount - 1)
+                    missing.discard(name)
+        return numbers, missing
+
+    def select(self, data, layers=None, nets=None, region=None):
+        """
+        Return the (offset, length) spans of the records matching all given filters in file
+        order, ready for parse_ddf(spans=...). Records without geometry (header, technology,
+        shapes, nets) are always selected.
+
+        :param layers: Set of KiCad layer names, components and vias count as copper.
+        :param nets: Set of net names, also a set of raw DDF net numbers.
+        :param region: (x0, y0, x1, y1) in KiCad mm, records overlapping it are selected.
+        """
+        if nets is not None and not all(isinstance(n, int) for n in nets):
+            nets = self.net_numbers(data, nets)[0]
+        copper = layers is not None and bool(layers & copper_layers())
+        if region is not None:
+            # mm to DDF units, a unit of slack for rounding and the halved diagonal points
+            region = [math.floor(region[0] * 6000 / 127) - 1, math.floor(region[1] * 6000 / 127) - 1,
+                      math.ceil(region[2] * 6000 / 127) + 1, math.ceil(region[3] * 6000 / 127) + 1]
+        spans = []
+        for i in range(len(self)):
+            kind = self.kinds[2 * i:2 * i + 2]
+            if kind in self.geometry:
+                if layers is not None:
+                    if kind in (b'V ', b'C '):
+                        if not copper:
+                            continue
+                    elif self.layer[i] >= 0 and layer_name(self.layer[i]) not in layers:
+                        continue
+                if nets is not None and self.net[i] != -2 and self.net[i] not in nets:
+                    continue
+                if region is not None and self.x0[i] <= self.x1[i] and (
+                        self.x1[i] < region[0] or self.x0[i] > region[2] or
+                        self.y1[i] < region[1] or self.y0[i] > region[3]):
+                    continue
+            spans.append((self.offset[i], self.length[i]))
+        return spans
+
+def filter_board(board, layers=None, nets=None, region=None):
+    """
+    Drop everything from a parsed board that doesn't match the filters, per object. Used
+    after a RecordIndex selection for records holding several nets, works on a fully parsed
+    board just as well. Free texts carry no net and are dropped whenever nets are given.
+
+    :param layers: Set of KiCad layer names, components and vias count as copper, the board
+                   outline is kept only with Edge.Cuts.
+    :param nets: Set of net names.
+    :param region: (x0, y0, x1, y1) in KiCad mm.
+    """
+    if layers is not None:
+        copper = bool(layers & copper_layers())
+    if nets is not None:
+        nets = {n for n, name in board.nets.items() if name in nets}
+    if region is not None:
+        x0, y0, x1, y1 = [round(v * 1000000) for v in region]
+
+    def layer_ok(layer):
+        return layers is None or layer_name(layer) in layers
+
+    def box_ok(xs, ys):
+        return region is None or not (max(xs) < x0 or min(xs) > x1 or max(ys) < y0 or min(ys) > y1)
+
+    segments = SegmentTable()
+    for sx, sy, ex, ey, code, layer, net in board.segments:
+        if layer_ok(layer) and (nets is None or net in nets) and box_ok((sx, ex), (sy, ey)):
+            segments.append(sx, sy, ex, ey, code, layer, net)
+    board.segments = segments
+
+    vias = ViaTable()
+    if layers is None or copper:
+        for x, y, code, net in board.vias:
+            if (nets is None or net in nets) and box_ok((x,), (y,)):
+                vias.append(x, y, code, net)
+    board.vias = vias
+
+    board.components = [comp for comp in board.components
+                        if (layers is None or copper)
+                        and (nets is None or any(pin[0] in nets for pin in comp.pnpairs))
+                        and box_ok(comp.pos[:1], comp.pos[1:2])]
+    board.zones = [zone for zone in board.zones
+                   if layer_ok(zone.layer) and (nets is None or zone.net in nets)
+                   and (not zone.pts or box_ok([p[0] for p in zone.pts], [p[1] for p in zone.pts]))]
+    board.arcs = [a for a in board.arcs if layer_ok(a[7]) and (nets is None or a[8] in nets) and box_ok(a[0:6:2], a[1:6:2])]
+    board.texts = [text for text in board.texts
+                   if nets is None and layer_ok(text.layer) and box_ok((text.x,), (text.y,))]
+    if layers is not None and 'Edge.Cuts' not in layers and 'BOARD' in board.shapes:
+        if not any(comp.shape == 'BOARD' for comp in board.components):
+            del board.shapes['BOARD']
+
+class FootprintTemplate:
+    """
+    A shape compiled once per side into a str.format() template. Placing a component only
+    has to fill in its position, rotation, texts and the nets of its pins.
+    """
+    def __init__(self, shape, lib_id=None):
+        self.shape = shape
+        self.lib_id = lib_id or "library:" + shape.name
+        self.templates = {}     # (side, indent): compiled template
+
+        # pads without copper are left out, 'smd' or 'th' plus whether the bottom gets an extra pad
+        self.pads = []
+        for pad in shape.pads:
+            top = pad.stack.top
+            if pad.stack.drill == 0:
+                self.pads.append(('smd', False) if top.y != 0 and top.width != 0 else None)
+            else:
+                self.pads.append(('th', pad.stack.differs))
+
+    def _compile(self, side, library=None):
+        # the footprint of a board, or with library set the footprint of that name in a
+        # .pretty library, which has no position and no nets
+        shape = self.shape
+        S = SExpression
+        value = Slot()
+        text = Slot(quoted=True)
+
+        if library is None:
+            fp = S('footprint', quote(self.lib_id), S('layer', text), S('at', value, value, value))
+            net = (S('net', value, text),)
+        else:
+            fp = S('footprint', quote(library), S('version', '20221018'), S('generator', 'ulti2kicad'), S('layer', text),
+                   S('descr', quote("UltiBoard shape " + shape.name)))
+            net = ()
+        fp.add('fp_text', 'user', quote('$' + shape.name),
+               S('at', fmt_nm(shape.reference[0]), fmt_nm(shape.reference[1]), fmt_num(shape.reference[2])),
+               S('layer', quote("F.Fab")),
+               S('effects', S('font', S('size', '0.25', '0.25'), S('thickness', '0.04'))))
+        silk = S('layer', quote(side + ".SilkS"))
+        for sx, sy, ex, ey in shape.lines:
+            fp.add('fp_line', S('start', fmt_nm(sx), fmt_nm(sy)), S('end', fmt_nm(ex), fmt_nm(ey)), silk)
+        for xs, ys, xm, ym, xe, ye in shape.arcs:
+            fp.add('fp_arc', S('start', fmt_nm(xs), fmt_nm(ys)), S('mid', fmt_nm(xm), fmt_nm(ym)),
+                   S('end', fmt_nm(xe), fmt_nm(ye)), S('width', '0.1'), silk)
+        for xc, yc, xe, ye in shape.circles:
+            fp.add('fp_circle', S('center', fmt_nm(xc), fmt_nm(yc)), S('end', fmt_nm(xe), fmt_nm(ye)), silk, S('width', '0.1'))
+        for prop, hide in (("Reference", 'no'), ("Value", 'yes')):
+            effects = S('effects', S('font', S('face', text), S('size', value, value), S('thickness', value)))
+            if side == 'B':
+                effects.add('justify', 'mirror')
+            fp.add('property', quote(prop), text, S('layer', quote(side + ".Fab")), S('at', value, value, value),
+                   S('hide', hide), effects)
+        fp.add('attr', 'smd' if shape.pads[0].stack.drill == 0 else 'through_hole')
+
+        for pad, entry in zip(shape.pads, self.pads):
+            if entry is None:
+                continue
+            top = pad.stack.top
+            pad_props = (S('roundrect_rratio', fmt_num(top.roundratio)), S('clearance', fmt_nm(top.clear)))
+            if entry[0] == 'smd':
+                centeroffset = top.x1 - top.x2
+                prely = pad.y if pad.y != 0 else 1000
+                rx = pad.x
+                ry = prely
+                if centeroffset != 0:
+                    match pad.rot:
+                        case 0:
+                            rx = pad.x - centeroffset//2
+                        case 90:
+                            ry = prely - centeroffset//2
+                        case 180:
+                            rx = pad.x + centeroffset//2
+                        case 270:
+                            ry = prely + centeroffset//2
+                # the copper layer and the side of paste and mask come from the component
+                fp.add('pad', quote(pad.name), 'smd', 'roundrect', *net,
+                       S('at', fmt_nm(rx), fmt_nm(-ry), value), S('size', fmt_nm(top.width), fmt_nm(top.y)),
+                       S('layers', text, text, text), *pad_props)
+            else:
+                # thruhole
+                if top.x1 == top.x2 and top.width == top.y:
+                    padshape = 'rect' if top.radius < top.width / 2 else 'circle'
+                else:
+                    padshape = 'roundrect'
+                at = S('at', fmt_nm(pad.x), fmt_nm(-pad.y), value)
+                fp.add('pad', quote(pad.name), 'thru_hole', padshape, *net, at,
+                       S('size', fmt_nm(top.y), fmt_nm(top.width)), S('drill', fmt_nm(pad.stack.drill)),
+                       S('layers', quote("*.Cu"), quote("*.Mask")), *pad_props)
+                # handle complex Padstack, right now only works if Top pad is smaller than the bottom one
+                if entry[1]:
+                    bottom = pad.stack.bottom
+                    fp.add('pad', quote(pad.name), 'smd', padshape, *net, at,
+                           S('size', fmt_nm(bottom.y), fmt_nm(bottom.width)), S('drill', '0'),
+                           S('layers', quote("B.Cu"), quote("B.Mask")), *pad_props)
+        return fp
+
+    def render(self, comp, nets, font, indent=None):
+        """
+        Render one placed component as a KiCad footprint.
+        """
+        pnpairs = comp.pnpairs
+        cxpos, cypos, crot = comp.pos
+        cnxpos, cnypos, cnrot, cnhght, cnwdth, cnthck = comp.nameref
+        caxpos, caypos, carot, cahght, cawdth, cathck = comp.aliasref
+
+        theside = 'B' if pnpairs[0][1] == 2 and pnpairs[-1][1] == 2 else 'F'
+        if theside == 'B':
+            crot = crot + 180
+            cnypos = -cnypos
+
+        template = self.templates.get((theside, indent))
+        if template is None:
+            template = self.templates[theside, indent] = self._compile(theside).template(indent, 1)
+
+        values = [layers[pnpairs[0][1]], fmt_nm(cxpos), fmt_nm(cypos), fmt_num(crot),
+                  comp.name, fmt_nm(cnxpos), fmt_nm(cnypos), fmt_num(cnrot + crot),
+                  font, fmt_nm(cnhght), fmt_nm(cnwdth), fmt_nm((cnthck + 5) // 10),
+                  comp.alias, fmt_nm(caxpos), fmt_nm(caypos), fmt_num(carot + crot),
+                  font, fmt_nm(cahght), fmt_nm(cawdth), fmt_nm((cathck + 5) // 10)]
+        for pad, entry, (nnum, setting) in zip(self.shape.pads, self.pads, pnpairs):
+            if entry is None:
+                continue
+            if entry[0] == 'smd':
+                side = 'B' if setting == 2 else 'F'
+                values += [nnum, nets[nnum], fmt_num(crot + pad.rot), layers[setting], side + ".Paste", side + ".Mask"]
+            else:
+                values += [nnum, nets[nnum], fmt_num(crot + pad.rot - 90)]
+                if entry[1]:
+                    values += [nnum, nets[nnum], fmt_num(crot + pad.rot - 90)]
+        return template.format(*values)
+
+    def library_footprint(self, name, font, indent=2):
+        """
+        Render the shape on the front side as footprint name of a .kicad_mod file.
+        """
+        shape = self.shape
+        ref = [fmt_nm(shape.reference[0]), fmt_nm(shape.reference[1]), '0', font, '1', '1', '0.15']
+        values = ['F.Cu', 'REF**'] + ref + [name] + ref
+        for pad, entry in zip(shape.pads, self.pads):
+            if entry is None:
+                continue
+            if entry[0] == 'smd':
+                values += [fmt_num(pad.rot), 'F.Cu', 'F.Paste', 'F.Mask']
+            else:
+                values += [fmt_num(pad.rot - 90)] * (2 if entry[1] else 1)
+        return self._compile('F', name).template(indent).format(*values)
+
+def shape_hash(shape):
+    """
+    Return a hash of the geometry of a shape. The name and the pad codes are left out, pads
+    count by their resolved pad stacks, so the same footprint under different names or
+    technology tables on different boards gets the same hash.
+    """
+    h = hashlib.sha256()
+    h.update(repr((shape.reference, shape.lines, shape.arcs, shape.circles)).encode())
+    for pad in shape.pads:
+        stack = pad.stack
+        defs = [[getattr(d, key) for key in PadDef.__slots__] for d in (stack.top, stack.inner, stack.bottom)]
+        h.update(repr((pad.name, pad.rot, pad.layer, pad.x, pad.y, stack.drill, defs)).encode())
+    return h.hexdigest()
+
+class FootprintLibrary:
+    """
+    A .pretty footprint library the shapes of converted boards are added to. Footprints are
+    named after the shape they were first seen as plus the start of their geometry hash,
+    e.g. DIP14_0123456789abcdef, and found again by the hash, so every geometry is in the
+    library once, whatever the shapes are called. Footprints of the board then refer to the
+    library entries.
+
+    Files are created exclusively, so batch workers that convert the same new shape at once
+    leave a single file.
+    """
+    HASH_DIGITS = 16
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.nickname = os.path.splitext(os.path.basename(os.path.normpath(directory)))[0]
+
+    def footprint_name(self, name, digest):
+        # characters KiCad or the file system may not take become '_'
+        return (re.sub(r'[^\w.+-]+', '_', name).strip('_.') or 'shape') + '_' + digest
+
+    def footprints(self):
+        """
+        Return the footprint names in the library by geometry hash. If one geometry has
+        several names the first in sort order counts.
+        """
+        found = {}
+        for fname in sorted(os.listdir(self.directory)):
+            stem, ext = os.path.splitext(fname)
+            digest = stem.rpartition('_')[2]
+            if ext == '.kicad_mod' and len(digest) == self.HASH_DIGITS:
+                found.setdefault(digest, stem)
+        return found
+
+    def add_board(self, board, font='KiCad Font'):
+        """
+        Write the shapes of board missing in the library and point the board footprints at
+        the library, returns the number of footprints written and found in the library.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        # the library as it is now, other workers may add to it while we go
+        known = self.footprints()
+        written = found = 0
+        for name, shape in board.shapes.items():
+            if name == 'BOARD' or not shape.pads:
+                continue
+            digest = shape_hash(shape)[:self.HASH_DIGITS]
+            template = FootprintTemplate(shape)
+            fpname = known.get(digest)
+            if fpname is None:
+                fpname = self.footprint_name(name, digest)
+                created = self._create(fpname, template.library_footprint(fpname, font))
+                # another worker may have added the geometry under another name meanwhile,
+                # the first name in sort order stays and the others remove their file again
+                known = self.footprints()
+                if known[digest] != fpname:
+                    if created:
+                        os.remove(os.path.join(self.directory, fpname + '.kicad_mod'))
+                        created = False
+                    fpname = known[digest]
+                if created:
+                    written += 1
+                else:
+                    found += 1
+            else:
+                found += 1
+            template.lib_id = self.nickname + ":" + fpname
+            shape.template = template
+        return written, found
+
+    def _create(self, fpname, text):
+        # write the footprint aside and link it into place, False if it is there already
+        path = os.path.join(self.directory, fpname + '.kicad_mod')
+        tmp = path + '.{}.tmp'.format(os.getpid())
+        with open(tmp, 'w', encoding='utf-8', newline='\n') as out:
+            out.write(text + "\n")
+        try:
+            os.link(tmp, path)
+            return True
+        except FileExistsError:
+            return False
+        except OSError:
+            # no hard links on this file system, create the file exclusively instead
+            pass
+        finally:
+            os.remove(tmp)
+        try:
+            with open(path, 'x', encoding='utf-8', newline='\n') as out:
+                out.write(text + "\n")
+            return True
+        except FileExistsError:
+            return False
+
+def merge_segments(board):
+    """
+    Join collinear segments of the same layer, net and trace code that touch end to end.
+    Only ends where exactly two segments of the layer meet are joined, so branches and
+    T junctions stay as they are.
+
+    :return: Number of segments removed.
+    """
+    segs = list(board.segments)
+    key = lambda layer, x, y: (layer, x, y)
+
+    degree = {}
+    for x1, y1, x2, y2, code, layer, net in segs:
+        for k in (key(layer, x1, y1), key(layer, x2, y2)):
+            degree[k] = degree.get(k, 0) + 1
+
+    ends = {}
+    for idx, (x1, y1, x2, y2, code, layer, net) in enumerate(segs):
+        if x1 == x2 and y1 == y2:
+            continue
+        for k in (key(layer, x1, y1), key(layer, x2, y2)):
+            if degree[k] == 2:
+                ends.setdefault(k, []).append(idx)
+
+    parent = list(range(len(segs)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for k, pair in ends.items():
+        if len(pair) != 2:
+            continue
+        a, b = segs[pair[0]], segs[pair[1]]
+        if a[4:] != b[4:]:
+            continue
+        # directions pointing away from the shared point
+        px, py = k[1], k[2]
+        ax, ay = (a[2] - a[0], a[3] - a[1]) if (a[0], a[1]) == (px, py) else (a[0] - a[2], a[1] - a[3])
+        bx, by = (b[2] - b[0], b[3] - b[1]) if (b[0], b[1]) == (px, py) else (b[0] - b[2], b[1] - b[3])
+        # collinear within 2 nm of offset, every end is rounded to the nm on its own
+        cross = ax * by - ay * bx
+        if abs(cross) > 2 * max(math.hypot(ax, ay), math.hypot(bx, by)) or ax * bx + ay * by >= 0:
+            continue
+        parent[find(pair[0])] = find(pair[1])
+
+    groups = {}
+    for idx in range(len(segs)):
+        groups.setdefault(find(idx), []).append(idx)
+
+    merged = SegmentTable()
+    for idx, (x1, y1, x2, y2, code, layer, net) in enumerate(segs):
+        group = groups[find(idx)]
+        if group[0] != idx:
+            continue
+        if len(group) > 1:
+            # the run ends are the extreme points along its direction
+            dx, dy = x2 - x1, y2 - y1
+            pts = [p for i in group for p in (segs[i][0:2], segs[i][2:4])]
+            proj = [(px - x1) * dx + (py - y1) * dy for px, py in pts]
+            (x1, y1), (x2, y2) = pts[proj.index(min(proj))], pts[proj.index(max(proj))]
+        merged.append(x1, y1, x2, y2, code, layer, net)
+
+    removed = len(segs) - len(merged)
+    board.segments = merged
+    return removed
+
+def simplify_polyline(pts, tolerance):
+    """
+    Douglas-Peucker reduction of an open polyline, both end points always stay.
+
+    :param pts: [(x, y), ...]
+    :param tolerance: Largest distance a dropped point may have from the result, same unit as pts.
+    :return: List of the kept points.
+    """
+    n = len(pts)
+    if n < 3 or tolerance <= 0:
+        return list(pts)
+    if np is not None:
+        xy = np.asarray(pts, dtype=np.float64)
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        ax, ay = pts[a]
+        dx, dy = pts[b][0] - ax, pts[b][1] - ay
+        length = math.hypot(dx, dy)
+        if np is not None:
+            rx, ry = xy[a + 1:b, 0] - ax, xy[a + 1:b, 1] - ay
+            d = np.abs(dx * ry - dy * rx) / length if length else np.hypot(rx, ry)
+            i = int(np.argmax(d))
+            dmax = d[i]
+        else:
+            dmax, i = -1.0, 0
+            for k in range(a + 1, b):
+                rx, ry = pts[k][0] - ax, pts[k][1] - ay
+                dk = abs(dx * ry - dy * rx) / length if length else math.hypot(rx, ry)
+                if dk > dmax:
+                    dmax, i = dk, k - a - 1
+        if dmax > tolerance:
+            i += a + 1
+            keep[i] = True
+            stack.append((a, i))
+            stack.append((i, b))
+    return [p for p, k in zip(pts, keep) if k]
+
+def simplify_ring(pts, tolerance):
+    """
+    Douglas-Peucker reduction of a closed polygon, split at the first point and the point
+    farthest away from it. Returns the points unchanged if less than three would remain.
+    """
+    pts = list(pts)
+    if len(pts) > 1 and pts[0] == pts[-1]:
+        pts.pop()
+    if len(pts) < 4 or tolerance <= 0:
+        return pts
+    x0, y0 = pts[0]
+    far = max(range(len(pts)), key=lambda i: (pts[i][0] - x0) ** 2 + (pts[i][1] - y0) ** 2)
+    ring = simplify_polyline(pts[:far + 1], tolerance) + simplify_polyline(pts[far:] + pts[:1], tolerance)[1:-1]
+    return ring if len(ring) >= 3 else pts
+
+def simplify_outlines(board, tolerance):
+    """
+    Drop zone outline and BOARD edge points that lie within tolerance of the simplified outline.
+
+    :param tolerance: Largest deviation in mm.
+    :return: Number of points removed.
+    """
+    tolerance = tolerance * 1000000     # coordinates are nm
+    removed = 0
+    for zone in board.zones:
+        pts = simplify_ring(zone.pts, tolerance)
+        removed += len(zone.pts) - len(pts)
+        zone.pts = pts
+
+    shape = board.shapes.get('BOARD')
+    if shape is not None and shape.lines:
+        # chain the edge lines into runs of connected lines, every run is simplified on its own
+        runs = []
+        for sx, sy, ex, ey in shape.lines:
+            if runs and runs[-1][-1] == (sx, sy):
+                runs[-1].append((ex, ey))
+            else:
+                runs.append([(sx, sy), (ex, ey)])
+        lines = []
+        for run in runs:
+            run = simplify_polyline(run, tolerance)
+            lines += [(sx, sy, ex, ey) for (sx, sy), (ex, ey) in zip(run, run[1:])]
+        removed += len(shape.lines) - len(lines)
+        shape.lines = lines
+    return removed
+
+class ConnectivityReport:
+    """
+    Result of check_connectivity().
+
+    shorts: [(net name, net name, (x, y)), ...] one entry per pair of shorted nets with the
+            first place their copper touches.
+    opens:  [(net name, islands), ...] nets whose pads end up on more than one copper island.
+    """
+    def __init__(self):
+        self.items = 0
+        self.islands = 0
+        self.shorts = []
+        self.opens = []
+
+    def report(self, out=None):
+        out = out or sys.stdout
+        out.write("connectivity: {} copper items, {} islands, {} shorts, {} opens\n"\
+                    .format(self.items, self.islands, len(self.shorts), len(self.opens)))
+        for a, b, (x, y) in self.shorts:
+            out.write("  short \"{}\" - \"{}\" at {:.4f} {:.4f}\n".format(a, b, x, y))
+        for name, islands in self.opens:
+            out.write("  open  \"{}\" pads on {} islands\n".format(name, islands))
+
+def _seg_dist2(ax, ay, bx, by, cx, cy, dx, dy):
+    # squared distance between the segments AB and CD, either may be a point
+    def point_seg(px, py, x1, y1, x2, y2):
+        vx, vy = x2 - x1, y2 - y1
+        l2 = vx * vx + vy * vy
+        t = 0.0 if l2 == 0 else max(0.0, min(1.0, ((px - x1) * vx + (py - y1) * vy) / l2))
+        ex, ey = x1 + t * vx - px, y1 + t * vy - py
+        return ex * ex + ey * ey
+
+    # proper crossing
+    d1 = (dx - cx) * (ay - cy) - (dy - cy) * (ax - cx)
+    d2 = (dx - cx) * (by - cy) - (dy - cy) * (bx - cx)
+    d3 = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+    d4 = (bx - ax) * (dy - ay) - (by - ay) * (dx - ax)
+    if ((d1 > 0 > d2) or (d1 < 0 < d2)) and ((d3 > 0 > d4) or (d3 < 0 < d4)):
+        return 0.0
+    return min(point_seg(ax, ay, cx, cy, dx, dy), point_seg(bx, by, cx, cy, dx, dy),
+               point_seg(cx, cy, ax, ay, bx, by), point_seg(dx, dy, ax, ay, bx, by))
+
+def _inside(x, y, pts):
+    # even-odd point in polygon test
+    inside = False
+    px, py = pts[-1]
+    for qx, qy in pts:
+        if (qy > y) != (py > y) and x < (px - qx) * (y - qy) / (py - qy) + qx:
+            inside = not inside
+        px, py = qx, qy
+    return inside
+
+def _pad_geometry(comp, rot, x, y, w, h):
+    # a placed pad as (center x, center y, unit vector along w x, y, half w, half h)
+    cx, cy, crot = comp.pos
+    if comp.pnpairs[0][1] == 2 and comp.pnpairs[-1][1] == 2:
+        crot = crot + 180       # same as FootprintTemplate.render()
+    t = math.radians(crot)
+    wx = cx + x * math.cos(t) + y * math.sin(t)
+    wy = cy - x * math.sin(t) + y * math.cos(t)
+    a = math.radians(crot + rot)
+    return (wx, wy, math.cos(a), -math.sin(a), w / 2, h / 2)
+
+def _geometry_capsule(geo):
+    # a pad as a segment with a radius, exact for round and oblong pads, rect corners are cut
+    wx, wy, ux, uy, hu, hn = geo
+    if hu >= hn:
+        half, r = hu - hn, hn
+    else:
+        half, r, ux, uy = hn - hu, hu, -uy, ux
+    return (wx - ux * half, wy - uy * half, wx + ux * half, wy + uy * half, r)
+
+def _board_pads(board, copper):
+    """
+    Generate the copper pads of all components.
+
+    :return: Iterator of (layers, net, clearance, rounded, geometry), geometry as returned by
+             _pad_geometry() in nm, rounded when the corner radius makes the pad a capsule.
+    """
+    for comp in board.components:
+        shape = board.shapes.get(comp.shape)
+        if shape is None:
+            continue
+        for pidx, pad in enumerate(shape.pads):
+            if pidx >= len(comp.pnpairs):
+                break
+            net, setting = comp.pnpairs[pidx]
+            top = pad.stack.top
+            if pad.stack.drill == 0:
+                if top.y == 0 or top.width == 0 or setting not in copper:
+                    continue
+                offset = (top.x1 - top.x2) / 2
+                rx, ry = pad.x, pad.y
+                match pad.rot:
+                    case 0: rx -= offset
+                    case 90: ry -= offset
+                    case 180: rx += offset
+                    case 270: ry += offset
+                geo = _pad_geometry(comp, pad.rot, rx, -ry, top.width, top.y)
+                yield (setting,), net, top.clear, 2 * top.radius >= min(top.width, top.y), geo
+            else:
+                w, h = top.y, top.width
+                if pad.stack.differs:
+                    w, h = max(w, pad.stack.bottom.y), max(h, pad.stack.bottom.width)
+                geo = _pad_geometry(comp, pad.rot - 90, pad.x, -pad.y, w, h)
+                yield copper, net, top.clear, 2 * top.radius >= min(w, h), geo
+
+def _copper_items(board):
+    """
+    Collect the copper of a board as segments with a radius (pads, traces, copper arcs, vias),
+    converted from nm to mm.
+
+    :return: (copper layer numbers, [(layers, ax, ay, bx, by, radius, net, is pad, clearance), ...])
+    """
+    copper = copper_numbers(board.maxlayers)
+    items = []      # (layers, ax, ay, bx, by, radius, net, is pad, clearance)
+
+    for padlayers, net, clear, rounded, geo in _board_pads(board, copper):
+        items.append((padlayers,) + _geometry_capsule(geo) + (net, True, clear))
+
+    widths = {code: v2nm(width) for code, width in board.traceWidth.items()}
+    clears = {code: v2nm(clear) for code, clear in board.traceClearance.items()}
+    for x1, y1, x2, y2, code, layer, net in board.segments:
+        if layer in copper:
+            items.append(((layer,), x1, y1, x2, y2, widths.get(code, 0) // 2, net, False, clears.get(code, 0)))
+
+    for xs, ys, xm, ym, xe, ye, width, layer, net, code in board.arcs:
+        if layer in copper:
+            # two chords through the mid point, good enough to find what the arc touches
+            items.append(((layer,), xs, ys, xm, ym, width // 2, net, False, clears.get(code, 0)))
+            items.append(((layer,), xm, ym, xe, ye, width // 2, net, False, clears.get(code, 0)))
+
+    for x, y, code, net in board.vias:
+        top = board.padstack[code].top
+        items.append((copper, x, y, x, y, top.y // 2, net, False, top.clear))
+
+    # the checks work in mm
+    items = [(l, ax / 1e6, ay / 1e6, bx / 1e6, by / 1e6, r / 1e6, net, ispad, clear / 1e6)
+             for l, ax, ay, bx, by, r, net, ispad, clear in items]
+    return copper, items
+
+def check_connectivity(board, cell=2.54):
+    """
+    Union touching copper per layer and compare the islands against the DDF net list.
+    Pads, segments, copper arcs, vias and zones go into a uniform grid per layer, so only
+    items sharing a grid cell are tested against each other.
+
+    Net 0 (no connect) connects copper but never counts as a net of its own, an island joining
+    two nets through no connect copper is a short all the same.
+
+    :param cell: Grid cell size in mm.
+    :return: ConnectivityReport
+    """
+    copper, items = _copper_items(board)
+
+    parent = list(range(len(items) + len(board.zones)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    result = ConnectivityReport()
+    result.items = len(items)
+    shorted = {}
+
+    # the net of every island root, 0 as long as it only holds no connect copper
+    rootnet = [item[6] for item in items] + [zone.net for zone in board.zones]
+
+    def union(i, j, x, y):
+        ri, rj = find(i), find(j)
+        if ri == rj:
+            return
+        parent[ri] = rj
+        net_i, net_j = rootnet[ri], rootnet[rj]
+        if net_i and net_j and net_i != net_j:
+            pair = (min(net_i, net_j), max(net_i, net_j))
+            if pair not in shorted:
+                shorted[pair] = (x, y)
+        rootnet[rj] = net_j or net_i
+
+    # each grid cell holds its items grouped by island, so an item skips whole islands it
+    # already belongs to and stops at the first touching item of any other island
+    grid = {}
+    boxes = []
+    first = {}
+    for idx, (ilayers, ax, ay, bx, by, r, net, ispad, clear) in enumerate(items):
+        box = (min(ax, bx) - r, min(ay, by) - r, max(ax, bx) + r, max(ay, by) + r)
+        boxes.append(box)
+        # copies of the same item (stacked vias, traces drawn twice) don't need the grid
+        same = first.setdefault((ilayers, ax, ay, bx, by, r), idx)
+        if same != idx:
+            union(idx, same, ax, ay)
+            continue
+        x0, x1 = int(math.floor(box[0] / cell)), int(math.floor(box[2] / cell))
+        y0, y1 = int(math.floor(box[1] / cell)), int(math.floor(box[3] / cell))
+        for layer in ilayers:
+            for gx in range(x0, x1 + 1):
+                for gy in range(y0, y1 + 1):
+                    bucket = grid.setdefault((layer, gx, gy), {})
+                    for key in list(bucket):
+                        root = find(key)
+                        if root != key:
+                            bucket.setdefault(root, []).extend(bucket.pop(key))
+                    for root, members in list(bucket.items()):
+                        if find(root) == find(idx):
+                            continue
+                        for other in members:
+                            obox = boxes[other]
+                            if obox[0] > box[2] or obox[2] < box[0] or obox[1] > box[3] or obox[3] < box[1]:
+                                continue
+                            olayers, cx, cy, dx, dy, s, onet, opad, oclear = items[other]
+                            reach = r + s
+                            if _seg_dist2(ax, ay, bx, by, cx, cy, dx, dy) <= reach * reach + 1e-9:
+                                union(idx, other, (ax + bx) / 2, (ay + by) / 2)
+                                break
+                    bucket.setdefault(find(idx), []).append(idx)
+
+    # a zone connects the items of its own net that lie inside its outline
+    for zidx, zone in enumerate(board.zones):
+        if zone.layer not in copper or len(zone.pts) < 3:
+            continue
+        zid = len(items) + zidx
+        pts = [(x / 1e6, y / 1e6) for x, y in zone.pts]
+        xs = [x for x, y in pts]
+        ys = [y for x, y in pts]
+        seen = set()
+        for gx in range(int(math.floor(min(xs) / cell)), int(math.floor(max(xs) / cell)) + 1):
+            for gy in range(int(math.floor(min(ys) / cell)), int(math.floor(max(ys) / cell)) + 1):
+                for idx in itertools.chain.from_iterable(grid.get((zone.layer, gx, gy), {}).values()):
+                    if idx in seen:
+                        continue
+                    seen.add(idx)
+                    ilayers, ax, ay, bx, by, r, net, ispad, clear = items[idx]
+                    if net == zone.net and (_inside(ax, ay, pts) or _inside(bx, by, pts)):
+                        union(idx, zid, ax, ay)
+
+    result.islands = len({find(i) for i in range(len(items))})
+    for (a, b), at in sorted(shorted.items()):
+        result.shorts.append((board.nets.get(a, str(a)), board.nets.get(b, str(b)), at))
+
+    padislands = {}
+    for idx, (ilayers, ax, ay, bx, by, r, net, ispad, clear) in enumerate(items):
+        if ispad and net:
+            padislands.setdefault(net, set()).add(find(idx))
+    for net, roots in sorted(padislands.items()):
+        if len(roots) > 1:
+            result.opens.append((board.nets.get(net, str(net)), len(roots)))
+    return result
 
-                    # ['F.Fab','F.Cu','B.Cu','In1.Cu','In2.Cu','F.Mask','B.Mask','B.SilkS','','Cmts.User','','','']
-                    # if textl == 0:
-                    #     textl = 0 if textr > 0 else 10
+class ClearanceReport:
+    """
+    Result of check_clearance().
+
+    violations: [(net name, net name, gap, clearance, (x, y)), ...] the closest pair of copper
+                items for every pair of nets that come closer than their clearance, worst first.
+    """
+    def __init__(self):
+        self.items = 0
+        self.pairs = 0
+        self.violations = []
+
+    def report(self, out=None):
+        out = out or sys.stdout
+        out.write("clearance: {} copper items, {} item pairs too close, {} net pairs\n"\
+                    .format(self.items, self.pairs, len(self.violations)))
+        for a, b, gap, clearance, (x, y) in self.violations:
+            out.write("  \"{}\" - \"{}\" gap {:.4f} < {:.4f} at {:.4f} {:.4f}\n".format(a, b, gap, clearance, x, y))
+
+def check_clearance(board, cell=2.54):
+    """
+    Find copper of different nets closer than the DDF clearance, the larger clearance of
+    the two items counts. Pads use the clearance of their pad definition, traces the one of
+    their *TT trace code, like copper arcs. Items are hashed into a uniform grid per layer, every pair is
+    tested once in the grid cell where their padded boxes start to overlap.
+
+    Net 0 (no connect) is not checked. Arcs are tested as the two chords through their mid
+    point, which lie up to the arc sagitta inside the real arc.
+
+    :param cell: Grid cell size in mm.
+    :return: ClearanceReport
+    """
+    copper, items = _copper_items(board)
+    result = ClearanceReport()
+    result.items = len(items)
+
+    grid = {}
+    boxes = []
+    for idx, (ilayers, ax, ay, bx, by, r, net, ispad, clear) in enumerate(items):
+        reach = r + clear
+        box = (min(ax, bx) - reach, min(ay, by) - reach, max(ax, bx) + reach, max(ay, by) + reach)
+        boxes.append(box)
+        if not net:
+            continue
+        for layer in ilayers:
+            for gx in range(int(math.floor(box[0] / cell)), int(math.floor(box[2] / cell)) + 1):
+                for gy in range(int(math.floor(box[1] / cell)), int(math.floor(box[3] / cell)) + 1):
+                    grid.setdefault((layer, gx, gy), []).append(idx)
+
+    worst = {}
+    for (layer, gx, gy), bucket in grid.items():
+        for n, i in enumerate(bucket):
+            ilayers, ax, ay, bx, by, r, net, ispad, clear = items[i]
+            box = boxes[i]
+            for j in bucket[n + 1:]:
+                olayers, cx, cy, dx, dy, s, onet, opad, oclear = items[j]
+                if onet == net:
+                    continue
+                obox = boxes[j]
+                if obox[0] > box[2] or obox[2] < box[0] or obox[1] > box[3] or obox[3] < box[1]:
+                    continue
+                # only the cell holding the lower left corner of the overlap tests the pair,
+                # and only on the first layer both are on
+                if (math.floor(max(box[0], obox[0]) / cell) != gx or math.floor(max(box[1], obox[1]) / cell) != gy
+                        or layer != min(l for l in ilayers if l in olayers)):
+                    continue
+                required = max(clear, oclear)
+                gap = math.sqrt(_seg_dist2(ax, ay, bx, by, cx, cy, dx, dy)) - r - s
+                if gap < required - 1e-6:
+                    result.pairs += 1
+                    pair = (min(net, onet), max(net, onet))
+                    if pair not in worst or gap < worst[pair][0]:
+                        worst[pair] = (gap, required, ((ax + bx + cx + dx) / 4, (ay + by + cy + dy) / 4))
+
+    for (a, b), (gap, required, at) in sorted(worst.items(), key=lambda w: w[1][0] - w[1][1]):
+        result.violations.append((board.nets.get(a, str(a)), board.nets.get(b, str(b)), max(gap, 0.0), required, at))
+    return result
 
-                    reallayer = 'User.1' if (args.textsilk == True and textl == 0) else layers[textl]
+def _fill_capsules(board, copper):
+    """
+    Collect the copper the zone fill has to keep away from as capsules in nm. Rectangular pads
+    are their four edges, the interval a line cuts from one group of capsules is the hull
+    of the intervals of its members.
+
+    :return: (column arrays of (layer, ax, ay, bx, by, radius, group, net, is pad),
+              [(layers, net, geometry, group), ...] of the pads for thermal spokes)
+    """
+    # traces and vias are added as whole columns, the rest row by row
+    blocks = []
+    widths = np.zeros(1 << 16)
+    for code, width in board.traceWidth.items():
+        widths[code] = v2nm(width)
+    seg = board.segments.to_np()
+    m = np.isin(seg['layer'], copper)
+    n = int(m.sum())
+    blocks.append(np.column_stack([seg['layer'][m], seg['x1'][m], seg['y1'][m], seg['x2'][m], seg['y2'][m],
+                                   widths[seg['code'][m]] / 2, np.arange(n), seg['net'][m], np.zeros(n)]))
+    group = n
+    rows = []
+    for xs, ys, xm, ym, xe, ye, width, layer, net, code in board.arcs:
+        if layer in copper:
+            rows.append((layer, xs, ys, xm, ym, width / 2, group, net, 0))
+            rows.append((layer, xm, ym, xe, ye, width / 2, group + 1, net, 0))
+            group += 2
+    blocks.append(np.array(rows, dtype=np.float64).reshape(-1, 9))
+    via = board.vias.to_np()
+    n = len(via['x'])
+    radius = np.array([stack.top.y / 2 for stack in board.padstack])[via['code']]
+    x, y = np.repeat(via['x'], len(copper)), np.repeat(via['y'], len(copper))
+    blocks.append(np.column_stack([np.tile(copper, n), x, y, x, y, np.repeat(radius, len(copper)),
+                                   np.repeat(group + np.arange(n), len(copper)), np.repeat(via['net'], len(copper)),
+                                   np.zeros(n * len(copper))]))
+    group += n
+    rows = []
+    pads = []
+    for padlayers, net, clear, rounded, geo in _board_pads(board, copper):
+        pads.append((padlayers, net, geo, group))
+        if rounded:
+            ax, ay, bx, by, r = _geometry_capsule(geo)
+            edges = [(ax, ay, bx, by, r)]
+        else:
+            cx, cy, ux, uy, hu, hn = geo
+            corners = [(cx + ux * hu * su - uy * hn * sn, cy + uy * hu * su + ux * hn * sn)
+                       for su, sn in ((1, 1), (-1, 1), (-1, -1), (1, -1))]
+            edges = [corners[i] + corners[i - 1] + (0,) for i in range(4)]
+        for layer in padlayers:
+            rows.extend((layer,) + edge + (group, net, 1) for edge in edges)
+        group += 1
+    blocks.append(np.array(rows, dtype=np.float64).reshape(-1, 9))
+    return np.concatenate(blocks).T, pads
+
+def _line_intervals(yc, ax, ay, bx, by, r):
+    # [lo, hi] of the horizontal line y = yc inside every capsule, lo > hi if it misses
+    lo = np.full(len(ax), np.inf)
+    hi = np.full(len(ax), -np.inf)
+    for px, py in ((ax, ay), (bx, by)):
+        s2 = r * r - (yc - py) ** 2
+        m = s2 >= 0
+        s = np.sqrt(np.where(m, s2, 0))
+        lo = np.where(m, np.minimum(lo, px - s), lo)
+        hi = np.where(m, np.maximum(hi, px + s), hi)
+    # the band between the end circles, within r across and between the ends along
+    dx = bx - ax
+    dy = by - ay
+    length = np.hypot(dx, dy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ux = dx / length
+        uy = dy / length
+        d = yc - ay
+        across = np.sort(np.stack([(-r - d * ux) / -uy, (r - d * ux) / -uy]), axis=0)
+        along = np.sort(np.stack([(-d * uy) / ux, (length - d * uy) / ux]), axis=0)
+    flat = uy == 0      # horizontal, across doesn't depend on x
+    across[0] = np.where(flat, np.where(np.abs(d) <= r, -np.inf, np.inf), across[0])
+    across[1] = np.where(flat, np.where(np.abs(d) <= r, np.inf, -np.inf), across[1])
+    upright = ux == 0   # vertical, along doesn't depend on x
+    inside = (d * uy >= 0) & (d * uy <= length)
+    along[0] = np.where(upright, np.where(inside, -np.inf, np.inf), along[0])
+    along[1] = np.where(upright, np.where(inside, np.inf, -np.inf), along[1])
+    slo = ax + np.maximum(across[0], along[0])
+    shi = ax + np.minimum(across[1], along[1])
+    m = (length > 0) & (slo <= shi)
+    lo = np.where(m, np.minimum(lo, slo), lo)
+    hi = np.where(m, np.maximum(hi, shi), hi)
+    return lo, hi
+
+def _group_intervals(yc, ax, ay, bx, by, r, groups):
+    # [lo, hi] of the line y = yc inside every run of capsules with the same group, lo > hi if it misses
+    lo, hi = _line_intervals(yc, ax, ay, bx, by, r)
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    return np.minimum.reduceat(lo, starts), np.maximum.reduceat(hi, starts)
+
+def _group_extents(ay, by, r, groups):
+    # top and bottom of the group of every capsule
+    top = np.minimum(ay, by) - r
+    bottom = np.maximum(ay, by) + r
+    if not len(groups):
+        return top, bottom
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    counts = np.diff(np.r_[starts, len(groups)])
+    return (np.repeat(np.minimum.reduceat(top, starts), counts),
+            np.repeat(np.maximum.reduceat(bottom, starts), counts))
+
+def _stack_rows(rows):
+    """
+    Join the free intervals of consecutive rows into staircase polygons. An interval continues
+    the polygon above it when the two only overlap each other.
+
+    :param rows: [(y0, y1, [(x0, x1), ...]), ...] from top to bottom, intervals sorted.
+    :return: List of point lists.
+    """
+    polygons = []
+    runs = []       # [x0, x1, left points, right points] of the rows above
+    last_y = None
+
+    def close(run):
+        polygons.append(run[2] + run[3][::-1])
+
+    def extend(points, x, y0, y1):
+        if len(points) >= 2 and points[-1][0] == x and points[-2][0] == x:
+            points[-1] = (x, y1)
+        else:
+            points += [(x, y0), (x, y1)]
+
+    for y0, y1, intervals in rows:
+        if last_y != y0:
+            for run in runs:
+                close(run)
+            runs = []
+        last_y = y1
+        above = [0] * len(runs)
+        below = [0] * len(intervals)
+        pairs = []
+        i = j = 0
+        while i < len(runs) and j < len(intervals):
+            if runs[i][1] > intervals[j][0] and intervals[j][1] > runs[i][0]:
+                pairs.append((i, j))
+                above[i] += 1
+                below[j] += 1
+            if runs[i][1] < intervals[j][1]:
+                i += 1
+            else:
+                j += 1
+        continued = {}
+        for i, j in pairs:
+            if above[i] == 1 and below[j] == 1:
+                continued[j] = i
+        kept = set(continued.values())
+        for i, run in enumerate(runs):
+            if i not in kept:
+                close(run)
+        previous = runs
+        runs = []
+        for j, (x0, x1) in enumerate(intervals):
+            run = previous[continued[j]] if j in continued else [x0, x1, [], []]
+            run[0], run[1] = x0, x1
+            extend(run[2], x0, y0, y1)
+            extend(run[3], x1, y0, y1)
+            runs.append(run)
+    for run in runs:
+        close(run)
+    return polygons
+
+def _points_clear(px, py, ax, ay, bx, by, radius):
+    # True if none of the capsules comes closer to any of the points than its radius
+    vx = bx - ax
+    vy = by - ay
+    l2 = vx * vx + vy * vy
+    px = px[:, None]
+    py = py[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.clip(np.where(l2 > 0, ((px - ax) * vx + (py - ay) * vy) / l2, 0), 0, 1)
+    return bool(np.all(np.hypot(ax + t * vx - px, ay + t * vy - py) > radius))
+
+def fill_zones(board, resolution=0.05, thermal_gap=0.254, spoke_width=0.254):
+    """
+    Compute the filled area of every zone the way pcbnew would roughly do it, so the board
+    opens filled: the zone outline minus the copper of other nets grown by the zone
+    clearance, pads of the own net get a thermal gap and four spokes. Traces and vias of the
+    own net are poured over. Needs NumPy.
+
+    The fill is built from rows of resolution mm height, every row keeps half a row more
+    distance than needed, so the result never violates the clearance. Rows are joined into
+    staircase polygons stored in zone.filled.
+
+    :return: Number of filled polygons.
+    """
+    copper = copper_numbers(board.maxlayers)
+    h = resolution * 1e6
+    gap = thermal_gap * 1e6
+    spoke = spoke_width * 1e6
+    caps, pads = _fill_capsules(board, copper)
+    clayer, cax, cay, cbx, cby, cr, cgroup, cnet, cpad = caps
+    count = 0
+    for zone in board.zones:
+        zone.filled = []
+        if len(zone.pts) < 3:
+            continue
+        pts = np.array(zone.pts, dtype=np.float64)
+        zx0, zy0 = pts.min(axis=0)
+        zx1, zy1 = pts.max(axis=0)
+        same = (cnet == zone.net) & (zone.net != 0)
+        # other nets keep the clearance, own pads the thermal gap, own traces and vias are poured over
+        keep = (clayer == zone.layer) & ~(same & (cpad == 0))
+        grow = np.where(same, gap, zone.clearance)
+        r = cr + grow
+        keep &= (np.minimum(cax, cbx) - r <= zx1) & (np.maximum(cax, cbx) + r >= zx0)
+        keep &= (np.minimum(cay, cby) - r <= zy1) & (np.maximum(cay, cby) + r >= zy0)
+        ex0, ey0 = pts.T
+        ex1, ey1 = np.roll(pts, -1, axis=0).T
+        # the outline edges keep the rows inside, groups start after the copper ones
+        ax = np.concatenate([cax[keep], ex0])
+        ay = np.concatenate([cay[keep], ey0])
+        bx = np.concatenate([cbx[keep], ex1])
+        by = np.concatenate([cby[keep], ey1])
+        rr = np.concatenate([r[keep], np.zeros(len(pts))]) + h / 2
+        groups = np.concatenate([cgroup[keep], cgroup.max(initial=0) + 1 + np.arange(len(pts))])
+        top, bottom = _group_extents(ay, by, rr, groups)
+
+        rows = []
+        for k in range(int((zy1 - zy0) // h)):
+            y0 = zy0 + k * h
+            yc = y0 + h / 2
+            cross = (ey0 > yc) != (ey1 > yc)
+            xs = np.sort(ex0[cross] + (yc - ey0[cross]) * (ex1[cross] - ex0[cross]) / (ey1[cross] - ey0[cross]))
+            if len(xs) < 2:
+                continue
+            act = np.flatnonzero((top <= yc) & (bottom >= yc))
+            blocked = []
+            if len(act):
+                lo, hi = _group_intervals(yc, ax[act], ay[act], bx[act], by[act], rr[act], groups[act])
+                m = lo <= hi
+                lo, hi = lo[m], hi[m]
+                order = np.argsort(lo)
+                lo, hi = lo[order], hi[order]
+                reach = np.maximum.accumulate(hi)
+                first = np.flatnonzero(np.r_[True, lo[1:] > reach[:-1]])
+                blocked = list(zip(lo[first].tolist(), reach[np.r_[first[1:] - 1, len(lo) - 1]].tolist()))
+            free = []
+            for x0, x1 in zip(xs[0::2].tolist(), xs[1::2].tolist()):
+                for b0, b1 in blocked:
+                    if b1 <= x0 or b0 >= x1:
+                        continue
+                    if b0 - x0 >= h:
+                        free.append((x0, b0))
+                    x0 = max(x0, b1)
+                if x1 - x0 >= h:
+                    free.append((x0, x1))
+            free = [(math.ceil(x0), math.floor(x1)) for x0, x1 in free]
+            rows.append((round(y0), round(y0 + h), free))
+        zone.filled = _stack_rows(rows)
+
+        # thermal spokes of the own pads, where their end reaches the fill
+        other = keep & ~same
+        oax, oay, obx, oby, orr = cax[other], cay[other], cbx[other], cby[other], cr[other] + zone.clearance
+        thermal = keep & same
+        for padlayers, net, geo, group in pads:
+            if net != zone.net or zone.net == 0 or zone.layer not in padlayers:
+                continue
+            cx, cy, ux, uy, hu, hn = geo
+            if not (zx0 <= cx <= zx1 and zy0 <= cy <= zy1):
+                continue
+            rest = thermal & (cgroup != group)
+            for dx, dy, ext in ((ux, uy, hu), (-ux, -uy, hu), (-uy, ux, hn), (uy, -ux, hn)):
+                end = ext + gap + 2 * h
+                px, py = -dy * spoke / 2, dx * spoke / 2
+                # both edges of the spoke from the pad edge on keep the clearance to other nets
+                t = np.repeat(np.arange(ext, end + h / 4, h / 2), 2)
+                sides = np.tile([-1.0, 1.0], len(t) // 2)
+                qx = cx + dx * t + sides * px
+                qy = cy + dy * t + sides * py
+                if not _points_clear(qx, qy, oax, oay, obx, oby, orr):
+                    continue
+                # and the end lies in the zone, outside the thermal gap of other pads
+                if not all(_inside(x, y, zone.pts) for x, y in zip(qx[-2:], qy[-2:])):
+                    continue
+                if not _points_clear(qx[-2:], qy[-2:], cax[rest], cay[rest], cbx[rest], cby[rest], cr[rest] + gap):
+                    continue
+                corners = [(cx + px, cy + py), (cx + dx * end + px, cy + dy * end + py),
+                           (cx + dx * end - px, cy + dy * end - py), (cx - px, cy - py)]
+                zone.filled.append([(round(x), round(y)) for x, y in corners])
+        count += len(zone.filled)
+    return count
+
+# RGB colours of the thumbnail, copper layers by KiCad name, zones get a darker shade
+THUMBNAIL_COLOURS = {
+    'background': (0, 16, 35),
+    'F.Cu': (200, 52, 52),
+    'B.Cu': (77, 127, 196),
+    'In1.Cu': (127, 200, 127),
+    'In2.Cu': (206, 125, 44),
+    'pad': (194, 178, 72),
+    'via': (170, 170, 170),
+    'outline': (208, 210, 205),
+}
+
+def render_thumbnail(board, size=512):
+    """
+    Rasterize the copper, zones, pads, vias and board outline of a board into a small
+    preview image, at most size pixels wide and high. Needs NumPy.
+
+    Every pixel row is a scanline through all capsules of a kind at once, the same way
+    fill_zones() cuts its rows. Copper narrower than a pixel is drawn one pixel wide, zones
+    are drawn by their outline.
+
+    :return: uint8 array of (height, width, 3).
+    """
+    copper = copper_numbers(board.maxlayers)
+    caps, pads = _fill_capsules(board, copper)
+    clayer, cax, cay, cbx, cby, cr, cgroup, cnet, cpad = caps
+    vias = np.array([(x, y, board.padstack[code].top.y / 2) for x, y, code, net in board.vias], dtype=np.float64).reshape(-1, 3)
+    edges = np.array(board.shapes['BOARD'].lines if 'BOARD' in board.shapes else [], dtype=np.float64).reshape(-1, 4)
+    zones = [zone for zone in board.zones if zone.layer in copper and len(zone.pts) >= 3]
+
+    # the picture shows the outline, or everything if there is none
+    if len(edges):
+        xs, ys = edges[:, 0::2], edges[:, 1::2]
+    else:
+        xs = np.concatenate([cax - cr, cbx + cr] + [np.array(zone.pts, dtype=np.float64)[:, 0] for zone in zones])
+        ys = np.concatenate([cay - cr, cby + cr] + [np.array(zone.pts, dtype=np.float64)[:, 1] for zone in zones])
+    if not len(xs):
+        return np.zeros((1, 1, 3), np.uint8) + np.array(THUMBNAIL_COLOURS['background'], np.uint8)
+    x0, y0, x1, y1 = xs.min(), ys.min(), xs.max(), ys.max()
+    margin = 2
+    scale = max(x1 - x0, y1 - y0, 1) / (size - 2 * margin)     # nm per pixel
+    width = min(size, int(math.ceil((x1 - x0) / scale)) + 2 * margin)
+    height = min(size, int(math.ceil((y1 - y0) / scale)) + 2 * margin)
+    ox = x0 - margin * scale
+    oy = y0 - margin * scale
+
+    # what gets painted, in order: (capsules, polygon edges, colour), capsules are
+    # (ax, ay, bx, by, radius, group) with rectangular pads as groups of their edges
+    def capsules(m, r=None):
+        return (cax[m], cay[m], cbx[m], cby[m], np.maximum(cr[m] if r is None else r, scale / 2), cgroup[m])
+
+    def shade(colour):
+        return tuple(c * 3 // 5 for c in colour)
+
+    layers_up = []
+    for layer in reversed(copper):
+        colour = THUMBNAIL_COLOURS.get(layers[layer], THUMBNAIL_COLOURS['In1.Cu'])
+        outline = [zone.pts for zone in zones if zone.layer == layer]
+        if outline:
+            layers_up.append((None, outline, shade(colour)))
+        layers_up.append((capsules((clayer == layer) & (cpad == 0)), None, colour))
+    # through hole pads are in the capsules once per layer, paint them once
+    pad = cpad == 1
+    if pad.any():
+        starts = np.flatnonzero(np.r_[True, cgroup[pad][1:] != cgroup[pad][:-1]])
+        counts = np.diff(np.r_[starts, pad.sum()])
+        first = clayer[pad] == np.repeat(np.minimum.reduceat(clayer[pad], starts), counts)
+        pad[np.flatnonzero(pad)[~first]] = False
+    layers_up.append((capsules(pad), None, THUMBNAIL_COLOURS['pad']))
+    vx, vy, vr = vias.T
+    layers_up.append(((vx, vy, vx, vy, np.maximum(vr, scale / 2), np.arange(len(vx))), None, THUMBNAIL_COLOURS['via']))
+    ex0, ey0, ex1, ey1 = edges.T
+    layers_up.append(((ex0, ey0, ex1, ey1, np.full(len(ex0), scale * 0.75), np.arange(len(ex0))), None, THUMBNAIL_COLOURS['outline']))
+
+    # prepare every kind for the row loop
+    painters = []
+    for caps, polygons, colour in layers_up:
+        if caps is not None and len(caps[0]):
+            ax, ay, bx, by, r, groups = caps
+            top, bottom = _group_extents(ay, by, r, groups)
+            # the capsules under every pixel row, in their order so groups stay together
+            first = np.clip(np.ceil((top - oy) / scale - 0.5), 0, height).astype(np.int64)
+            last = np.clip(np.floor((bottom - oy) / scale - 0.5), -1, height - 1).astype(np.int64)
+            counts = np.maximum(last - first + 1, 0)
+            index = np.repeat(np.arange(len(ax)), counts)
+            rows = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            order = np.argsort(rows, kind='stable')
+            index = index[order]
+            starts = np.searchsorted(rows[order], np.arange(height + 1))
+            painters.append(('caps', (ax, ay, bx, by, r, groups, index, starts), np.array(colour, np.uint8)))
+        elif polygons is not None:
+            pts = [np.array(p, dtype=np.float64) for p in polygons]
+            e0 = np.concatenate(pts)
+            e1 = np.concatenate([np.roll(p, -1, axis=0) for p in pts])
+            ring = np.repeat(np.arange(len(pts)), [len(p) for p in pts])
+            painters.append(('poly', (e0[:, 0], e0[:, 1], e1[:, 0], e1[:, 1], ring), np.array(colour, np.uint8)))
+
+    image = np.empty((height, width, 3), np.uint8)
+    image[:] = THUMBNAIL_COLOURS['background']
+    for row in range(height):
+        yc = oy + (row + 0.5) * scale
+        for kind, cols, colour in painters:
+            if kind == 'caps':
+                ax, ay, bx, by, r, groups, index, starts = cols
+                act = index[starts[row]:starts[row + 1]]
+                if not len(act):
+                    continue
+                lo, hi = _group_intervals(yc, ax[act], ay[act], bx[act], by[act], r[act], groups[act])
+            else:
+                ax, ay, bx, by, ring = cols
+                cross = (ay > yc) != (by > yc)
+                if not cross.any():
+                    continue
+                ax, ay, bx, by, ring = ax[cross], ay[cross], bx[cross], by[cross], ring[cross]
+                x = ax + (yc - ay) * (bx - ax) / (by - ay)
+                # even-odd per ring, crossings sorted by ring and then x pair up
+                order = np.lexsort((x, ring))
+                lo, hi = x[order][0::2], x[order][1::2]
+            a = np.clip(np.ceil((lo - ox) / scale - 0.5), 0, width).astype(np.int64)
+            b = np.clip(np.floor((hi - ox) / scale - 0.5) + 1, 0, width).astype(np.int64)
+            m = a < b
+            cover = np.cumsum(np.bincount(a[m], minlength=width + 1) - np.bincount(b[m], minlength=width + 1))[:width]
+            image[row, cover > 0] = colour
+    return image
+
+def write_png(path, image):
+    """
+    Write an RGB uint8 array of (height, width, 3) as a PNG file, compressed with zlib.
+    """
+    height, width = image.shape[:2]
+    raw = np.concatenate([np.zeros((height, 1), np.uint8), image.reshape(height, width * 3)], axis=1)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+
+class ChunkWriter:
+    """
+    Collects output strings and hands them to the stream in large chunks instead of one
+    write() per record. With an encoding the stream is expected to be binary and gets
+    the encoded bytes.
+    """
+    def __init__(self, stream, chunk_size=1 << 20, encoding=None):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self.parts = []
+        self.size = 0
+
+    def write(self, s):
+        self.parts.append(s)
+        self.size += len(s)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def write_records(self, records, batch=4096):
+        """
+        Write an iterable of formatted record strings, joined batch by batch.
+        """
+        records = iter(records)
+        while True:
+            data = "".join(itertools.islice(records, batch))
+            if not data:
+                break
+            self.write(data)
+
+    def flush(self):
+        if self.parts:
+            data = "".join(self.parts)
+            self.stream.write(data.encode(self.encoding) if self.encoding else data)
+            self.parts = []
+            self.size = 0
+
+@functools.lru_cache(maxsize=None)
+def board_templates(indent=None):
+    """
+    Compiled templates of the records at board level, one line each unless pretty-printed
+    with indent. Footprints get theirs from FootprintTemplate.
+    """
+    S = SExpression
+    value = Slot()
+    text = Slot(quoted=True)
+    nodes = {
+        'net': S('net', value, text),
+        'edge': S('gr_line', S('start', value, value), S('end', value, value), S('width', '0.1'), S('layer', quote("Edge.Cuts"))),
+        'segment': S('segment', S('start', value, value), S('end', value, value), S('width', value), S('layer', text), S('net', value)),
+        'arc': S('gr_arc', S('start', value, value), S('mid', value, value), S('end', value, value), S('width', value), S('layer', text)),
+        'zone': S('zone', S('net', value), S('net_name', text), S('layer', text),
+                  S('fill', 'yes', S('thermal_gap', '0.254'), S('thermal_bridge_width', '0.254')),
+                  S('connect_pads', S('clearance', value)),
+                  S('polygon', S('pts', Slot(nodes=True))), Slot(nodes=True)),
+        'via': S('via', S('at', value, value), S('size', value), S('drill', value), S('layers', quote("F.Cu"), quote("B.Cu")), S('net', value)),
+        'text': S('gr_text', text, S('at', value, value, value), S('layer', text),
+                  S('effects', S('font', S('face', text), S('size', value, value), S('thickness', value)))),
+    }
+    nodes['text_mirror'] = S('gr_text', *nodes['text'].values[:-1], S('effects', *nodes['text'].values[-1].values, S('justify', 'mirror')))
+    templates = {name: '  ' + node.template(indent, 1) + '\n' for name, node in nodes.items()}
+    # zone points go into the pts of the zone, four levels down, the same for filled polygons
+    templates['xy'] = SExpression.separator(indent, 4) + S('xy', value, value).template(indent, 4)
+    templates['filled'] = SExpression.separator(indent, 2) + S('filled_polygon', S('layer', text), S('pts', Slot(nodes=True))).template(indent, 2)
+    return templates
+
+def format_segments(cols, widths, indent=None):
+    """
+    Return the segment records of a slice of the segment table as one string.
+
+    :param cols: Columns in SegmentTable.columns order, see SegmentTable.slice().
+    :param widths: Formatted width per trace code.
+    """
+    tstr = board_templates(indent)['segment'].format
+    return "".join([tstr(fmt_nm(x1), fmt_nm(y1), fmt_nm(x2), fmt_nm(y2), widths[code], layers[layer], netnr) for x1, y1, x2, y2, code, layer, netnr in zip(*cols)])
+
+def format_zones(zones, nets, indent=None):
+    """
+    Return the zone records of a list of zones as one string.
+    """
+    templates = board_templates(indent)
+    xy = templates['xy'].format
+    parts = []
+    for zone in zones:
+        pts = "".join([xy(fmt_nm(x), fmt_nm(y)) for x, y in zone.pts])
+        filled = "".join([templates['filled'].format(layers[zone.layer], "".join([xy(fmt_nm(x), fmt_nm(y)) for x, y in poly]))
+                          for poly in zone.filled])
+        parts.append(templates['zone'].format(zone.net, nets[zone.net], layers[zone.layer], fmt_nm(zone.clearance), pts, filled))
+    return "".join(parts)
+
+# segments and zone points per chunk of output formatted at once, also per worker task
+FORMAT_ROWS = 50000
+
+def write_kicad(board, kicad, font='KiCad Font', textsilk=False, chunk_size=1 << 20, encoding=None, stats=None, pool=None, indent=None):
+    """
+    Write a parsed Board as a .kicad_pcb file.
+
+    :param board: The Board returned by parse_ddf().
+    :param kicad: Text stream to write to, or a binary stream if encoding is given.
+    :param font: Font face used for component references and free text.
+    :param textsilk: Put freestanding silk text onto User.1 instead of the reference layer.
+    :param chunk_size: Number of characters collected before they are written to the stream.
+    :param encoding: Encode the output and write bytes, e.g. 'utf-8'.
+    :param stats: Stats object to count objects and write time per record type in.
+    :param pool: concurrent.futures executor, segments and zones are then formatted in
+                 chunks by its workers and written in order.
+    :param indent: Pretty-print records over several lines, indented by this many spaces
+                   per level.
+    """
+    clock = time.perf_counter
+    last = [clock()]
+    def lap(kind, objects):
+        if stats is not None:
+            now = clock()
+            stats.wrote(kind, objects, now - last[0])
+            last[0] = now
+
+    out = ChunkWriter(kicad, chunk_size, encoding)
+    innerl = ""
+    for l in range(1,board.maxlayers-1):
+        innerl += "({c} \"In{l}.Cu\" signal)\n".format(c=l,l=l)
+
+    out.write(header.format(inner_layers=innerl, papersize=board.papersize))
+    lap('*P', 0)
+    templates = board_templates(indent)
+    nstr = templates['net'].format
+    out.write(nstr(0, ""))     #Empty Net
+    out.write_records(nstr(ncount, name) for ncount, name in board.nets.items() if ncount != 0)
+    lap('*N', len(board.nets) - 1)
+
+    # handle complex board outline
+    if 'BOARD' in board.shapes:
+        estr = templates['edge'].format
+        out.write_records(estr(fmt_nm(sx), fmt_nm(sy), fmt_nm(ex), fmt_nm(ey)) for sx, sy, ex, ey in board.shapes['BOARD'].lines)
+        lap('*S', len(board.shapes['BOARD'].lines))
+
+    for comp in board.components:
+        shape = board.shapes[comp.shape]
+        if shape.template is None:
+            shape.template = FootprintTemplate(shape)
+        out.write("  " + shape.template.render(comp, board.nets, font, indent) + "\n")
+    lap('*C', len(board.components))
+
+    def formatted(func, parts, *args):
+        # results of func(part, *args) in order, with a pool up to 16 parts are worked on ahead
+        if pool is None:
+            for part in parts:
+                yield func(part, *args)
+            return
+        ahead = collections.deque()
+        for part in parts:
+            ahead.append(pool.submit(func, part, *args))
+            if len(ahead) >= 16:
+                yield ahead.popleft().result()
+        while ahead:
+            yield ahead.popleft().result()
+
+    widths = {code: fmt_nm(v2nm(width)) for code, width in board.traceWidth.items()}
+    parts = (board.segments.slice(i, i + FORMAT_ROWS) for i in range(0, len(board.segments), FORMAT_ROWS))
+    for text in formatted(format_segments, parts, widths, indent):
+        out.write(text)
+    lap('*LT', len(board.segments))
+
+    astr = templates['arc'].format
+    out.write_records(astr(fmt_nm(xs), fmt_nm(ys), fmt_nm(xm), fmt_nm(ym), fmt_nm(xe), fmt_nm(ye), fmt_nm(width), layers[layer]) for xs, ys, xm, ym, xe, ye, width, layer, net, code in board.arcs)
+    lap('*LA', len(board.arcs))
+
+    parts = []
+    size = 0
+    for zone in board.zones:
+        if not parts or size >= FORMAT_ROWS:
+            parts.append([])
+            size = 0
+        parts[-1].append(zone)
+        size += len(zone.pts)
+    for text in formatted(format_zones, parts, board.nets, indent):
+        out.write(text)
+    lap('*LP', len(board.zones))
+
+    vstr = templates['via'].format
+    out.write_records(vstr(fmt_nm(x), fmt_nm(y), fmt_nm(board.padstack[code].top.y), fmt_nm(board.padstack[code].drill), netnr) for x, y, code, netnr in board.vias)
+    lap('*V', len(board.vias))
+
+    for text in board.texts:
+        if text.layer == 2 or text.layer == 4:
+            thetext = templates['text_mirror']
+        else:
+            thetext = templates['text']
+
+        # ['F.Fab','F.Cu','B.Cu','In1.Cu','In2.Cu','F.Mask','B.Mask','B.SilkS','','Cmts.User','','','']
+        reallayer = 'User.1' if (textsilk == True and text.layer == 0) else layers[text.layer]
+
+        out.write(thetext.format(text.text, fmt_nm(text.x), fmt_nm(text.y), fmt_num(text.rot), reallayer, font, fmt_nm(text.height), fmt_nm(text.width), fmt_nm(text.thickness)))
+
+    out.write(')')
+    out.flush()
+    lap('*X', len(board.texts))
+
+def convert(infile, outfile, merge=False, simplify=0, fill=0, stats=None, layers=None, nets=None, region=None, jobs=None, cache=None, library=None, thumbnail=None, thumbnail_size=512, log=None, **options):
+    """
+    Convert a single DDF file to a UTF-8 .kicad_pcb file, returns the parsed Board.
+    Either file name can be '-' for stdin/stdout, messages then go to stderr.
+
+    :param merge: Join collinear touching segments before writing.
+    :param simplify: Tolerance in mm for reducing zone and board edge outlines, 0 keeps all points.
+    :param fill: Write zones filled, computed in rows of this height in mm, 0 leaves the filling to KiCad.
+    :param stats: Stats object filled in by parsing and writing.
+    :param layers: Only convert objects on this set of KiCad layer names.
+    :param nets: Only convert objects of this set of net names.
+    :param region: Only convert objects overlapping (x0, y0, x1, y1) in KiCad mm.
+    :param jobs: Parse and format traces and polygons with this many worker processes.
+    :param cache: BoardCache to take the parsed board from or to add it to, not used with
+                  the filters.
+    :param library: FootprintLibrary to add the shapes to, the footprints then refer to it.
+    :param thumbnail: Also write a PNG preview of the board to this file, needs NumPy.
+    :param thumbnail_size: Width and height of the preview at most, in pixels.
+    :param log: Text stream for messages, defaults to stdout, or stderr when writing to stdout.
+    :param options: Passed on to write_kicad().
+    """
+    msg = log if log is not None else sys.stderr if outfile == '-' else sys.stdout
+    with contextlib.ExitStack() as stack:
+        pool = None
+        if jobs is not None and jobs > 1:
+            pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=jobs))
+        if layers is None and nets is None and region is None:
+            if cache is not None:
+                board = _parse_cached(infile, cache, stats, pool)
+            elif infile == '-' and pool is not None:
+                board = parse_ddf(sys.stdin.buffer.read(), stats=stats, pool=pool)
+            else:
+                board = parse_ddf(sys.stdin.buffer if infile == '-' else infile, stats=stats, pool=pool)
+        else:
+            board = _parse_selected(infile, msg, stats, layers, nets, region, pool)
+        if merge:
+            print("merged away {} collinear segments".format(merge_segments(board)), file=msg)
+        if simplify:
+            print("simplified away {} outline points".format(simplify_outlines(board, simplify)), file=msg)
+        if fill:
+            print("filled {} zones with {} polygons".format(len(board.zones), fill_zones(board, fill)), file=msg)
+        if library is not None:
+            written, found = library.add_board(board, options.get('font', 'KiCad Font'))
+            print("library {}: {} footprints written, {} already there".format(library.directory, written, found), file=msg)
+        if thumbnail is not None:
+            image = render_thumbnail(board, thumbnail_size)
+            write_png(thumbnail, image)
+            print("thumbnail {}x{} written to {}".format(image.shape[1], image.shape[0], thumbnail), file=msg)
+        if outfile == '-':
+            sys.stdout.flush()
+            write_kicad(board, sys.stdout.buffer, encoding='utf-8', stats=stats, pool=pool, **options)
+            sys.stdout.buffer.flush()
+        else:
+            with open(outfile, 'wb') as kicad:
+                write_kicad(board, kicad, encoding='utf-8', stats=stats, pool=pool, **options)
+    return board
+
+def _parse_cached(infile, cache, stats, pool):
+    # the hash needs all of the input, so stdin gets read first as well
+    with contextlib.ExitStack() as stack:
+        if infile == '-':
+            data = sys.stdin.buffer.read()
+        else:
+            data = map_ddf(stack.enter_context(open(infile, 'rb')))
+            if isinstance(data, mmap.mmap):
+                stack.callback(data.close)
+        key = cache.key(data)
+        board = cache.load(key, stats)
+        if board is not None:
+            if stats is not None:
+                stats.count_objects(board)
+            board.note("parsed board taken from the cache")
+            return board
+        # the record counts are stored with the board for --stats on later runs
+        parsed = stats if stats is not None else Stats()
+        board = parse_ddf(data, stats=parsed, pool=pool)
+    cache.store(key, board, parsed.records)
+    return board
+
+def _parse_selected(infile, msg, stats, layers, nets, region, pool=None):
+    # parse only the records the index selects, stdin can't have a cached index
+    with contextlib.ExitStack() as stack:
+        if infile == '-':
+            data = sys.stdin.buffer.read()
+            index = RecordIndex.build(data)
+        else:
+            data = map_ddf(stack.enter_context(open(infile, 'rb')))
+            if isinstance(data, mmap.mmap):
+                stack.callback(data.close)
+            index = RecordIndex.for_file(infile, data)
+        if nets is not None:
+            missing = index.net_numbers(data, nets)[1]
+            if missing:
+                print("no such net: " + ", ".join(sorted(missing)), file=msg)
+        spans = index.select(data, layers, nets, region)
+        print("selected {} of {} records".format(len(spans), len(index)), file=msg)
+        board = parse_ddf(data, stats=stats, spans=spans, pool=pool)
+    filter_board(board, layers, nets, region)
+    return board
+
+@functools.lru_cache(maxsize=None)
+def converter_version():
+    # any change to the converter invalidates cached boards
+    with open(os.path.abspath(__file__), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+class _BoardUnpickler(pickle.Unpickler):
+    # boards pickled by the script run as __main__ and by the imported module are the same
+    def find_class(self, module, name):
+        if module in ('__main__', __name__):
+            return globals()[name]
+        return super().find_class(module, name)
+
+class BoardCache:
+    """
+    Parsed boards on disk, keyed by the hash of the DDF contents and the converter version,
+    so a board converted again with other output options skips parsing.
+
+    A cache file holds the segment and via columns as raw arrays at 8 byte aligned offsets,
+    described by a JSON header together with the record counts of the parse, and the rest
+    of the board pickled. When the cache grows
+    beyond max_bytes the least recently used boards are removed.
+    """
+    magic = b'U2KBOARD'
+    tables = ('segments', 'vias')
+
+    def __init__(self, directory=None, max_bytes=1 << 30):
+        if directory is None:
+            base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+            directory = os.path.join(base, 'ulti2kicad')
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, data):
+        h = hashlib.sha256(data)
+        h.update(converter_version().encode('ascii'))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.board')
+
+    def load(self, key, stats=None):
+        """
+        Return the cached Board for key, or None if there is none or it can't be read.
 
-                    thetext = "  (gr_text \"{tstr}\" (at {x} {y} {r}) (layer \"{tl}\") (effects (font (face \"{font}\") (size {fh} {fw}) (thickness {thick})) {j}))\n"
-                    kicad.write(thetext.format(tstr = textstr, x = textx, y = texty, r = textr, tl = reallayer, fw = textw, fh = texth, thick = textt, j = textj, font=args.font))
-                    # print(textstr, textl, args.textsilk)
-                # case _:
-                #     print(line[1])
+        :param stats: Stats to add the stored record counts and bytes to, parse times are
+                      left at 0 as nothing gets parsed.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:8] != self.magic:
+                    return None
+                size, = struct.unpack('<I', data[8:12])
+                head = json.loads(data[12:12 + size])
+                if head['key'] != key:
+                    return None
+                offset, size = head['board']
+                board = _BoardUnpickler(io.BytesIO(data[offset:offset + size])).load()
+                for name, column, typecode, offset, count in head['arrays']:
+                    col = arr.array(typecode)
+                    col.frombytes(data[offset:offset + count * col.itemsize])
+                    setattr(getattr(board, name), column, col)
+            os.utime(path)      # recently used
+        except (OSError, ValueError, KeyError, struct.error, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        if stats is not None:
+            if 'records' in head:
+                stats.merge({kind: (count, nbytes, 0, 0.0) for kind, (count, nbytes) in head['records'].items()})
+            else:
+                board.note("record statistics are not in the cache")
+        return board
 
-        # kicad.write(line)
-    # import json
-    # print(json.dumps(nets, indent=4))
-    # print(nets)
-    kicad.write(')')
-    kicad.close()
-    ddf.close()
+    def store(self, key, board, records=None):
+        """
+        Save a board under key and evict old boards, a cache that can't be written is
+        silently skipped.
 
+        :param records: Stats.records of the parse, their counts and bytes are kept.
+        """
+        tables = {name: getattr(board, name) for name in self.tables}
+        for name, table in tables.items():
+            setattr(board, name, type(table)())
+        try:
+            blob = pickle.dumps(board, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            for name, table in tables.items():
+                setattr(board, name, table)
+
+        columns = [(name, column, getattr(table, column)) for name, table in tables.items() for column in table.columns]
+        # the header holds its own offsets, reserve room for them first
+        head = {'key': key, 'version': converter_version(), 'board': [0, len(blob)],
+                'arrays': [[name, column, col.typecode, 0, len(col)] for name, column, col in columns]}
+        if records is not None:
+            head['records'] = {kind: entry[:2] for kind, entry in records.items()}
+        start = 12 + len(json.dumps(head)) + 32 * (len(columns) + 1)
+        offset = start
+        for entry, (name, column, col) in zip(head['arrays'], columns):
+            offset = (offset + 7) & ~7
+            entry[3] = offset
+            offset += len(col) * col.itemsize
+        head['board'][0] = offset
+        text = json.dumps(head).encode('ascii')
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = self.path(key) + '.{}.tmp'.format(os.getpid())
+            with open(tmp, 'wb') as f:
+                f.write(self.magic + struct.pack('<I', len(text)) + text)
+                f.write(bytes(start - 12 - len(text)))
+                for entry, (name, column, col) in zip(head['arrays'], columns):
+                    f.write(bytes(entry[3] - f.tell()))
+                    col.tofile(f)
+                f.write(blob)
+            os.replace(tmp, self.path(key))
+            self.evict()
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Remove the least recently used boards until the cache fits into max_bytes.
+        """
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.board'):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+def find_ddf_files(indir):
+    """
+    Return all DDF files below indir, sorted.
+    """
+    found = []
+    for root, dirs, files in os.walk(indir):
+        for fname in files:
+            if fname.lower().endswith('.ddf'):
+                found.append(os.path.join(root, fname))
+    return sorted(found)
+
+def _batch_job(infile, outfile, options):
+    # runs inside a worker process, errors, messages and the --stats report are sent back instead of printed
+    options = dict(options)
+    stats = Stats() if options.pop('stats', False) else None
+    check = options.pop('check', False)
+    clearance = options.pop('clearance', False)
+    if options.get('thumbnail') is not None:
+        options['thumbnail'] = os.path.splitext(outfile)[0] + '.png'
+    buf = io.StringIO()
+    try:
+        os.makedirs(os.path.dirname(outfile) or '.', exist_ok=True)
+        board = convert(infile, outfile, stats=stats, log=buf, **options)
+        if stats is not None:
+            stats.report(board, buf)
+        if check:
+            check_connectivity(board).report(buf)
+        if clearance:
+            check_clearance(board).report(buf)
+        return (infile, outfile, True, '', buf.getvalue())
+    except Exception as e:
+        return (infile, outfile, False, "{}: {}".format(type(e).__name__, e), buf.getvalue())
+
+def convert_batch(indir, outdir, jobs=None, **options):
+    """
+    Convert every DDF file below indir into the same tree below outdir using a process pool.
+
+    :param jobs: Number of worker processes, defaults to the number of cores.
+    :param options: Passed on to convert() for every file, stats=True, check=True and
+                    clearance=True print the statistics, connectivity and clearance reports per file.
+    :return: List of (infile, outfile, ok, error) tuples in input file order.
+    """
+    work = []
+    for infile in find_ddf_files(indir):
+        rel = os.path.splitext(os.path.relpath(infile, indir))[0]
+        work.append((infile, os.path.join(outdir, rel + '.kicad_pcb')))
+
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_batch_job, infile, outfile, options) for infile, outfile in work]
+        for future in concurrent.futures.as_completed(futures):
+            infile, outfile, ok, error, report = future.result()
+            results[infile] = (infile, outfile, ok, error)
+            if ok:
+                print("ok     {} -> {}".format(infile, outfile))
+            else:
+                print("FAILED {}: {}".format(infile, error))
+            if report:
+                print(report, end='')
+    return [results[infile] for infile, outfile in work]
+
+# catalog columns after path, size and mtime_ns, with their SQLite types
+CATALOG_COLUMNS = (('name', 'TEXT'), ('layers', 'INTEGER'), ('width_mm', 'REAL'), ('height_mm', 'REAL'),
+                   ('records', 'INTEGER'), ('shapes', 'INTEGER'), ('components', 'INTEGER'), ('nets', 'INTEGER'),
+                   ('traces', 'INTEGER'), ('vias', 'INTEGER'), ('zones', 'INTEGER'), ('error', 'TEXT'))
+
+# a line of a *LT or *V block with a row on it
+CATALOG_ROW = re.compile(rb'(?m)^[ \t]*\S')
+
+def scan_header(path):
+    """
+    Read the *P header of a DDF file and count its records without parsing them. Traces and
+    vias are counted per row of their *LT and *V blocks the way the parser reads them, up to
+    the ';' that ends the block and without empty lines. The file is memory-mapped, so only
+    the pages the scan touches are read.
+
+    :return: dict of the CATALOG_COLUMNS.
+    """
+    with open(path, 'rb') as f:
+        data = map_ddf(f)
+    try:
+        if data[:2] != b'*P':
+            raise ValueError("no *P header")
+        line, body = split_record(data[:data.find(b'\n*') + 1 or len(data)])
+        outline = [int(i) for i in body.splitlines()[1].strip()[:-1].split(b',')]
+        counts = collections.Counter()
+        rows = collections.Counter()
+        for start, length in record_spans(data):
+            kind = data[start + 1:start + 3 if data[start + 1:start + 2] == b'L' else start + 2]
+            counts[kind] += 1
+            if kind in (b'LT', b'V'):
+                end = start + length
+                first = data.find(b'\n', start, end)
+                if first >= 0:
+                    semi = data.find(b';', first, end)
+                    rows[kind] += len(CATALOG_ROW.findall(data, first + 1, semi if semi >= 0 else end))
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+    return {
+        'name': line[2:].strip().decode('cp850'),
+        'layers': outline[-1],
+        'width_mm': round((outline[2] - outline[0]) * 127 / 6000, 3),
+        'height_mm': round((outline[3] - outline[1]) * 127 / 6000, 3),
+        'records': sum(counts.values()),
+        'shapes': counts[b'S'],
+        'components': counts[b'C'],
+        'nets': counts[b'N'],
+        'traces': rows[b'LT'],
+        'vias': rows[b'V'],
+        'zones': counts[b'LP'],
+        'error': None,
+    }
+
+def _catalog_job(path):
+    # runs inside a worker process, errors are stored in the catalog instead of raised
+    try:
+        return path, scan_header(path)
+    except Exception as e:
+        return path, {'error': "{}: {}".format(type(e).__name__, e)}
+
+def catalog(indir, dbfile, jobs=None):
+    """
+    Add every DDF file below indir to the SQLite catalog dbfile, or update it. Files are
+    scanned in parallel with scan_header(), unchanged ones (same size and mtime) are kept
+    and those gone from indir removed.
+
+    :param jobs: Number of worker processes, defaults to the number of cores.
+    :return: (scanned, unchanged, removed) numbers of files.
+    """
+    db = sqlite3.connect(dbfile)
+    try:
+        columns = ", ".join("{} {}".format(name, kind) for name, kind in CATALOG_COLUMNS)
+        db.execute("CREATE TABLE IF NOT EXISTS boards (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, {})".format(columns))
+        top = os.path.join(os.path.abspath(indir), '')
+        known = {path: (size, mtime) for path, size, mtime in
+                 db.execute("SELECT path, size, mtime_ns FROM boards WHERE substr(path, 1, ?) = ?", (len(top), top))}
+        work = {}
+        for path in find_ddf_files(indir):
+            path = os.path.abspath(path)
+            st = os.stat(path)
+            work[path] = (st.st_size, st.st_mtime_ns)
+        gone = [(path,) for path in known if path not in work]
+        todo = [path for path, key in work.items() if known.get(path) != key]
+
+        sql = "INSERT OR REPLACE INTO boards VALUES ({})".format(", ".join("?" * (3 + len(CATALOG_COLUMNS))))
+        with db:
+            db.executemany("DELETE FROM boards WHERE path = ?", gone)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+                for path, info in pool.map(_catalog_job, todo, chunksize=16):
+                    db.execute(sql, (path, *work[path], *(info.get(name) for name, kind in CATALOG_COLUMNS)))
+                    if info['error'] is not None:
+                        print("FAILED {}: {}".format(path, info['error']))
+        return len(todo), len(work) - len(todo), len(gone)
+    finally:
+        db.close()
+
+def catalog_main(argv):
+    parser = argparse.ArgumentParser(prog='ulti2kicad.py catalog', description='Index the headers and record counts of all DDF files below a directory in an SQLite database.')
+    parser.add_argument('indir', help='directory searched for DDF files')
+    parser.add_argument('dbfile', help='SQLite database, created if missing and updated otherwise')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes, defaults to the number of cores')
+    parser.add_argument('-w', '--where', default=None, metavar='SQL', help='afterwards list the boards matching this condition, e.g. "layers >= 4 and width_mm < 100"')
+
+    args = parser.parse_args(argv)
+    scanned, unchanged, removed = catalog(args.indir, args.dbfile, args.jobs)
+    print("{} scanned, {} unchanged, {} removed".format(scanned, unchanged, removed))
+    if args.where is not None:
+        db = sqlite3.connect(args.dbfile)
+        try:
+            for path, layers, width, height, components in db.execute(
+                    "SELECT path, layers, width_mm, height_mm, components FROM boards WHERE {} ORDER BY path".format(args.where)):
+                print("{}  {} layers  {} x {} mm  {} components".format(path, layers, width, height, components))
+        except sqlite3.Error as e:
+            parser.error("--where: {}".format(e))
+        finally:
+            db.close()
+    return 0
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['catalog']:
+        return catalog_main(argv[1:])
+    parser = argparse.ArgumentParser(description='Convert PCB board files in UltiBoard 4.x format to KiCad pcb format.')
+    parser.add_argument('infile', help='input file, - for stdin (input directory with --batch)',)
+    parser.add_argument('outfile', help='output file, - for stdout (output directory with --batch)')
+    parser.add_argument('-b', '--batch', action='store_true', default=False, help='convert every DDF file below infile into the same tree below outfile')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes, for --batch defaults to the number of cores, a single board is split up from 2 on')
+    parser.add_argument('-f', '--font', default='KiCad Font', help='use a different font, mono spaced fonts work best')
+    parser.add_argument('-ts', '--textsilk', action='store_true', default=False, help='put freestanding silk text unto the front silk layer instead of the reference layer')
+    parser.add_argument('-m', '--merge', action='store_true', default=False, help='join collinear touching trace segments of the same width, layer and net')
+    parser.add_argument('-sp', '--simplify', type=float, default=0, metavar='TOLERANCE', help='drop zone and board edge points within TOLERANCE mm of the simplified outline')
+    parser.add_argument('-fz', '--fill', action='store_true', default=False, help='write zones already filled, needs NumPy')
+    parser.add_argument('--fill-resolution', type=float, default=0.05, metavar='MM', help='height of the rows --fill computes zones in, default 0.05')
+    parser.add_argument('-ly', '--layers', default=None, help='only convert objects on these comma separated KiCad layers or DDF layer numbers, Edge.Cuts for the board outline')
+    parser.add_argument('-n', '--nets', default=None, help='only convert objects of these comma separated nets')
+    parser.add_argument('-r', '--region', default=None, metavar='X0,Y0,X1,Y1', help='only convert objects overlapping this rectangle in KiCad mm')
+    parser.add_argument('-ca', '--cache', action='store_true', default=False, help='keep parsed boards in the cache directory and reuse them for unchanged files')
+    parser.add_argument('--cache-dir', default=None, metavar='DIR', help='cache directory for --cache, default ~/.cache/ulti2kicad')
+    parser.add_argument('--cache-size', type=int, default=1024, metavar='MB', help='remove the least recently used boards beyond this cache size, default 1024')
+    parser.add_argument('-lib', '--library', default=None, metavar='DIR', help='also write every shape as a footprint to the .pretty library DIR, the same geometry only once')
+    parser.add_argument('-th', '--thumbnail', default=None, metavar='PNG', help='also write a preview image of the copper and outline, with --batch next to every output file, needs NumPy')
+    parser.add_argument('--thumbnail-size', type=int, default=512, metavar='PX', help='largest width and height of the preview, default 512')
+    parser.add_argument('-pp', '--pretty', action='store_true', default=False, help='write records over several indented lines instead of one line each')
+    parser.add_argument('-cs', '--chunk-size', type=int, default=1 << 20, help='characters of output collected before each write, default 1048576')
+    parser.add_argument('-s', '--stats', action='store_true', default=False, help='print records, bytes, objects and parse/write time per record type plus diagnostics')
+    parser.add_argument('-c', '--check', action='store_true', default=False, help='check that the copper connects the pads of every net without shorts between nets')
+    parser.add_argument('-cl', '--clearance', action='store_true', default=False, help='report copper of different nets closer than the DDF clearance')
+
+    args = parser.parse_args(argv)
+    # print(args)
+    options = {'font': args.font, 'textsilk': args.textsilk, 'chunk_size': args.chunk_size, 'merge': args.merge, 'simplify': args.simplify, 'fill': args.fill_resolution if args.fill else 0}
+    if args.fill and np is None:
+        parser.error("--fill needs NumPy")
+    if args.fill_resolution <= 0:
+        parser.error("--fill-resolution must be positive")
+    if args.thumbnail is not None:
+        if np is None:
+            parser.error("--thumbnail needs NumPy")
+        options['thumbnail'] = args.thumbnail
+        options['thumbnail_size'] = args.thumbnail_size
+    try:
+        if args.layers is not None:
+            options['layers'] = parse_layer_names(args.layers)
+        if args.region is not None:
+            options['region'] = parse_region(args.region)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.nets is not None:
+        options['nets'] = {name.strip() for name in args.nets.split(',')}
+    if args.pretty:
+        options['indent'] = 2
+    if args.library is not None:
+        options['library'] = FootprintLibrary(args.library)
+    if args.cache:
+        options['cache'] = BoardCache(args.cache_dir, args.cache_size << 20)
+    if args.batch:
+        if '-' in (args.infile, args.outfile):
+            parser.error("--batch needs directories, not -")
+        results = convert_batch(args.infile, args.outfile, jobs=args.jobs, stats=args.stats, check=args.check, clearance=args.clearance, **options)
+        failed = [r for r in results if not r[2]]
+        print("{} converted, {} failed".format(len(results) - len(failed), len(failed)))
+        for infile, outfile, ok, error in failed:
+            print("  {}: {}".format(infile, error))
+        return 1 if failed else 0
+
+    stats = Stats() if args.stats else None
+    board = convert(args.infile, args.outfile, stats=stats, jobs=args.jobs, **options)
+    msg = sys.stderr if args.outfile == '-' else sys.stdout
+    if stats is not None:
+        stats.report(board, msg)
+    if args.check:
+        check_connectivity(board).report(msg)
+    if args.clearance:
+        check_clearance(board).report(msg)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())